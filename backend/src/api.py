@@ -1,23 +1,69 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, HttpUrl, validator
 from typing import List, Optional, Dict, Any
-from city_garden.graph_builder import build_garden_graph
+import city_garden.llm
+from city_garden.city_garden_nodes import plant_images_refinement_key
+from city_garden.graph_builder import build_garden_graph, plan_progress, replan_garden, resume_garden
 from city_garden.garden_state import GardenState
+from city_garden.services.asset_store import get_asset_store
 from city_garden.services.image_loader import AzureImageLoader
+from city_garden.services.blob_arena import get_blob_arenas
+from city_garden.services.cache_backend import get_cache
+from city_garden.services.checkpoint_store import SQLiteCheckpointSaver, create_checkpointer
 from city_garden.services.content_safety import ContentAnalyzer
+from city_garden.services.image_cache import get_image_cache
+from city_garden.services.image_dedup import collapse_near_duplicates
+from city_garden.services.image_prescreen import RequestPrescreen, get_image_prescreener
+from city_garden.services.image_upload import UploadRejected, UploadTooLarge, cached_upload, receive_upload, upload_url
+from city_garden.utils.admission import Overloaded, current_degradation, get_admission
+from city_garden.utils.deadline import DeadlineExceeded, deadline_scope
+from city_garden.utils.hedging import hedging_stats
+from city_garden.utils.prefetch import get_prefetcher
+from city_garden.utils.profiling import get_profiler
+from city_garden.utils.refinement import DONE, get_refinements
+from city_garden.utils.shared_work import SharedWork, shared, shared_work_scope
+from city_garden.utils.structured_logging import configure_logging, fields, get_request_id, new_request_id, request_context
+from city_garden.utils.tracing import get_exporter, is_trace_id, new_trace_id, render_waterfall, span, traced
 import os
+import json
+import uuid
+import base64
+import hashlib
+import asyncio
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from urllib.parse import urlparse
 from dotenv import load_dotenv
+from openai import APITimeoutError
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 app = FastAPI(title="City Garden API", description="API for generating garden plans")
 
+# Plan sessions: every run is checkpointed under its plan id so it can be re-planned, or resumed after a failure
+plan_checkpointer = create_checkpointer()
+garden_graph = build_garden_graph(checkpointer=plan_checkpointer)
+MAX_PLAN_SESSIONS = int(os.environ.get("CITY_GARDEN_MAX_PLAN_SESSIONS", "256"))
+_plan_sessions = OrderedDict()
+_plan_sessions_lock = threading.Lock()
+
+# Overall time budget of one plan; upstream call timeouts are capped by what is left of it
+REQUEST_DEADLINE = float(os.environ.get("CITY_GARDEN_REQUEST_DEADLINE", "300"))
+
+# Errors that mean an upstream call or the request as a whole ran out of time
+UPSTREAM_TIMEOUTS = (DeadlineExceeded, TimeoutError, APITimeoutError)
+
+BATCH_MAX_UNITS = int(os.environ.get("CITY_GARDEN_BATCH_MAX_UNITS", "100"))
+BATCH_CONCURRENCY = int(os.environ.get("CITY_GARDEN_BATCH_CONCURRENCY", "4"))
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +73,30 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.middleware("http")
+async def bind_request_id(request: Request, call_next):
+    """
+    Carry a correlation id through every log record of the request, and trace the request.
+
+    The trace gets its own server-generated id (X-Trace-ID), since X-Request-ID may come from the client.
+    Sampled requests, and requests whose X-Profile-Token header matches CITY_GARDEN_PROFILE_TOKEN, are
+    also profiled; their folded stacks are served under /api/debug/profiles/{trace_id}.
+    """
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    trace_id = new_trace_id()
+    profiler = get_profiler()
+    forced = profiler.wants(request.headers.get("X-Profile-Token"))
+    profiling = profiler.session(trace_id, forced) if forced is not None else nullcontext()
+    with request_context(request_id), span(f"{request.method} {request.url.path}", trace_id=trace_id) as root, \
+            profiling as profile:
+        response = await call_next(request)
+        root.set(status_code=response.status_code)
+    response.headers["X-Request-ID"] = request_id
+    response.headers["X-Trace-ID"] = trace_id
+    if profile is not None and await asyncio.to_thread(profiler.finish, profile):
+        response.headers["X-Profile-ID"] = profile.name
+    return response
+
 class Location(BaseModel):
     latitude: float
     longitude: float
@@ -39,107 +109,620 @@ class UserPreferences(BaseModel):
     winterType: Optional[str] = None
 
 class GardenPlanRequest(BaseModel):
-    image_urls: List[str]  # Changed from HttpUrl to str to handle Azure SAS URLs
+    image_urls: List[str] = []  # Changed from HttpUrl to str to handle Azure SAS URLs
+    # Handles returned by POST /api/uploads, used in place of (or next to) image_urls
+    image_handles: List[str] = []
     user_preferences: UserPreferences
     location: Location
 
-    @validator('image_urls')
-    def validate_image_urls(cls, v):
-        if not v:
-            raise ValueError("At least one image URL is required")
-        if len(v) > 3:
+    @validator('image_handles', always=True)
+    def validate_images(cls, v, values):
+        count = len(values.get('image_urls') or []) + len(v)
+        if count == 0:
+            raise ValueError("At least one image URL or upload handle is required")
+        if count > 3:
             raise ValueError("Maximum 3 images allowed")
         return v
 
+class BatchGardenPlanUnit(GardenPlanRequest):
+    unit_id: str
+
+class BatchGardenPlanRequest(BaseModel):
+    units: List[BatchGardenPlanUnit]
+
+    @validator('units')
+    def validate_units(cls, v):
+        if not v:
+            raise ValueError("At least one unit is required")
+        if len(v) > BATCH_MAX_UNITS:
+            raise ValueError(f"Maximum {BATCH_MAX_UNITS} units allowed")
+        return v
+
+class ReplanRequest(BaseModel):
+    user_preferences: UserPreferences
+
+class UploadResponse(BaseModel):
+    handle: str
+    sha256: str
+    size: int
+    content_type: str
+    width: int
+    height: int
+    thumbnail_url: str
+
+class PlanStatusResponse(BaseModel):
+    plan_id: str
+    status: str
+    nodes: Dict[str, str]
+    error: Optional[str] = None
+    garden_image_url: Optional[str] = None
+    garden_image_srcset: Dict[str, str] = {}
+    garden_image_quality: Optional[str] = None
+    garden_image_refinement: Optional[str] = None
+    plant_images: List[Dict[str, Any]] = []
+    plant_images_deferred: List[str] = []
+    plant_images_refinement: Optional[str] = None
+
+class RefinementResponse(BaseModel):
+    plan_id: str
+    garden_image_refinement: str
+
 class GardenPlanResponse(BaseModel):
+    plan_id: str
     garden_image_url: str
+    garden_image_srcset: Dict[str, str] = {}
+    # "preview" until the refined garden image replaces it; poll the status endpoint for it
+    garden_image_quality: str = "final"
+    garden_image_refinement: Optional[str] = None
     plant_recommendations: List[Dict[Any, Any]]
-    plant_images: List[Dict[str, str]]
+    plant_images: List[Dict[str, Any]]
+    # Plants whose images are still being generated in the background (only under load)
+    plant_images_deferred: List[str] = []
+    plant_images_refinement: Optional[str] = None
+    recommendation_source: Optional[str] = None
+    image_dedup: Dict[str, Any] = {}
+    # Degradation the request was admitted with: 0 is full quality, see utils/admission.py
+    degradation_level: int = 0
+    degradation: str = "full"
 
-@app.post("/api/garden_plan", response_model=GardenPlanResponse)
-async def create_garden_plan(request: GardenPlanRequest):
+class PlanRunFailed(Exception):
+    """A node of a started plan failed; the plan's checkpoints are kept so it can be resumed."""
+
+    def __init__(self, plan_id: str, error: BaseException):
+        super().__init__(f"Garden plan {plan_id} failed: {error}")
+        self.plan_id = plan_id
+        self.error = error
+
+    @property
+    def status_code(self) -> int:
+        return 504 if isinstance(self.error, UPSTREAM_TIMEOUTS) else 502
+
+    def to_http(self) -> HTTPException:
+        return HTTPException(
+            status_code=self.status_code,
+            detail=f"Garden plan failed: {self.error}. Resume it with POST /api/garden_plan/{self.plan_id}/resume",
+            headers={"X-Plan-ID": self.plan_id}
+        )
+
+def overloaded(e: Overloaded) -> HTTPException:
+    """503 for a plan rejected at admission, telling the client when to come back."""
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after), "X-Degradation-Level": str(e.level)}
+    )
+
+def run_plan_graph(plan_id: str, run):
+    """Run a graph invocation of a plan, wrapping node failures in PlanRunFailed."""
+    get_admission().started()
     try:
-        logger.info(f"Received request with {len(request.image_urls)} images")
-        
-        # Load images
-        image_loader = AzureImageLoader(
-            account_name=os.environ["AZURE_STORAGE_ACCOUNT_NAME"],
-            account_key=os.environ["AZURE_STORAGE_ACCOUNT_KEY"]
+        with span("graph", plan_id=plan_id):
+            return run()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Garden plan failed", extra=fields(plan_id=plan_id, error=e))
+        raise PlanRunFailed(plan_id, e) from e
+    finally:
+        # Until the next run of the plan its photos may leave memory
+        get_blob_arenas().finish(plan_id)
+
+def format_style_preferences(preferences: UserPreferences) -> str:
+    """Format user preferences for the garden state."""
+    return f"preferred grow type: {preferences.growType or 'none'} {preferences.subType or 'none'}, preferred cycle type: {preferences.cycleType or 'none'}, preferred winter type: {preferences.winterType or 'none'}".strip()
+
+def plan_config(plan_id: str) -> Dict[str, Any]:
+    return {"configurable": {"thread_id": plan_id}}
+
+def remember_plan(plan_id: str) -> None:
+    """
+    Track a plan session, dropping what this process holds for the oldest sessions beyond MAX_PLAN_SESSIONS.
+
+    Checkpoints in the shared SQLite file are left to its own age-based sweep; other workers may still use them.
+    """
+    with _plan_sessions_lock:
+        _plan_sessions[plan_id] = True
+        _plan_sessions.move_to_end(plan_id)
+        while len(_plan_sessions) > MAX_PLAN_SESSIONS:
+            expired_plan_id, _ = _plan_sessions.popitem(last=False)
+            if not isinstance(plan_checkpointer, SQLiteCheckpointSaver):
+                plan_checkpointer.delete_thread(expired_plan_id)
+            get_blob_arenas().release(expired_plan_id)
+            get_refinements().release(expired_plan_id)
+            get_refinements().release(plant_images_refinement_key(expired_plan_id))
+
+def require_plan_here(plan_id: str) -> None:
+    """
+    Refuse follow-up requests for a plan this process does not hold (another worker's, or expired here). Blocking.
+
+    Its checkpoints are shared, but its photos, refinements and deferred plant images are not; a plan
+    without checkpoints is left to the endpoint's own 404.
+
+    Raises:
+        HTTPException: 409 if the plan exists but this process does not hold it
+    """
+    with _plan_sessions_lock:
+        if plan_id in _plan_sessions:
+            return
+    if plan_checkpointer.get_tuple(plan_config(plan_id)) is not None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Plan {plan_id} is not held by this worker process (another worker created it, or it expired here); "
+                   "run the server with a single worker to follow up on plans"
         )
-        
-        try:
-            logger.info("Attempting to load images from Azure Blob Storage")
-            garden_image_contents = image_loader.load_images(request.image_urls)
-            logger.info(f"Successfully loaded {len(garden_image_contents)} images")
-        except Exception as e:
-            logger.error(f"Failed to load images: {str(e)}")
-            raise HTTPException(status_code=400, detail=f"Failed to load images: {str(e)}")
-        
-        if len(garden_image_contents) == 0:
-            logger.error("No images loaded successfully")
-            raise HTTPException(status_code=400, detail="No images loaded successfully")
-        
-        # Check content safety
-        content_analyzer = ContentAnalyzer(
-            endpoint=os.environ["AZURE_CONTENT_SAFETY_ENDPOINT"],
-            key=os.environ["AZURE_CONTENT_SAFETY_KEY"]
+
+def plan_images(plan_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The plan's images as the client should show them now.
+
+    The garden image is the refined render once it is done, else what the state holds (possibly a
+    preview); deferred plant images are added once they have been generated in the background.
+    """
+    images = {
+        "garden_image_url": state.get('garden_image_url'),
+        "garden_image_srcset": state.get('garden_image_srcset') or {},
+        "garden_image_quality": state.get('garden_image_quality') or "final",
+        "garden_image_refinement": None,
+        "plant_images": list(state.get('plant_images') or []),
+        "plant_images_deferred": list(state.get('plant_images_deferred') or []),
+        "plant_images_refinement": None,
+    }
+    refinements = get_refinements()
+    if images["garden_image_quality"] == "preview":
+        refinement = refinements.get(plan_id)
+        if refinement is not None:
+            # Someone is still looking at the plan; keep its queued refinement
+            refinements.touch(plan_id)
+            images["garden_image_refinement"] = refinement.status
+            if refinement.status == DONE:
+                images.update(
+                    garden_image_url=refinement.result["full"],
+                    garden_image_srcset=refinement.result,
+                    garden_image_quality="final",
+                )
+    if images["plant_images_deferred"]:
+        key = plant_images_refinement_key(plan_id)
+        refinement = refinements.get(key)
+        if refinement is not None:
+            refinements.touch(key)
+            images["plant_images_refinement"] = refinement.status
+            if refinement.status == DONE:
+                images["plant_images"] += refinement.result
+                images["plant_images_deferred"] = []
+    return images
+
+def plan_response(plan_id: str, final_state: Dict[str, Any]) -> GardenPlanResponse:
+    images = plan_images(plan_id, final_state)
+    degradation = current_degradation()
+    logger.info("Garden plan ready", extra=fields(
+        plan_id=plan_id,
+        plant_recommendations=len(final_state['plant_recommendations']),
+        garden_image_url=images['garden_image_url'],
+        garden_image_quality=images['garden_image_quality'],
+        degradation=degradation.name
+    ))
+    return GardenPlanResponse(
+        plan_id=plan_id,
+        **images,
+        plant_recommendations=final_state['plant_recommendations'],
+        degradation_level=degradation.level,
+        degradation=degradation.name,
+        recommendation_source=final_state.get('recommendation_source'),
+        image_dedup=final_state.get('image_dedup', {})
+    )
+
+def load_image(image_loader: AzureImageLoader, image_url: str) -> str:
+    """Load one image. Returns the base64 image content."""
+    try:
+        with span("load_image", blob=urlparse(image_url).path):
+            return image_loader.load_image(image_url)
+    except Exception as e:
+        logger.error("Failed to load images", extra=fields(error=e))
+        raise HTTPException(status_code=400, detail=f"Failed to load images: {str(e)}")
+
+def load_upload(image_loader: AzureImageLoader, handle: str) -> str:
+    """Load one uploaded photo, from this process's photo cache if a plan here already used it. Returns the base64 image content."""
+    try:
+        url = upload_url(get_asset_store(), handle)
+    except UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    with span("load_upload", handle=handle) as current:
+        data = cached_upload(url)
+        current.set(cached=data is not None)
+        if data is not None:
+            return base64.b64encode(data).decode("utf-8")
+        return load_image(image_loader, url)
+
+def prescreen_images(images: List[bytes]) -> RequestPrescreen:
+    """Run the local pre-screen over a request's images before any paid call."""
+    with span("prescreen", images=len(images)):
+        prescreen = get_image_prescreener().screen_request(images)
+    for index, result in enumerate(prescreen.results):
+        if result.rejected_by or result.flagged_by:
+            logger.warning("Image pre-screen findings", extra=fields(
+                image=index,
+                rejected_by=result.rejected_by,
+                flagged_by=result.flagged_by,
+                stats=result.stats
+            ))
+    if not prescreen.accepted:
+        raise HTTPException(status_code=400, detail=f"Image rejected by pre-screen: {', '.join(prescreen.rejected_by)}")
+    return prescreen
+
+def select_images(images: List[bytes]) -> Dict[str, Any]:
+    """
+    Pre-screen a request's images and collapse exact and near duplicates.
+
+    Returns:
+        Dict[str, Any]: Dedup metadata for the response: "uploaded" count, "kept" indices into the
+            request's image_urls followed by its image_handles, and "collapsed" entries naming the kept
+            image each duplicate was merged into
+    """
+    prescreen = prescreen_images(images)
+    collapsed = [
+        {"index": index, "kept_index": result.duplicate_of, "distance": 0}
+        for index, result in enumerate(prescreen.results)
+        if result.duplicate_of is not None
+    ]
+    dedup = collapse_near_duplicates([images[index] for index in prescreen.kept])
+    kept = [prescreen.kept[index] for index in dedup.kept]
+    for image in dedup.collapsed:
+        kept_index = prescreen.kept[image.kept_index]
+        collapsed.append({"index": prescreen.kept[image.index], "kept_index": kept_index, "distance": image.distance})
+    # Exact duplicates of a photo that was itself collapsed point at the photo that was kept
+    representative = {entry["index"]: entry["kept_index"] for entry in collapsed}
+    for entry in collapsed:
+        while entry["kept_index"] in representative:
+            entry["kept_index"] = representative[entry["kept_index"]]
+    return {"uploaded": len(images), "kept": kept, "collapsed": sorted(collapsed, key=lambda entry: entry["index"])}
+
+def check_content_safety(content_analyzer: ContentAnalyzer, image_content: str) -> str:
+    """Check the content safety of one base64 image. Returns the image content."""
+    try:
+        with span("content_safety"):
+            analysis_result = content_analyzer.analyze_image_data(image_content)
+        if (analysis_result.hate_severity > 0.5 or 
+            analysis_result.self_harm_severity > 0.5 or 
+            analysis_result.sexual_severity > 0.5 or 
+            analysis_result.violence_severity > 0.5):
+            logger.error("Image content safety check failed")
+            raise HTTPException(status_code=400, detail="Image content safety check failed")
+    except Exception as e:
+        logger.error("Content safety analysis failed", extra=fields(error=e))
+        raise HTTPException(status_code=400, detail=f"Content safety analysis failed: {str(e)}")
+    return image_content
+
+@traced("run_garden_plan")
+def run_garden_plan(request: GardenPlanRequest) -> GardenPlanResponse:
+    """Load and screen the images, then run the garden planning graph. Blocking."""
+    get_admission().started()
+    logger.info("Received garden plan request", extra=fields(images=len(request.image_urls) + len(request.image_handles)))
+    
+    # Load images
+    image_loader = AzureImageLoader(
+        account_name=os.environ["AZURE_STORAGE_ACCOUNT_NAME"],
+        account_key=os.environ["AZURE_STORAGE_ACCOUNT_KEY"]
+    )
+    
+    # Check content safety
+    content_analyzer = ContentAnalyzer(
+        endpoint=os.environ["AZURE_CONTENT_SAFETY_ENDPOINT"],
+        key=os.environ["AZURE_CONTENT_SAFETY_KEY"]
+    )
+    
+    logger.info("Attempting to load images from Azure Blob Storage")
+    with span("load_images", images=len(request.image_urls) + len(request.image_handles)):
+        garden_image_contents = [
+            # Photos shared by several units of a batch are downloaded and screened once
+            shared(
+                ("loaded_image", urlparse(image_url)._replace(query="").geturl()),
+                lambda image_url=image_url: load_image(image_loader, image_url)
+            )
+            for image_url in request.image_urls
+        ] + [
+            shared(("loaded_image", handle), lambda handle=handle: load_upload(image_loader, handle))
+            for handle in request.image_handles
+        ]
+    # Local checks first: rejected requests and duplicate photos never reach a paid call
+    image_dedup = select_images([base64.b64decode(image_content) for image_content in garden_image_contents])
+    garden_image_contents = [garden_image_contents[index] for index in image_dedup["kept"]]
+    garden_image_contents = [
+        shared(
+            ("screened_image", hashlib.sha256(image_content.encode("ascii")).hexdigest()),
+            lambda image_content=image_content: check_content_safety(content_analyzer, image_content)
         )
-        
-        for image_content in garden_image_contents:
+        for image_content in garden_image_contents
+    ]
+    logger.info("Successfully loaded images", extra=fields(count=len(garden_image_contents)))
+    
+    if len(garden_image_contents) == 0:
+        logger.error("No images loaded successfully")
+        raise HTTPException(status_code=400, detail="No images loaded successfully")
+    
+    plan_id = uuid.uuid4().hex
+    style_preferences = format_style_preferences(request.user_preferences)
+    # The state carries handles; the photos stay in the plan's arena for as long as the plan session
+    image_handles = [
+        get_blob_arenas().put(plan_id, base64.b64decode(image_content))
+        for image_content in garden_image_contents
+    ]
+    del garden_image_contents
+
+    # Initialize the state
+    initial_state = GardenState(
+        sun_exposure="",
+        micro_climate="",
+        hardscape_elements="",
+        plant_iventory="",
+        environment_factors="",
+        wind_pattern="",
+        style_preferences=style_preferences,
+        user_preferences=request.user_preferences.model_dump(),
+        plant_recommendations=[],
+        garden_image_url="",
+        garden_image="",
+        location=request.location.address,
+        latitude=request.location.latitude,
+        longitude=request.location.longitude,
+        images=image_handles,
+        image_dedup=image_dedup,
+        messages=[],
+        request_id=get_request_id()
+    )
+    
+    # Run the graph
+    logger.info("Running the garden planning graph", extra=fields(plan_id=plan_id))
+    remember_plan(plan_id)
+    final_state = run_plan_graph(plan_id, lambda: garden_graph.invoke(initial_state, plan_config(plan_id)))
+    logger.info("Graph execution completed")
+    
+    # Return the results
+    return plan_response(plan_id, final_state)
+
+@app.post("/api/uploads", response_model=UploadResponse)
+async def upload_photo(request: Request):
+    """
+    Stream a photo into Blob Storage and return a handle for /api/garden_plan's image_handles.
+
+    Accepts multipart/form-data with a "file" field, or the photo itself with its image/* content type.
+    The body is hashed, decoded and uploaded in blocks while it arrives, and never buffered as a whole;
+    the first plan using the handle downloads the photo into the photo cache.
+    """
+    try:
+        result = await receive_upload(request.stream(), request.headers.get("content-type", ""), get_asset_store())
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.exception("Upload failed", extra=fields(error=e))
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    return UploadResponse(
+        handle=result.handle,
+        sha256=result.sha256,
+        size=result.size,
+        content_type=result.content_type,
+        width=result.width,
+        height=result.height,
+        thumbnail_url=result.thumbnail_url
+    )
+
+@app.post("/api/garden_plan", response_model=GardenPlanResponse)
+async def create_garden_plan(request: GardenPlanRequest):
+    try:
+        # The pipeline blocks on upstream calls; keep it off the event loop
+        with get_admission().admit(), deadline_scope(REQUEST_DEADLINE):
+            return await asyncio.to_thread(run_garden_plan, request)
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise overloaded(e)
+    except PlanRunFailed as e:
+        raise e.to_http()
+    except UPSTREAM_TIMEOUTS as e:
+        logger.error("Garden plan timed out", extra=fields(error=e))
+        raise HTTPException(status_code=504, detail=f"Garden plan timed out: {str(e)}")
+    except Exception as e:
+        logger.exception("Unexpected error", extra=fields(error=e))
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@app.post("/api/garden_plan/batch")
+async def create_garden_plan_batch(request: BatchGardenPlanRequest):
+    """
+    Plan many balconies in one submission.
+    
+    Units run with bounded parallelism (CITY_GARDEN_BATCH_CONCURRENCY). Work that is identical across
+    units, such as downloading and screening the same photo, climate data for the same site and plant
+    images for the same species, is computed once and reused. Results are streamed as NDJSON, one
+    line per unit in completion order, followed by a summary line.
+    """
+    logger.info("Received batch garden plan request", extra=fields(units=len(request.units)))
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    shared_work = SharedWork()
+
+    async def run_unit(unit: BatchGardenPlanUnit) -> Dict[str, Any]:
+        async with semaphore:
             try:
-                analysis_result = content_analyzer.analyze_image_data(image_content)
-                if (analysis_result.hate_severity > 0.5 or 
-                    analysis_result.self_harm_severity > 0.5 or 
-                    analysis_result.sexual_severity > 0.5 or 
-                    analysis_result.violence_severity > 0.5):
-                    logger.error("Image content safety check failed")
-                    raise HTTPException(status_code=400, detail="Image content safety check failed")
+                # Each unit is admitted and gets its own deadline, counted from when it starts
+                with get_admission().admit(), deadline_scope(REQUEST_DEADLINE):
+                    response = await asyncio.to_thread(run_garden_plan, unit)
+                return {"type": "unit", "unit_id": unit.unit_id, "status": "ok", "plan": response.model_dump()}
+            except Overloaded as e:
+                return {"type": "unit", "unit_id": unit.unit_id, "status": "error", "status_code": 503, "error": str(e), "degradation_level": e.level}
+            except HTTPException as e:
+                return {"type": "unit", "unit_id": unit.unit_id, "status": "error", "status_code": e.status_code, "error": e.detail}
+            except PlanRunFailed as e:
+                return {"type": "unit", "unit_id": unit.unit_id, "status": "error", "status_code": e.status_code, "error": str(e.error), "plan_id": e.plan_id}
+            except UPSTREAM_TIMEOUTS as e:
+                return {"type": "unit", "unit_id": unit.unit_id, "status": "error", "status_code": 504, "error": str(e)}
             except Exception as e:
-                logger.error(f"Content safety analysis failed: {str(e)}")
-                raise HTTPException(status_code=400, detail=f"Content safety analysis failed: {str(e)}")
-        
-        # Create the graph
-        graph = build_garden_graph()
-        
-        # Format user preferences for the garden state
-        style_preferences = f"preferred grow type: {request.user_preferences.growType or 'none'} {request.user_preferences.subType or 'none'}, preferred cycle type: {request.user_preferences.cycleType or 'none'}, preferred winter type: {request.user_preferences.winterType or 'none'}".strip()
-
-        # Initialize the state
-        initial_state = GardenState(
-            sun_exposure="",
-            micro_climate="",
-            hardscape_elements="",
-            plant_iventory="",
-            environment_factors="",
-            wind_pattern="",
-            style_preferences=style_preferences,
-            plant_recommendations=[],
-            garden_image_url="",
-            garden_image="",
-            location=request.location.address,
-            latitude=request.location.latitude,
-            longitude=request.location.longitude,
-            images=garden_image_contents,
-            messages=[]
-        )
-        
-        # Run the graph
-        logger.info("Running the garden planning graph")
-        final_state = graph.invoke(initial_state)
-        logger.info("Graph execution completed")
-        
-        # print out plant recommendations
-        print(f"Plant recommendations: {final_state['plant_recommendations']}")
-        print(f"Garden image URL: {final_state['garden_image_url']}")   
-        
-        # Return the results
-        return GardenPlanResponse(
-            garden_image_url=final_state['garden_image_url'],
-            plant_recommendations=final_state['plant_recommendations'],
-            plant_images=final_state['plant_images']
-        )
+                logger.exception("Unexpected error in batch unit", extra=fields(unit_id=unit.unit_id, error=e))
+                return {"type": "unit", "unit_id": unit.unit_id, "status": "error", "status_code": 500, "error": str(e)}
+
+    # Tasks copy the current context, so every unit sees the batch's SharedWork
+    with shared_work_scope(shared_work):
+        tasks = [asyncio.create_task(run_unit(unit)) for unit in request.units]
+
+    async def stream_results():
+        succeeded = 0
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                succeeded += result["status"] == "ok"
+                yield json.dumps(result) + "\n"
+            yield json.dumps({
+                "type": "summary",
+                "units": len(tasks),
+                "succeeded": succeeded,
+                "shared_work": shared_work.stats()
+            }) + "\n"
+        finally:
+            # Client went away: do not start the units that are still queued
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/api/garden_plan/{plan_id}/replan", response_model=GardenPlanResponse)
+async def replan_garden_plan(plan_id: str, request: ReplanRequest):
+    """Re-plan an existing plan with new preferences, re-running only the nodes that depend on them."""
+    try:
+        logger.info("Received re-plan request", extra=fields(plan_id=plan_id))
+        await asyncio.to_thread(require_plan_here, plan_id)
+        with get_admission().admit(), deadline_scope(REQUEST_DEADLINE):
+            final_state = await asyncio.to_thread(
+                run_plan_graph,
+                plan_id,
+                lambda: replan_garden(
+                    garden_graph,
+                    plan_config(plan_id),
+                    {
+                        "style_preferences": format_style_preferences(request.user_preferences),
+                        "user_preferences": request.user_preferences.model_dump()
+                    }
+                )
+            )
+            if final_state is None:
+                raise HTTPException(status_code=404, detail=f"No re-plannable plan found for id {plan_id}")
+            remember_plan(plan_id)
+            return plan_response(plan_id, final_state)
     except HTTPException:
         raise
+    except Overloaded as e:
+        raise overloaded(e)
+    except PlanRunFailed as e:
+        raise e.to_http()
+    except UPSTREAM_TIMEOUTS as e:
+        logger.error("Re-plan timed out", extra=fields(plan_id=plan_id, error=e))
+        raise HTTPException(status_code=504, detail=f"Re-plan timed out: {str(e)}")
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}") 
\ No newline at end of file
+        logger.exception("Unexpected error", extra=fields(error=e))
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@app.post("/api/garden_plan/{plan_id}/resume", response_model=GardenPlanResponse)
+async def resume_garden_plan(plan_id: str):
+    """Continue a failed plan from its last successful node; completed nodes are not run (or paid for) again."""
+    try:
+        logger.info("Received resume request", extra=fields(plan_id=plan_id))
+        await asyncio.to_thread(require_plan_here, plan_id)
+        with get_admission().admit(), deadline_scope(REQUEST_DEADLINE):
+            final_state = await asyncio.to_thread(
+                run_plan_graph, plan_id, lambda: resume_garden(garden_graph, plan_config(plan_id))
+            )
+            if final_state is None:
+                raise HTTPException(status_code=404, detail=f"No plan found for id {plan_id}")
+            remember_plan(plan_id)
+            return plan_response(plan_id, final_state)
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        raise overloaded(e)
+    except PlanRunFailed as e:
+        raise e.to_http()
+    except Exception as e:
+        logger.exception("Unexpected error", extra=fields(error=e))
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+@app.get("/api/garden_plan/{plan_id}/status", response_model=PlanStatusResponse)
+async def get_garden_plan_status(plan_id: str):
+    """Per-node progress of a plan: which nodes are done, which one failed and why, and which are pending."""
+    await asyncio.to_thread(require_plan_here, plan_id)
+    progress = await asyncio.to_thread(plan_progress, garden_graph, plan_config(plan_id))
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"No plan found for id {plan_id}")
+    state = await asyncio.to_thread(lambda: garden_graph.get_state(plan_config(plan_id)).values)
+    return PlanStatusResponse(plan_id=plan_id, **progress, **plan_images(plan_id, state))
+
+@app.delete("/api/garden_plan/{plan_id}/refinement", response_model=RefinementResponse)
+async def cancel_garden_image_refinement(plan_id: str):
+    """Stop refining a plan's garden image, e.g. when the user leaves the page; the preview stays."""
+    await asyncio.to_thread(require_plan_here, plan_id)
+    refinement = get_refinements().cancel(plan_id)
+    if refinement is None:
+        raise HTTPException(status_code=404, detail=f"No garden image refinement for plan {plan_id}")
+    return RefinementResponse(plan_id=plan_id, garden_image_refinement=refinement.status)
+
+@app.get("/api/debug/traces/{trace_id}")
+async def get_trace(trace_id: str, format: str = "html"):
+    """
+    Waterfall of one request's spans (load_images, content safety, graph nodes, LLM and image calls, blob uploads).
+
+    Use the X-Trace-ID of the response to look up a request; format=json returns the raw spans.
+    """
+    spans = await asyncio.to_thread(get_exporter().load, trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail=f"No trace found for trace id {trace_id}")
+    if format == "json":
+        return {"trace_id": spans[0]["trace_id"], "spans": spans}
+    return HTMLResponse(render_waterfall(spans))
+
+@app.get("/api/debug/profiles/{trace_id}", response_class=PlainTextResponse)
+async def get_profile(trace_id: str):
+    """
+    Sampled stacks of one profiled request in folded format, for flamegraph.pl, speedscope or inferno.
+
+    Profiled responses carry X-Profile-ID, the request's trace id.
+    """
+    folded = await asyncio.to_thread(get_profiler().load, trace_id) if is_trace_id(trace_id) else None
+    if folded is None:
+        raise HTTPException(status_code=404, detail=f"No profile found for trace id {trace_id}")
+    return PlainTextResponse(folded)
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Process-local counters: image pre-screen savings, photo cache usage, hedged LLM calls, deployment routing, prefetched plant images, the shared cache, plan photo arenas, background image refinements, admission control and the profiler."""
+    router = getattr(city_garden.llm, "llm", None)
+    return {
+        "prescreen": get_image_prescreener().stats(),
+        "image_cache": get_image_cache().stats(),
+        "hedging": hedging_stats(),
+        "llm_router": router.stats() if hasattr(router, "stats") else {},
+        "prefetch": get_prefetcher().stats(),
+        "cache": get_cache().stats(),
+        "blob_arenas": get_blob_arenas().stats(),
+        "refinements": get_refinements().stats(),
+        "admission": get_admission().stats(),
+        "profiler": get_profiler().stats(),
+        # Counters are per worker process when running under server.py
+        "worker": {"pid": os.getpid()},
+    }
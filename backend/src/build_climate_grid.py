@@ -0,0 +1,107 @@
+"""
+Precompute a climate grid for the service regions.
+
+Fetches monthly climate normals (temperature, precipitation, wind and frost
+days) from Open-Meteo for every point of a bounding box at a fixed resolution
+and writes them to a compact binary grid file. Point the API at the file with
+CITY_GARDEN_CLIMATE_GRID and climate lookups inside the box no longer call
+Open-Meteo.
+
+Example:
+    python src/build_climate_grid.py --lat-min 47 --lat-max 55.5 --lon-min 5.5 --lon-max 15.5 \
+        --resolution 0.25 --output data/climate_grid.bin
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from city_garden.services.climate_grid import write_climate_grid
+from city_garden.tools.climate import GRID_FIELDS, fetch_climate_normals
+from city_garden.utils.structured_logging import configure_logging, fields
+
+logger = logging.getLogger(__name__)
+
+
+def build_climate_grid(
+    output: str,
+    lat_min: float,
+    lat_max: float,
+    lon_min: float,
+    lon_max: float,
+    resolution: float,
+    start_date: str,
+    end_date: str,
+    batch_size: int = 50,
+    pause: float = 1.0,
+) -> np.ndarray:
+    """Fetch normals for every grid point, batch_size points per request, and write the grid file."""
+    latitudes = np.round(np.arange(lat_min, lat_max + resolution / 2, resolution), 6)
+    longitudes = np.round(np.arange(lon_min, lon_max + resolution / 2, resolution), 6)
+    values = np.full((len(latitudes), len(longitudes), len(GRID_FIELDS), 12), np.nan, dtype=np.float32)
+
+    points = [(row, col) for row in range(len(latitudes)) for col in range(len(longitudes))]
+    logger.info("Building climate grid", extra=fields(rows=len(latitudes), cols=len(longitudes), points=len(points)))
+
+    for start in range(0, len(points), batch_size):
+        batch = points[start:start + batch_size]
+        try:
+            profiles = fetch_climate_normals(
+                [float(latitudes[row]) for row, _ in batch],
+                [float(longitudes[col]) for _, col in batch],
+                start_date=start_date,
+                end_date=end_date,
+            )
+        except Exception as e:
+            # Cells stay NaN; lookups near them fall back to the live API
+            logger.warning("Failed to fetch grid batch", extra=fields(first_point=start, error=e))
+            continue
+        for (row, col), profile in zip(batch, profiles):
+            values[row, col] = [getattr(profile, name) for name in GRID_FIELDS]
+        logger.info("Fetched grid batch", extra=fields(done=start + len(batch), points=len(points)))
+        if pause:
+            # Stay below the Open-Meteo rate limit
+            time.sleep(pause)
+
+    write_climate_grid(output, values, float(latitudes[0]), float(longitudes[0]), resolution, resolution, GRID_FIELDS)
+    logger.info("Wrote climate grid", extra=fields(
+        output=output,
+        bytes=values.nbytes,
+        missing_cells=int(np.isnan(values[:, :, 0, 0]).sum())
+    ))
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute a climate grid file from Open-Meteo")
+    parser.add_argument("--lat-min", type=float, required=True)
+    parser.add_argument("--lat-max", type=float, required=True)
+    parser.add_argument("--lon-min", type=float, required=True)
+    parser.add_argument("--lon-max", type=float, required=True)
+    parser.add_argument("--resolution", type=float, default=0.25, help="Grid spacing in degrees")
+    parser.add_argument("--start-date", default="2015-01-01", help="First day of the reference period")
+    parser.add_argument("--end-date", default="2024-12-31", help="Last day of the reference period")
+    parser.add_argument("--batch-size", type=int, default=50, help="Grid points per Open-Meteo request")
+    parser.add_argument("--pause", type=float, default=1.0, help="Seconds between requests")
+    parser.add_argument("--output", default="data/climate_grid.bin")
+    args = parser.parse_args()
+
+    configure_logging(fmt="text")
+    build_climate_grid(
+        args.output,
+        args.lat_min,
+        args.lat_max,
+        args.lon_min,
+        args.lon_max,
+        args.resolution,
+        args.start_date,
+        args.end_date,
+        batch_size=args.batch_size,
+        pause=args.pause,
+    )
+
+
+if __name__ == "__main__":
+    main()
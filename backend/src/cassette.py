@@ -0,0 +1,502 @@
+"""
+Record and replay of upstream calls with their latencies.
+
+Recording wraps the API's upstream seams, the same ones the load test
+replaces with stand-ins, and appends every interaction with its request key
+and latency to a cassette: a directory with one JSONL file per seam.
+
+    llm             llm.invoke / ainvoke / stream (chunks with their offsets)
+    image           OpenAI().images.edit / generate (the returned image)
+    blob_download   AzureImageLoader.load_image (the photo)
+    blob_upload     AssetStore.put (the returned URL)
+    content_safety  ContentAnalyzer.analyze_image_data (the severities)
+    climate         get_climate_profile (the Open-Meteo normals, or None)
+
+Replay serves the recorded interactions instead, optionally sleeping the
+recorded latency (scaled by latency_scale), so a change to the pipeline can
+be compared offline against production-shaped sizes and latencies. A call is
+answered with the interaction recorded for the same request. Otherwise it
+gets the recorded interactions of the same kind in turn, e.g. the same
+prompt template or image quality, and then those of the same seam. In
+strict mode it fails with CassetteMiss instead. Recorded failures are
+replayed as RecordedUpstreamError after their latency.
+
+Record against real backends with `python src/run_api.py --record-cassette DIR`,
+then replay with `python src/load_test.py --replay DIR`.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+from load_test import StandInAssetStore, StandInLatency, use_stand_in_environment
+
+SEAMS = ("llm", "image", "blob_download", "blob_upload", "content_safety", "climate")
+
+
+class CassetteMiss(LookupError):
+    """No recorded interaction can answer a replayed call."""
+
+
+class RecordedUpstreamError(RuntimeError):
+    """A replayed call whose recorded original failed."""
+
+
+def request_key(*parts: Any) -> str:
+    """Stable key of an upstream request from the parts that identify it."""
+    encoded = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]
+
+
+def llm_request(messages: List[Any]) -> Tuple[str, str]:
+    """Key and kind (the system prompt, i.e. which node asks) of a chat call."""
+    contents = [(type(message).__name__, message.content) for message in messages]
+    return request_key(contents), request_key(contents[0] if contents else None)[:16]
+
+
+def image_request(operation: str, kwargs: Dict[str, Any]) -> Tuple[str, str]:
+    """Key and kind (operation and quality) of an image call."""
+    files = [
+        hashlib.sha256(image_file.getvalue()).hexdigest() if hasattr(image_file, "getvalue") else str(image_file)
+        for image_file in kwargs.get("image") or []
+    ]
+    quality = kwargs.get("quality", "auto")
+    return (
+        request_key(operation, kwargs.get("prompt"), kwargs.get("size"), quality, files),
+        f"{operation}:{quality}",
+    )
+
+
+class Cassette:
+    """A directory of recorded interactions, written while recording and served while replaying."""
+
+    def __init__(self, directory: str, latency_scale: float = 1.0, strict: bool = False):
+        """
+        Initialize the Cassette.
+
+        Args:
+            directory (str): Where the cassette files are
+            latency_scale (float): Share of the recorded latency a replayed call sleeps; 0 answers at once
+            strict (bool): Only answer a replayed call with an interaction recorded for the same request
+        """
+        self.directory = directory
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._by_key: Optional[Dict[Tuple[str, str], List[Dict[str, Any]]]] = None
+        self._by_kind: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._by_seam: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursors: Dict[Tuple[str, ...], int] = {}
+        self.counts = {"recorded": 0, "exact": 0, "fallback": 0, "missed": 0}
+
+    def path(self, seam: str) -> str:
+        return os.path.join(self.directory, f"{seam}.jsonl")
+
+    def record(self, seam: str, key: str, kind: str, latency: float, response: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        """Append one interaction to the seam's cassette file."""
+        line = json.dumps({
+            "key": key,
+            "kind": kind,
+            "latency": round(latency, 4),
+            "recorded_at": time.time(),
+            "response": response,
+            "error": f"{type(error).__name__}: {error}" if error is not None else None,
+        }, ensure_ascii=False, default=str)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(seam), "a", encoding="utf-8") as cassette_file:
+                cassette_file.write(line + "\n")
+            self.counts["recorded"] += 1
+
+    def recorded(self, seam: str, key: str, kind: str, call: Callable[[], Any], encode: Callable[[Any], Any]) -> Any:
+        """Run call, record its latency and encoded result (or failure), and return the result."""
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception as e:
+            self.record(seam, key, kind, time.perf_counter() - started, error=e)
+            raise
+        self.record(seam, key, kind, time.perf_counter() - started, response=encode(result))
+        return result
+
+    def _load(self) -> None:
+        self._by_key = {}
+        for seam in SEAMS:
+            try:
+                with open(self.path(seam), encoding="utf-8") as cassette_file:
+                    entries = [json.loads(line) for line in cassette_file if line.strip()]
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                self._by_key.setdefault((seam, entry["key"]), []).append(entry)
+                self._by_kind.setdefault((seam, entry["kind"]), []).append(entry)
+                self._by_seam.setdefault(seam, []).append(entry)
+
+    def replay(self, seam: str, key: str, kind: str) -> Dict[str, Any]:
+        """
+        Pick the recorded interaction that answers a call.
+
+        Repeated calls cycle through the candidates in recording order.
+
+        Raises:
+            CassetteMiss: If nothing recorded matches (or, in strict mode, nothing for the same request)
+        """
+        with self._lock:
+            if self._by_key is None:
+                self._load()
+            candidates = [(("key", seam, key), self._by_key.get((seam, key)))]
+            if not self.strict:
+                candidates += [(("kind", seam, kind), self._by_kind.get((seam, kind))), (("seam", seam), self._by_seam.get(seam))]
+            for cursor, entries in candidates:
+                if entries:
+                    index = self._cursors.get(cursor, 0)
+                    self._cursors[cursor] = index + 1
+                    self.counts["exact" if cursor[0] == "key" else "fallback"] += 1
+                    return entries[index % len(entries)]
+            self.counts["missed"] += 1
+        raise CassetteMiss(f"No recorded {seam} interaction in {self.directory} for request {key} ({kind})")
+
+    def delay(self, entry: Dict[str, Any]) -> float:
+        return max(0.0, entry["latency"] * self.latency_scale)
+
+    def wait(self, entry: Dict[str, Any]) -> Any:
+        """Sleep the interaction's latency, then return its response or raise its recorded failure."""
+        time.sleep(self.delay(entry))
+        return self._outcome(entry)
+
+    async def wait_async(self, entry: Dict[str, Any]) -> Any:
+        await asyncio.sleep(self.delay(entry))
+        return self._outcome(entry)
+
+    def _outcome(self, entry: Dict[str, Any]) -> Any:
+        if entry.get("error"):
+            raise RecordedUpstreamError(entry["error"])
+        return entry["response"]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+
+class RecordingLLM:
+    """Chat model wrapper recording every call; everything else is the wrapped model's."""
+
+    def __init__(self, llm: Any, cassette: Cassette):
+        self.llm = llm
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.llm, name)
+
+    def invoke(self, messages, *args, **kwargs):
+        key, kind = llm_request(messages)
+        return self.cassette.recorded(
+            "llm", key, kind, lambda: self.llm.invoke(messages, *args, **kwargs), lambda message: {"content": message.content}
+        )
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        key, kind = llm_request(messages)
+        started = time.perf_counter()
+        try:
+            message = await self.llm.ainvoke(messages, *args, **kwargs)
+        except Exception as e:
+            self.cassette.record("llm", key, kind, time.perf_counter() - started, error=e)
+            raise
+        self.cassette.record("llm", key, kind, time.perf_counter() - started, response={"content": message.content})
+        return message
+
+    def stream(self, messages, *args, **kwargs):
+        key, kind = llm_request(messages)
+        started = time.perf_counter()
+        chunks = []
+        try:
+            for chunk in self.llm.stream(messages, *args, **kwargs):
+                text = chunk.content if isinstance(chunk.content, str) else ""
+                chunks.append([round(time.perf_counter() - started, 4), text])
+                yield chunk
+        except Exception as e:
+            self.cassette.record("llm", key, kind, time.perf_counter() - started, error=e)
+            raise
+        content = "".join(text for _, text in chunks)
+        self.cassette.record("llm", key, kind, time.perf_counter() - started, response={"content": content, "chunks": chunks})
+
+
+class ReplayLLM:
+    """Chat model answering from a cassette; streamed answers keep their recorded chunk timing."""
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    def invoke(self, messages, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+        response = self.cassette.wait(self.cassette.replay("llm", *llm_request(messages)))
+        return AIMessage(content=response["content"])
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+        response = await self.cassette.wait_async(self.cassette.replay("llm", *llm_request(messages)))
+        return AIMessage(content=response["content"])
+
+    def stream(self, messages, *args, **kwargs):
+        from langchain_core.messages import AIMessageChunk
+        entry = self.cassette.replay("llm", *llm_request(messages))
+        if entry.get("error"):
+            self.cassette.wait(entry)
+        # An answer recorded by invoke() arrives as one chunk at its latency
+        chunks = entry["response"].get("chunks") or [[entry["latency"], entry["response"]["content"]]]
+        previous = 0.0
+        for offset, text in chunks:
+            time.sleep(max(0.0, (offset - previous) * self.cassette.latency_scale))
+            previous = offset
+            yield AIMessageChunk(content=text)
+
+
+def _image_response(response: Any) -> Dict[str, Any]:
+    return {"b64_json": response.data[0].b64_json}
+
+
+def recording_openai(openai_class: Callable[..., Any], cassette: Cassette) -> Callable[..., Any]:
+    """OpenAI client factory whose clients record images.edit and images.generate."""
+    class RecordingImages:
+        def __init__(self, images: Any):
+            self.images = images
+
+        def edit(self, *args, **kwargs):
+            key, kind = image_request("edit", kwargs)
+            return cassette.recorded("image", key, kind, lambda: self.images.edit(*args, **kwargs), _image_response)
+
+        def generate(self, *args, **kwargs):
+            key, kind = image_request("generate", kwargs)
+            return cassette.recorded("image", key, kind, lambda: self.images.generate(*args, **kwargs), _image_response)
+
+    def create(*args, **kwargs):
+        client = openai_class(*args, **kwargs)
+        return SimpleNamespace(images=RecordingImages(client.images))
+    return create
+
+
+class ReplayOpenAI:
+    """OpenAI client stand-in answering images.edit and images.generate from a cassette."""
+
+    cassette: Optional[Cassette] = None
+
+    def __init__(self, *args, **kwargs):
+        self.images = self
+
+    def _respond(self, operation: str, kwargs: Dict[str, Any]):
+        response = self.cassette.wait(self.cassette.replay("image", *image_request(operation, kwargs)))
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=response["b64_json"])])
+
+    def edit(self, *args, **kwargs):
+        return self._respond("edit", kwargs)
+
+    def generate(self, *args, **kwargs):
+        return self._respond("generate", kwargs)
+
+
+def _blob_request(blob_url: str) -> Tuple[str, str]:
+    # The SAS token rotates; the blob is the same
+    return request_key(blob_url.split("?", 1)[0]), "load_image"
+
+
+def recording_image_loader(loader_class: Callable[..., Any], cassette: Cassette) -> Callable[..., Any]:
+    """AzureImageLoader factory whose loaders record load_image."""
+    class RecordingImageLoader:
+        def __init__(self, *args, **kwargs):
+            self.loader = loader_class(*args, **kwargs)
+
+        def __getattr__(self, name: str) -> Any:
+            return getattr(self.loader, name)
+
+        def load_image(self, blob_url):
+            key, kind = _blob_request(blob_url)
+            return cassette.recorded(
+                "blob_download", key, kind, lambda: self.loader.load_image(blob_url), lambda content: {"content": content}
+            )
+    return RecordingImageLoader
+
+
+class ReplayImageLoader:
+    """AzureImageLoader stand-in serving recorded photos."""
+
+    cassette: Optional[Cassette] = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def load_image(self, blob_url):
+        return self.cassette.wait(self.cassette.replay("blob_download", *_blob_request(blob_url)))["content"]
+
+    def load_images(self, blob_urls):
+        return [self.load_image(blob_url) for blob_url in blob_urls]
+
+
+def _upload_request(data: bytes, extension: str, container_name: Optional[str]) -> Tuple[str, str]:
+    from city_garden.services.asset_store import AssetStore
+    return request_key(container_name, AssetStore.blob_name_for(data, extension)), f"put:{extension}"
+
+
+class RecordingAssetStore:
+    """AssetStore wrapper recording put(); streamed uploads (open_upload) pass through unrecorded."""
+
+    def __init__(self, store: Any, cassette: Cassette):
+        self.store = store
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.store, name)
+
+    def put(self, data, content_type, extension, container_name=None):
+        key, kind = _upload_request(data, extension, container_name)
+        return self.cassette.recorded(
+            "blob_upload", key, kind, lambda: self.store.put(data, content_type, extension, container_name),
+            lambda url: {"url": url, "bytes": len(data)}
+        )
+
+
+class ReplayAssetStore(StandInAssetStore):
+    """Asset store stand-in taking as long as the recorded uploads; URLs are content-addressed as usual."""
+
+    def __init__(self, cassette: Cassette):
+        super().__init__(StandInLatency(blob=0, content_safety=0, llm=0, image=0))
+        self.cassette = cassette
+
+    def put(self, data, content_type, extension, container_name=None):
+        self.cassette.wait(self.cassette.replay("blob_upload", *_upload_request(data, extension, container_name)))
+        return super().put(data, content_type, extension, container_name)
+
+
+def _safety_request(image_data: Any) -> Tuple[str, str]:
+    data = image_data if isinstance(image_data, bytes) else str(image_data).encode("utf-8")
+    return request_key(hashlib.sha256(data).hexdigest()), "analyze_image"
+
+
+def recording_content_analyzer(analyzer_class: Callable[..., Any], cassette: Cassette) -> Callable[..., Any]:
+    """ContentAnalyzer factory whose analyzers record analyze_image_data."""
+    class RecordingContentAnalyzer:
+        def __init__(self, *args, **kwargs):
+            self.analyzer = analyzer_class(*args, **kwargs)
+
+        def __getattr__(self, name: str) -> Any:
+            return getattr(self.analyzer, name)
+
+        def analyze_image_data(self, image_data):
+            key, kind = _safety_request(image_data)
+            return cassette.recorded(
+                "content_safety", key, kind, lambda: self.analyzer.analyze_image_data(image_data), asdict
+            )
+    return RecordingContentAnalyzer
+
+
+class ReplayContentAnalyzer:
+    """ContentAnalyzer stand-in returning the recorded severities."""
+
+    cassette: Optional[Cassette] = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def analyze_image_data(self, image_data):
+        from city_garden.services.content_safety import ImageAnalysisResult
+        return ImageAnalysisResult(**self.cassette.wait(self.cassette.replay("content_safety", *_safety_request(image_data))))
+
+
+def _climate_request(latitude: float, longitude: float) -> Tuple[str, str]:
+    return request_key(round(latitude, 2), round(longitude, 2)), "climate_profile"
+
+
+def recording_climate_profile(get_climate_profile: Callable[..., Any], cassette: Cassette) -> Callable[..., Any]:
+    """get_climate_profile wrapper recording each lookup."""
+    def recorded_climate_profile(latitude, longitude):
+        key, kind = _climate_request(latitude, longitude)
+        return cassette.recorded(
+            "climate", key, kind, lambda: get_climate_profile(latitude, longitude),
+            lambda profile: asdict(profile) if profile is not None else None
+        )
+    return recorded_climate_profile
+
+
+def replay_climate_profile(cassette: Cassette) -> Callable[..., Any]:
+    def replayed_climate_profile(latitude, longitude):
+        from city_garden.tools.climate import ClimateProfile
+        normals = cassette.wait(cassette.replay("climate", *_climate_request(latitude, longitude)))
+        return ClimateProfile(**normals) if normals is not None else None
+    return replayed_climate_profile
+
+
+@contextmanager
+def recorded_backends(directory: str) -> Iterator[Cassette]:
+    """
+    Record every upstream call of the API module to a cassette.
+
+    The backends currently wired in are wrapped, so this records real backends, or the load
+    test's stand-ins when used inside stand_in_backends().
+
+    Args:
+        directory (str): Cassette directory; interactions are appended to its files
+    """
+    import api
+    from city_garden import city_garden_nodes
+    from city_garden.utils.refinement import get_refinements
+
+    cassette = Cassette(directory)
+    get_asset_store = api.get_asset_store
+    node_asset_store = city_garden_nodes.get_asset_store
+    with mock.patch.object(api, "AzureImageLoader", recording_image_loader(api.AzureImageLoader, cassette)), \
+            mock.patch.object(api, "get_asset_store", lambda: RecordingAssetStore(get_asset_store(), cassette)), \
+            mock.patch.object(api, "ContentAnalyzer", recording_content_analyzer(api.ContentAnalyzer, cassette)), \
+            mock.patch.object(city_garden_nodes, "get_asset_store", lambda: RecordingAssetStore(node_asset_store(), cassette)), \
+            mock.patch.object(city_garden_nodes, "OpenAI", recording_openai(city_garden_nodes.OpenAI, cassette)), \
+            mock.patch.object(city_garden_nodes, "get_climate_profile",
+                              recording_climate_profile(city_garden_nodes.get_climate_profile, cassette)), \
+            mock.patch.object(city_garden_nodes, "llm", RecordingLLM(city_garden_nodes.llm, cassette)):
+        try:
+            yield cassette
+        finally:
+            # Background refinements are upstream calls of their plans too
+            get_refinements().drain()
+
+
+@contextmanager
+def replayed_backends(directory: str, latency_scale: float = 1.0, strict: bool = False):
+    """
+    Wire the API module to a cassette instead of its upstream dependencies.
+
+    Args:
+        directory (str): Cassette directory written by recorded_backends()
+        latency_scale (float): Share of the recorded latencies to re-apply; 0 answers at once
+        strict (bool): Fail calls that were not recorded for the same request instead of reusing similar ones
+
+    Returns:
+        The FastAPI app; the cassette is app.state.cassette
+    """
+    use_stand_in_environment()
+    import api
+    from city_garden import city_garden_nodes
+    from city_garden.utils.refinement import get_refinements
+
+    cassette = Cassette(directory, latency_scale=latency_scale, strict=strict)
+    for replay in (ReplayOpenAI, ReplayImageLoader, ReplayContentAnalyzer):
+        replay.cassette = cassette
+
+    with mock.patch.object(api, "AzureImageLoader", ReplayImageLoader), \
+            mock.patch.object(api, "get_asset_store", lambda: ReplayAssetStore(cassette)), \
+            mock.patch.object(api, "ContentAnalyzer", ReplayContentAnalyzer), \
+            mock.patch.object(city_garden_nodes, "get_asset_store", lambda: ReplayAssetStore(cassette)), \
+            mock.patch.object(city_garden_nodes, "OpenAI", ReplayOpenAI), \
+            mock.patch.object(city_garden_nodes, "get_climate_profile", replay_climate_profile(cassette)), \
+            mock.patch.object(city_garden_nodes, "llm", ReplayLLM(cassette)), \
+            mock.patch.object(api.app.state, "cassette", cassette, create=True):
+        try:
+            yield api.app
+        finally:
+            get_refinements().drain()
@@ -1,34 +1,166 @@
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from typing import Dict, Any, List, TypedDict, Annotated, Optional
+from typing import Dict, Any, Iterator, List, TypedDict, Annotated, Optional
 import sys
 import os
 import json
-from datetime import datetime
-from azure.storage.blob import BlobClient
 import base64
 from io import BytesIO
 
 from city_garden.garden_state import GardenState
-from city_garden.tools.climate import get_monthly_average_temperature, get_monthly_precipitation, get_wind_pattern
-from city_garden.services.image_loader import AzureImageLoader
+from city_garden.tools.climate import get_climate_profile, get_monthly_average_temperature, get_monthly_precipitation, get_wind_pattern
+from city_garden.services.plant_catalog import SuitabilityQuery, get_plant_catalog
+from city_garden.services.asset_store import get_asset_store
+from city_garden.services.blob_arena import resolve_images
+from city_garden.services.cache_backend import cache_key, get_cache
+from city_garden.services.image_variants import ImageVariant, encode_variants, upload_variants
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from langsmith import Client
-from langchain_core.tracers import LangChainTracer
-from langchain_core.callbacks.manager import CallbackManager
 import re
+import time
 import logging
-from city_garden.llm import llm
+from city_garden.llm import LLM_TIMEOUT, llm
 logger = logging.getLogger(__name__)
 from io import BytesIO
 from base64 import b64decode
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
+from city_garden.utils.admission import current_degradation, record_upstream
+from city_garden.utils.deadline import DeadlineExceeded, call_timeout
+from city_garden.utils.hedging import get_hedger
+from city_garden.utils.json_stream import ArrayItemStream
+from city_garden.utils.prefetch import get_prefetcher
 from city_garden.utils.prompt_loader import load_prompt
+from city_garden.utils.refinement import get_refinements
+from city_garden.utils.shared_work import shared
+from city_garden.utils.structured_logging import fields, debug_sampled
+from city_garden.utils.tracing import span
 load_dotenv()
 
+# Number of pre-ranked catalog candidates put into the recommendation prompt
+CATALOG_SHORTLIST_SIZE = int(os.environ.get("CITY_GARDEN_CATALOG_SHORTLIST_SIZE", "8"))
+# Answer from the catalog alone when enough candidates score at least this well
+CATALOG_CONFIDENT_SCORE = float(os.environ.get("CITY_GARDEN_CATALOG_CONFIDENT_SCORE", "0.85"))
+CATALOG_MIN_CONFIDENT = 3
+CATALOG_MAX_RECOMMENDATIONS = 5
+# Per-call limit for gpt-image-1 in seconds; a request deadline can shorten it further
+IMAGE_TIMEOUT = float(os.environ.get("CITY_GARDEN_IMAGE_TIMEOUT", "120"))
+CATALOG_SKIP_LLM = os.environ.get("CITY_GARDEN_CATALOG_SKIP_LLM", "true").lower() in ("1", "true", "yes")
+# Bounds of the message history carried in the state
+MAX_MESSAGES = 8
+MESSAGE_MAX_CHARS = 1000
+# Seconds a generated plant image is reused for the same species
+PLANT_IMAGE_CACHE_TTL = float(os.environ.get("CITY_GARDEN_PLANT_IMAGE_CACHE_TTL", str(7 * 24 * 3600)))
+# Garden image: a quick low-quality preview first, the full render in the background
+PROGRESSIVE_GARDEN_IMAGE = os.environ.get("CITY_GARDEN_PROGRESSIVE_IMAGE", "true").lower() in ("1", "true", "yes")
+GARDEN_IMAGE_SIZE = "1024x1536"
+GARDEN_IMAGE_QUALITY = "medium"
+PREVIEW_IMAGE_SIZE = "1024x1024"
+PREVIEW_IMAGE_QUALITY = "low"
+
+
+class ImageGenerationError(RuntimeError):
+    """gpt-image-1 did not produce an image, or the image could not be stored."""
+
+
+def invoke_llm(messages: List[Any], stage: str, hedge: bool = False):
+    """
+    Call the chat model within the request deadline.
+
+    Args:
+        messages (List[Any]): The chat messages
+        stage (str): Name of the calling node, used for the deadline error, logs and hedging metrics
+        hedge (bool): Allow a hedged backup call; only for idempotent prompts
+
+    Returns:
+        The model response
+    """
+    timeout = call_timeout(LLM_TIMEOUT, stage)
+    hedger = get_hedger(stage) if hedge else None
+    with span("llm", stage=stage, hedged=hedger is not None and hedger.enabled):
+        if hedger is not None and hedger.enabled:
+            return hedger.call(lambda: llm.ainvoke(messages, timeout=timeout), timeout=timeout)
+        return llm.invoke(messages, timeout=timeout)
+
+
+def append_message(state: GardenState, content: str) -> None:
+    """Add an assistant message, keeping the history bounded since the state is copied into every checkpoint."""
+    if len(content) > MESSAGE_MAX_CHARS:
+        content = content[:MESSAGE_MAX_CHARS] + "..."
+    history = (state.get("messages") or [])[-(MAX_MESSAGES - 1):]
+    state["messages"] = history + [{"role": "assistant", "content": content}]
+
+
+def stream_llm(messages: List[Any], stage: str) -> Iterator[str]:
+    """
+    Stream the chat model's answer within the request deadline.
+
+    Args:
+        messages (List[Any]): The chat messages
+        stage (str): Name of the calling node, used for the deadline error
+
+    Returns:
+        Iterator[str]: The answer text, chunk by chunk
+    """
+    timeout = call_timeout(LLM_TIMEOUT, stage)
+    with span("llm_stream", stage=stage) as current:
+        chunks = 0
+        for chunk in llm.stream(messages, timeout=timeout):
+            if isinstance(chunk.content, str) and chunk.content:
+                chunks += 1
+                yield chunk.content
+        current.set(chunks=chunks)
+
+
+def plant_image_key(plant_name: str) -> str:
+    return plant_name.strip().lower()
+
+
+def plant_image_prompt(plant_name: str) -> str:
+    system_prompt = load_prompt('plant_image_generator.yml', 'plant_image_generator_en')
+    return system_prompt.format(plant_name=plant_name)
+
+
+def plant_image_variants(plant_name: str) -> Dict[str, str]:
+    """Generate the image of one recommended plant.
+
+    Plants of the same species share one image across a batch submission, and across
+    requests and workers through the shared cache until PLANT_IMAGE_CACHE_TTL expires.
+    """
+    prompt = plant_image_prompt(plant_name)
+    return shared(
+        ("plant_image", plant_image_key(plant_name)),
+        lambda: get_cache().get_or_compute_json(
+            cache_key("plant_image", plant_image_key(plant_name), prompt),
+            lambda: generate_image_variants(prompt, image_files=None, image_name=plant_name, size="1024x1024", quality="low"),
+            ttl=PLANT_IMAGE_CACHE_TTL
+        )
+    )
+
+
+def cached_plant_image_variants(plant_name: str) -> Optional[Dict[str, str]]:
+    """Return a plant's image if it is in the shared cache, without generating it."""
+    value = get_cache().get(cache_key("plant_image", plant_image_key(plant_name), plant_image_prompt(plant_name)))
+    return None if value is None else json.loads(value)
+
+
+def plant_image_budget(index: int) -> bool:
+    """Whether the plant at this position of the recommendations gets its image generated during the plan."""
+    degradation = current_degradation()
+    if degradation.defer_plant_images:
+        return False
+    return degradation.max_plant_images is None or index < degradation.max_plant_images
+
+
+def prefetch_plant_image(jobs: str, plant: Dict[str, Any], index: int) -> None:
+    """Start a plant's image in the background so create_plant_images only has to collect it."""
+    name = plant.get("name") if isinstance(plant, dict) else None
+    if not isinstance(name, str) or not name.strip() or not plant_image_budget(index):
+        return
+    get_prefetcher().start(jobs, plant_image_key(name), lambda: plant_image_variants(name))
+
 
 """ 
 City Garden Graph is a state graph that defines the flow of the city garden project. 
@@ -44,12 +176,13 @@ def check_compliance(state: GardenState) -> GardenState:
     """
     Check compliance of the generated content.
     """
-    print("Checking compliance")
+    logger.info("Checking compliance", extra=fields(images=len(state["images"])))
 
     # Load the prompt template
     system_prompt = load_prompt('compliance_checker.yml', 'compliance_checker_en')
 
-    garden_image_contents = state["images"]
+    # Photos are resolved from their handles only for the request body
+    garden_image_contents = resolve_images(state["images"])
     
     # Create message content with all images
     message_content = [{'type': 'text', 'text': f"Analyze the images."}]
@@ -57,7 +190,7 @@ def check_compliance(state: GardenState) -> GardenState:
         message_content.append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/jpeg;base64,{image_content}"
+                "url": f"data:image/jpeg;base64,{base64.b64encode(image_content).decode('ascii')}"
             }
         })
     
@@ -66,10 +199,10 @@ def check_compliance(state: GardenState) -> GardenState:
         HumanMessage(content=message_content)
     ]  
     
-    response = llm.invoke(messages)
+    response = invoke_llm(messages, "check_compliance", hedge=True)
     state["compliance_check"] = response.content
     
-    print(f"Compliance check: {state['compliance_check']}")
+    logger.info("Compliance check finished", extra=fields(compliance_check=state["compliance_check"]))
     
     return state
 
@@ -79,14 +212,14 @@ def analyze_garden_conditions(state: GardenState) -> GardenState:
     Sets sun_exposure, micro_climate, hardscape_elements, and plant_inventory, environment_factors, wind_pattern.
     Environment_factors and wind_pattern are retrieved from openweathermap api and weatherbit api.
     """
-    print("Analyzing garden conditions")
+    logger.info("Analyzing garden conditions")
 
     # Load the prompt template
     system_prompt = load_prompt('env_feature_extractor.yml', 'env_feature_extractor_en')
     
-    garden_image_contents = state["images"]
+    garden_image_contents = resolve_images(state["images"])
     
-    print(f"Garden image contents loaded: {len(garden_image_contents)}")
+    logger.info("Garden image contents loaded", extra=fields(images=len(garden_image_contents)))
 
     # Create message content with all images
     message_content = [{'type': 'text', 'text': f"Analyze the images. The latitude and longitude are {state['latitude']} and {state['longitude']}."}]
@@ -94,7 +227,7 @@ def analyze_garden_conditions(state: GardenState) -> GardenState:
         message_content.append({
             "type": "image_url",
             "image_url": {
-                "url": f"data:image/jpeg;base64,{image_content}"
+                "url": f"data:image/jpeg;base64,{base64.b64encode(image_content).decode('ascii')}"
             }
         })
     
@@ -103,9 +236,9 @@ def analyze_garden_conditions(state: GardenState) -> GardenState:
         HumanMessage(content=message_content)
     ] 
     
-    response = llm.invoke(messages)
+    response = invoke_llm(messages, "analyze_garden_conditions", hedge=True)
     
-    print(f"Response: {response.content}")
+    logger.debug("Garden conditions response", extra=fields(response=response.content))
     
     response_content = response.content
     
@@ -140,12 +273,12 @@ def analyze_garden_conditions(state: GardenState) -> GardenState:
         state["wind_pattern"] = extract_value(response_content, "wind_pattern")
     else:
         state["wind_pattern"] = "None, no inpput information"
+
+    climate_profile = get_climate_profile(state["latitude"], state["longitude"])
+    state["climate_profile"] = climate_profile.as_dict() if climate_profile else None
     
     # Add a message about the analysis
-    state["messages"].append({
-        "role": "assistant",
-        "content": f"I've analyzed your garden conditions based on the provided information. {response_content}"
-    })
+    append_message(state, f"I've analyzed your garden conditions based on the provided information. {response_content}")
     
     return state
 
@@ -160,7 +293,7 @@ def generate_final_output(state: GardenState) -> GardenState:
     - Design Recommendations
     - Conclusion
     """
-    print("Generating final output")
+    logger.info("Generating final output")
     # Get garden information from state
     garden_info = f"""
     Sun exposure: {state.get('sun_exposure', 'Not analyzed')}
@@ -173,7 +306,41 @@ def generate_final_output(state: GardenState) -> GardenState:
     
     # User's preferences
     preferences = state.get('style_preferences', 'Not analyzed')
-    print(f"Preferences: {preferences}")
+    logger.info("Using style preferences", extra=fields(preferences=preferences))
+
+    # Rank the local catalog first; only its shortlist goes to the LLM
+    catalog = get_plant_catalog()
+    query = SuitabilityQuery.from_state(state)
+    shortlist = catalog.rank(query, top_k=CATALOG_SHORTLIST_SIZE)
+    logger.info("Ranked plant catalog", extra=fields(
+        shortlist=[(plant.name, round(plant.score, 2)) for plant in shortlist]
+    ))
+
+    confident = [plant for plant in shortlist if plant.score >= CATALOG_CONFIDENT_SCORE]
+    if CATALOG_SKIP_LLM and query.is_standard_profile() and len(confident) >= CATALOG_MIN_CONFIDENT:
+        state["plant_recommendations"] = [
+            catalog.recommendation(plant, plant_id)
+            for plant_id, plant in enumerate(confident[:CATALOG_MAX_RECOMMENDATIONS])
+        ]
+        state["recommendation_source"] = "catalog"
+        # The plants are known now; their images overlap with the garden image
+        state["plant_image_jobs"] = get_prefetcher().new_group()
+        for index, plant in enumerate(state["plant_recommendations"]):
+            prefetch_plant_image(state["plant_image_jobs"], plant, index)
+        logger.info("Plant recommendations answered from catalog", extra=fields(
+            names=[plant["name"] for plant in state["plant_recommendations"]]
+        ))
+        append_message(state, "I've selected the best matching plants for your balcony from the plant catalog.")
+        return state
+
+    if shortlist:
+        candidates = "\n".join(f"        - {catalog.describe(plant)}" for plant in shortlist)
+        candidate_section = f"""
+        CANDIDATE PLANTS (pre-ranked by suitability for this site, best first; recommend from this list unless a candidate clearly does not fit):
+{candidates}
+        """
+    else:
+        candidate_section = ""
 
     # Load the prompt template
     system_prompt = """  
@@ -232,129 +399,213 @@ def generate_final_output(state: GardenState) -> GardenState:
         
         USER PREFERENCES:
         {preferences}
-        
+        {candidate_section}
         Please structure the report with the sections mentioned in the system prompt.
         """)
     ]
     
-    # Generate the final report
-    response = llm.invoke(messages)
-    final_report = response.content
-    
-    print(f"Final report: {final_report}")
-    
+    # Stream the final report; each plant's image starts as soon as its entry is complete
+    state["plant_image_jobs"] = get_prefetcher().new_group()
+    entries = ArrayItemStream("plant_recommendations")
+    chunks = []
+    streamed = 0
+    started = time.monotonic()
+    for chunk in stream_llm(messages, "generate_final_output"):
+        chunks.append(chunk)
+        for plant in entries.feed(chunk):
+            logger.info("Plant recommendation streamed", extra=fields(
+                plant=plant.get("name") if isinstance(plant, dict) else None,
+                after_seconds=round(time.monotonic() - started, 3)
+            ))
+            prefetch_plant_image(state["plant_image_jobs"], plant, streamed)
+            streamed += 1
+    final_report = "".join(chunks)
+    
+    logger.debug("Final report", extra=fields(report=final_report))
+    
+    state["recommendation_source"] = "llm"
     if "plant_recommendations" in final_report:
         state["plant_recommendations"] = json.loads(final_report)["plant_recommendations"]
-        print(f"Plant Recommendations: {state['plant_recommendations']}")
     else:
         # if no plant recommendations, set an empty list
         state["plant_recommendations"] = "None, no information"
         
-    print(f"Plant Recommendations final: {state['plant_recommendations']}")
-    
-    # Store the final report in the state
-    state["final_output"] = final_report
+    if isinstance(state["plant_recommendations"], list):
+        logger.info("Plant recommendations generated", extra=fields(
+            count=len(state["plant_recommendations"]),
+            names=[plant.get("name") for plant in state["plant_recommendations"]]
+        ))
+    if debug_sampled(logger):
+        logger.debug("Plant recommendations", extra=fields(plant_recommendations=state["plant_recommendations"]))
     
-    # Add the final report to the messages
-    state["messages"].append({
-        "role": "assistant",
-        "content": "I've generated a comprehensive garden design report for you."
-    })
-    
-    state["messages"].append({
-        "role": "assistant",
-        "content": final_report
-    })
+    # The report itself is not kept: its content is in plant_recommendations
+    append_message(state, "I've generated a comprehensive garden design report for you.")
     
     return state
 
 
-def create_garden_image(state: GardenState) -> GardenState:
+def garden_image_files(image_handles: List[str]) -> List[BytesIO]:
+    """Wrap a plan's photos as the file-like objects images.edit expects."""
+    image_files = []
+    for idx, img_bytes in enumerate(resolve_images(image_handles)):
+        bio = BytesIO(img_bytes)
+        bio.name = f"image_{idx}.jpeg"  # <-- Give it a filename with proper extension!
+        image_files.append(bio)
+    return image_files
+
+
+def create_garden_image(state: GardenState, config: Optional[RunnableConfig] = None) -> GardenState:
     """
     Create a garden image based on the garden information and plant recommendations. The image should be in colorful hand-drawn style.
     The image is created by LLM. For debugging, the image is shown.
+
+    With CITY_GARDEN_PROGRESSIVE_IMAGE, a plan run under a thread id gets a low-quality preview here and
+    the full render is refined in the background (see utils/refinement.py); the plan's response and
+    status endpoint swap in the refined image once it is ready.
     """
     
-    print("Generating garden image with GPT")
+    logger.info("Generating garden image with GPT")
     
     load_dotenv()    
     
     # Get garden information from state
-    garden_image_contents = state.get('images', 'Not analyzed')
+    garden_image_contents = state.get('images', [])
     plant_recommendations = state.get('plant_recommendations', [])
     
     if not plant_recommendations:
-        print("Error: No plant recommendations found in state")
+        logger.error("No plant recommendations found in state")
         return state
-    
-    # Wrap loaded Azure images as file-like objects
-    #print("Wrapping loaded Azure images as file-like objects")
-    image_files = []
-    for idx, img_bytes in enumerate(garden_image_contents):
-        bio = BytesIO(base64.b64decode(img_bytes))
-        bio.name = f"image_{idx}.jpeg"  # <-- Give it a filename with proper extension!
-        image_files.append(bio)
 
     # Load the prompt template and format it with the plant recommendations
     system_prompt = load_prompt('image_generator.yml', 'image_generator_en').format(
         plant_recommendations=json.dumps(plant_recommendations, indent=2)
     )
 
-    
-    try:
-        response = generate_image(system_prompt, image_files, size="1024x1536", quality="medium")
-        if response is None:
-            print("Error: Failed to generate image with GPT")
-            return state
-            
-        print("Image generated successfully with GPT")
-        state["garden_image_url"] = response
-            
-    except Exception as e:
-        print(f"Error during GPT image generation: {str(e)}")
-        return state
+    plan_id = (config or {}).get("configurable", {}).get("thread_id")
+    # Under load, admission control may ask for a cheaper image and no background refinement
+    degradation = current_degradation()
+    size = degradation.garden_image_size or GARDEN_IMAGE_SIZE
+    quality = degradation.garden_image_quality or GARDEN_IMAGE_QUALITY
+    if PROGRESSIVE_GARDEN_IMAGE and degradation.refine_garden_image and plan_id:
+        # A failure fails the node, so the plan can be resumed from here
+        image_urls = generate_image_variants(
+            system_prompt, garden_image_files(garden_image_contents),
+            size=PREVIEW_IMAGE_SIZE, quality=PREVIEW_IMAGE_QUALITY
+        )
+        # The photos are read again from the plan's arena; the preview call consumed its file objects
+        get_refinements().start(plan_id, lambda: generate_image_variants(
+            system_prompt, garden_image_files(garden_image_contents), size=size, quality=quality
+        ))
+        logger.info("Garden image preview generated", extra=fields(plan_id=plan_id))
+        state["garden_image_quality"] = "preview"
+    else:
+        image_urls = generate_image_variants(
+            system_prompt, garden_image_files(garden_image_contents), size=size, quality=quality
+        )
+        logger.info("Image generated successfully with GPT")
+        state["garden_image_quality"] = "final"
+    state["garden_image_url"] = image_urls["full"]
+    state["garden_image_srcset"] = image_urls
             
     return state
 
 
-def create_plant_images(state: GardenState) -> GardenState:
+def plant_images_refinement_key(plan_id: str) -> str:
+    """Key under which a plan's deferred plant images are generated in the background."""
+    return f"{plan_id}:plant_images"
+
+
+def plant_image_entry(plant_name: str, plant_image_urls: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        "name": plant_name,
+        "image_url": plant_image_urls["full"],
+        "srcset": plant_image_urls
+    }
+
+
+def generate_deferred_plant_images(plant_names: List[str]) -> List[Dict[str, Any]]:
+    """Generate plant images that were deferred under load; plants whose image fails are left out."""
+    plant_images = []
+    for plant_name in plant_names:
+        try:
+            plant_images.append(plant_image_entry(plant_name, plant_image_variants(plant_name)))
+        except ImageGenerationError as e:
+            logger.error("Deferred plant image failed", extra=fields(plant=plant_name, error=e))
+    return plant_images
+
+
+def create_plant_images(state: GardenState, config: Optional[RunnableConfig] = None) -> GardenState:
     """
     Create plant images based on the plant recommendations. The image should be in colorful hand-drawn style.
     The image is created by LLM. For debugging, the image is shown.
+
+    Under load, admission control may cap how many images are generated during the plan, or defer
+    them: cached images are still used, the others are generated in the background (see
+    utils/refinement.py) and listed in plant_images_deferred meanwhile.
     """
-    print("Creating plant images")
-    
-    # Initialize plant_images if not exists
-    if state.get('plant_images') is None:
-        state["plant_images"] = []
+    logger.info("Creating plant images")
     
     plant_recommendations = state.get('plant_recommendations', 'Not analyzed')
     # check if plant_recommendations is a list
     if not isinstance(plant_recommendations, list):
-        print("Error: plant_recommendations is not a list")
+        logger.error("plant_recommendations is not a list")
         return state
     
     # check if plant_recommendations is empty
     if len(plant_recommendations) == 0:
-        print("Error: plant_recommendations is empty")
+        logger.error("plant_recommendations is empty")
         return state
     
-    # load prompt template
-    system_prompt = load_prompt('plant_image_generator.yml', 'plant_image_generator_en')
+    # Images started while the recommendations were streaming
+    prefetched = get_prefetcher().collect(state.get("plant_image_jobs"))
+    used = 0
+    degradation = current_degradation()
     
     # create plant images
-    for plant in plant_recommendations:
-        print(f"Creating image for {plant['name']}")
-        # create plant image
-        plant_image_url = generate_image(system_prompt.format(plant_name=plant['name']), image_files=None, image_name=plant['name'], size="1024x1024", quality="low")
-        state["plant_images"].append({
-            "name": plant['name'],
-            "image_url": plant_image_url
-        })
+    plant_images = []
+    failed = []
+    deferred = []
+    for index, plant in enumerate(plant_recommendations):
+        future = prefetched.pop(plant_image_key(plant['name']), None)
+        try:
+            if future is not None:
+                used += 1
+                logger.info("Collecting prefetched plant image", extra=fields(plant=plant['name']))
+                plant_image_urls = future.result()
+            elif plant_image_budget(index):
+                logger.info("Creating plant image", extra=fields(plant=plant['name']))
+                plant_image_urls = plant_image_variants(plant['name'])
+            else:
+                plant_image_urls = cached_plant_image_variants(plant['name'])
+                if plant_image_urls is None:
+                    if degradation.defer_plant_images:
+                        deferred.append(plant['name'])
+                    logger.info("Plant image not generated under load", extra=fields(
+                        plant=plant['name'],
+                        degradation=degradation.name,
+                        deferred=degradation.defer_plant_images
+                    ))
+                    continue
+        except ImageGenerationError as e:
+            # Keep going: the images that succeed are cached, so a resumed run only redoes the failed ones
+            failed.append(plant['name'])
+            logger.error("Plant image failed", extra=fields(plant=plant['name'], error=e))
+            continue
+        plant_images.append(plant_image_entry(plant['name'], plant_image_urls))
+    get_prefetcher().release(prefetched, used)
+    if failed:
+        raise ImageGenerationError(f"Could not generate plant images for {', '.join(failed)}")
+
+    plan_id = (config or {}).get("configurable", {}).get("thread_id")
+    if deferred and plan_id:
+        get_refinements().start(plant_images_refinement_key(plan_id), lambda: generate_deferred_plant_images(deferred))
     
+    # Replace rather than extend, so a resumed or re-planned run does not duplicate images
+    state["plant_images"] = plant_images
+    state["plant_images_deferred"] = deferred if plan_id else []
     return state
 
-def generate_image(prompt: str, image_files: Optional[List[BytesIO]] = None, image_name: str = "garden_image", size: str = "1024x1024", quality: str = "medium") -> Optional[str]:
+def generate_image(prompt: str, image_files: Optional[List[BytesIO]] = None, image_name: str = "garden_image", size: str = "1024x1024", quality: str = "medium") -> str:
     """
     Generate or edit an image using GPT.
     
@@ -364,47 +615,78 @@ def generate_image(prompt: str, image_files: Optional[List[BytesIO]] = None, ima
         image_name (str): Name for the generated image
         
     Returns:
-        Optional[str]: The generated image URL if successful, None otherwise
-    """
-    client = OpenAI()
-    try:
-        if image_files:
-            # Edit existing images
-            response = client.images.edit(
-                model="gpt-image-1",
-                image=image_files,
-                prompt=prompt             
-            )
-        else:
-            # Generate new image
-            response = client.images.generate(
-                model="gpt-image-1",
-                prompt=prompt,
-                size=size,
-                quality=quality
-            )
+        str: The URL of the full-size derivative
         
-        image_loader = AzureImageLoader(
-            account_name=os.environ["AZURE_STORAGE_ACCOUNT_NAME"],
-            account_key=os.environ["AZURE_STORAGE_ACCOUNT_KEY"]
-        )
-        
-        image_content = response.data[0].b64_json
-        blob_name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}-{image_name}.png"
+    Raises:
+        ImageGenerationError: If the image could not be generated or stored
+    """
+    return generate_image_variants(prompt, image_files, image_name, size, quality)["full"]
+
+def generate_image_variants(prompt: str, image_files: Optional[List[BytesIO]] = None, image_name: str = "garden_image", size: str = "1024x1024", quality: str = "medium") -> Dict[str, str]:
+    """
+    Generate or edit an image using GPT and upload its responsive derivatives.
+    
+    Args:
+        prompt (str): The prompt describing the desired image
+        image_files (Optional[List[BytesIO]]): List of image files to edit. If None, generates new image
+        image_name (str): Name for the generated image
         
-        image_url = image_loader.upload_image(b64decode(image_content), "images", blob_name)
-        #state[f"{image_name}_url"] = image_url
+    Returns:
+        Dict[str, str]: Derivative label ("thumbnail", "card", "full") to URL
         
-        print(f"{image_name.title()} URL: {image_url}")
+    Raises:
+        ImageGenerationError: If the image could not be generated or stored
+        DeadlineExceeded: If the request ran out of time
+    """
+    client = OpenAI(timeout=IMAGE_TIMEOUT, max_retries=1)
+    with span("generate_image", image_name=image_name, size=size, quality=quality, edit=bool(image_files)):
+        try:
+            with span("openai_image"):
+                if image_files:
+                    # Edit existing images
+                    response = client.images.edit(
+                        model="gpt-image-1",
+                        image=image_files,
+                        prompt=prompt,
+                        size=size,
+                        quality=quality,
+                        timeout=call_timeout(IMAGE_TIMEOUT, "image generation")
+                    )
+                else:
+                    # Generate new image
+                    response = client.images.generate(
+                        model="gpt-image-1",
+                        prompt=prompt,
+                        size=size,
+                        quality=quality,
+                        timeout=call_timeout(IMAGE_TIMEOUT, "image generation")
+                    )
+            record_upstream(throttled=False)
+            
+            asset_store = get_asset_store()
+            with span("encode_variants"):
+                variants = encode_variants(b64decode(response.data[0].b64_json))
+            
+            def upload(variant: ImageVariant) -> str:
+                with span("blob_upload", variant=variant.label, bytes=len(variant.data)):
+                    return asset_store.put(variant.data, content_type=variant.content_type, extension=variant.extension)
+            
+            image_urls = upload_variants(variants, upload)
+            
+            logger.info("Image uploaded", extra=fields(image_name=image_name, urls=image_urls))
+            
+            return image_urls
         
-        return image_url
-    
-    except Exception as err:
-        print(f"Error generating {image_name}:", err)
-        return None
+        except DeadlineExceeded:
+            raise
+        except Exception as err:
+            if isinstance(err, RateLimitError):
+                record_upstream(throttled=True)
+            logger.error("Error generating image", extra=fields(image_name=image_name, error=err))
+            raise ImageGenerationError(f"Could not generate {image_name}: {err}") from err
 
 # Keep the old function for backward compatibility
-def generate_image_with_gpt(prompt: str, image_files: List[BytesIO], image_name: str = "garden_image") -> Optional[str]:
+def generate_image_with_gpt(prompt: str, image_files: List[BytesIO], image_name: str = "garden_image") -> str:
     """Legacy function for image editing. Use generate_image() instead."""
     return generate_image(prompt, image_files, image_name)
 
@@ -433,21 +715,3 @@ def extract_value(text: str, key: str) -> Optional[str]:
         pattern = f'"{key}"\s*:\s*"([^"]*)"'
         match = re.search(pattern, text)
         return match.group(1) if match else None
-
-def upload_image(image_content: str, container_name: str, blob_name: str) -> str:
-    """Upload an image to Azure Blob Storage and return its URL."""
-    blob_client = BlobClient(
-        account_url=f"https://{os.environ['AZURE_STORAGE_ACCOUNT_NAME']}.blob.core.windows.net",
-        container_name=container_name,
-        blob_name=blob_name,
-        credential=os.environ['AZURE_STORAGE_ACCOUNT_KEY']
-    )
-    
-    # Convert base64 to bytes and upload
-    image_bytes = base64.b64decode(image_content)
-    blob_client.upload_blob(image_bytes, overwrite=True)
-    
-    # Generate and return the URL
-    return f"https://{os.environ['AZURE_STORAGE_ACCOUNT_NAME']}.blob.core.windows.net/{container_name}/{blob_name}"
-
-
@@ -14,6 +14,9 @@ class GardenState(TypedDict):
     environment_factors: str
     wind_pattern: Optional[str]
     style_preferences: str
+    user_preferences: Dict[str, Optional[str]]
+    climate_profile: Optional[Dict[str, Any]]
+    recommendation_source: str
     plant_recommendations: List[Dict[Any, Any]]
     location: str
     latitude: float
@@ -21,6 +24,15 @@ class GardenState(TypedDict):
     compliance_check: str
     garden_image: str
     garden_image_url: str
-    plant_images: List[Dict[str, str]]
+    garden_image_srcset: Dict[str, str]
+    # "preview" while the full render is refined in the background, else "final"
+    garden_image_quality: Optional[str]
+    plant_images: List[Dict[str, Any]]
+    # Plants whose image is generated in the background because the plan was admitted under load
+    plant_images_deferred: List[str]
+    plant_image_jobs: Optional[str]
+    # Handles into the plan's blob arena (see services/blob_arena.py), not the photos themselves
     images: List[str]
-    messages: List[Dict[str, Any]]
\ No newline at end of file
+    image_dedup: Dict[str, Any]
+    messages: List[Dict[str, Any]]
+    request_id: Optional[str]
\ No newline at end of file
@@ -1,18 +1,41 @@
+from typing import Any, Dict, Optional
+
 from langgraph.graph import StateGraph, START, END
 from city_garden.garden_state import GardenState
 from city_garden.city_garden_nodes import analyze_garden_conditions, generate_final_output, check_compliance, create_garden_image, create_plant_images
+from city_garden.utils.tracing import traced
+
+# Nodes in execution order
+NODE_ORDER = [
+    "check_compliance",
+    "analyze_garden_conditions",
+    "generate_final_output",
+    "create_garden_image",
+    "create_plant_images",
+]
 
-def build_garden_graph():
+# First node that reads each input field; everything from that node onwards depends on it
+FIELD_ENTRY_NODES = {
+    "images": "check_compliance",
+    "location": "analyze_garden_conditions",
+    "latitude": "analyze_garden_conditions",
+    "longitude": "analyze_garden_conditions",
+    "style_preferences": "generate_final_output",
+    "user_preferences": "generate_final_output",
+}
+
+def build_garden_graph(checkpointer=None):
     garden_graph = StateGraph(GardenState)
     
-    garden_graph.add_node("check_compliance", check_compliance)
+    # Every node run is a span of the request's trace
+    garden_graph.add_node("check_compliance", traced("node:check_compliance")(check_compliance))
 
-    garden_graph.add_node("analyze_garden_conditions", analyze_garden_conditions)
+    garden_graph.add_node("analyze_garden_conditions", traced("node:analyze_garden_conditions")(analyze_garden_conditions))
 
     # Add a node to generate final output
-    garden_graph.add_node("generate_final_output", generate_final_output)
-    garden_graph.add_node("create_garden_image", create_garden_image)
-    garden_graph.add_node("create_plant_images", create_plant_images)
+    garden_graph.add_node("generate_final_output", traced("node:generate_final_output")(generate_final_output))
+    garden_graph.add_node("create_garden_image", traced("node:create_garden_image")(create_garden_image))
+    garden_graph.add_node("create_plant_images", traced("node:create_plant_images")(create_plant_images))
     # Define the parallel flow
     garden_graph.add_edge(START, "check_compliance")
     
@@ -28,4 +51,103 @@ def build_garden_graph():
     garden_graph.add_edge("create_garden_image", "create_plant_images")
     garden_graph.add_edge("create_plant_images", END)
 
-    return garden_graph.compile()
\ No newline at end of file
+    return garden_graph.compile(checkpointer=checkpointer)
+
+def replan_garden(graph, config: Dict[str, Any], updates: Dict[str, Any]) -> Optional[GardenState]:
+    """
+    Re-run a checkpointed plan with changed inputs, executing only the affected nodes.
+    
+    The earliest node that reads any of the updated fields is looked up in FIELD_ENTRY_NODES.
+    The plan is forked from the checkpoint taken just before that node, the updates are applied
+    there, and the graph resumes from that node. Earlier nodes are not executed again.
+    
+    Args:
+        graph: A garden graph compiled with a checkpointer
+        config (Dict[str, Any]): Config identifying the plan, e.g. {"configurable": {"thread_id": plan_id}}
+        updates (Dict[str, Any]): New values for GardenState fields
+        
+    Returns:
+        Optional[GardenState]: The final state of the re-planned run, or None if the plan has
+        no checkpoint before the affected node (unknown plan, or the run stopped earlier)
+        
+    Raises:
+        ValueError: If updates contains a field that no node reads
+    """
+    unknown = set(updates) - set(FIELD_ENTRY_NODES)
+    if unknown:
+        raise ValueError(f"Cannot re-plan for changes to {sorted(unknown)}")
+    entry_index = min(NODE_ORDER.index(FIELD_ENTRY_NODES[key]) for key in updates)
+    entry_node = NODE_ORDER[entry_index]
+    
+    # History is newest first, so a previous re-plan's fork is preferred over the original run
+    snapshot = next(
+        (snapshot for snapshot in graph.get_state_history(config) if snapshot.next == (entry_node,)),
+        None
+    )
+    if snapshot is None:
+        return None
+    
+    previous_node = NODE_ORDER[entry_index - 1] if entry_index > 0 else START
+    fork_config = graph.update_state(snapshot.config, updates, as_node=previous_node)
+    return graph.invoke(None, fork_config)
+
+def plan_progress(graph, config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Report how far a checkpointed plan got, node by node.
+    
+    Args:
+        graph: A garden graph compiled with a checkpointer
+        config (Dict[str, Any]): Config identifying the plan
+        
+    Returns:
+        Optional[Dict[str, Any]]: "status" of the plan ("complete", "rejected", "failed" or
+        "running"), "nodes" mapping every node in NODE_ORDER to "done", "failed", "pending"
+        or "skipped", and the failed node's "error"; None for an unknown plan
+    """
+    snapshot = graph.get_state(config)
+    if not snapshot.created_at:
+        return None
+    
+    if not snapshot.next:
+        rejected = snapshot.values.get("compliance_check") not in (None, "Pass")
+        nodes = {node: "done" for node in NODE_ORDER}
+        if rejected:
+            nodes.update({node: "skipped" for node in NODE_ORDER[1:]})
+        return {"status": "rejected" if rejected else "complete", "nodes": nodes, "error": None}
+    
+    next_index = min(NODE_ORDER.index(node) for node in snapshot.next)
+    errors = {task.name: task.error for task in snapshot.tasks if task.error is not None}
+    nodes = {}
+    for index, node in enumerate(NODE_ORDER):
+        if index < next_index:
+            nodes[node] = "done"
+        else:
+            nodes[node] = "failed" if node in errors else "pending"
+    error = next(iter(errors.values()), None)
+    return {
+        "status": "failed" if errors else "running",
+        "nodes": nodes,
+        "error": f"{type(error).__name__}: {error}" if error is not None else None,
+    }
+
+def resume_garden(graph, config: Dict[str, Any]) -> Optional[GardenState]:
+    """
+    Continue a checkpointed plan from its last successful node.
+    
+    Nodes that completed are not executed again: the run restarts at the node that failed
+    (or was interrupted) with the state checkpointed before it. A plan that already
+    finished is returned as it is.
+    
+    Args:
+        graph: A garden graph compiled with a checkpointer
+        config (Dict[str, Any]): Config identifying the plan
+        
+    Returns:
+        Optional[GardenState]: The final state, or None for an unknown plan
+    """
+    snapshot = graph.get_state(config)
+    if not snapshot.created_at:
+        return None
+    if not snapshot.next:
+        return snapshot.values
+    return graph.invoke(None, config)
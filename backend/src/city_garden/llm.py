@@ -1,28 +1,72 @@
 import os
+import json
 from dotenv import load_dotenv
 from langchain_openai import AzureChatOpenAI
-from langsmith import Client
-from langchain_core.tracers import LangChainTracer
-from langchain_core.callbacks.manager import CallbackManager
+from city_garden.services.llm_router import LLMRouter, RoutedDeployment
 from city_garden.tools.climate import get_monthly_average_temperature, get_monthly_precipitation, get_wind_pattern
 
 load_dotenv()
+
+# Per-call limit in seconds; a request deadline can shorten it further
+LLM_TIMEOUT = float(os.environ.get("CITY_GARDEN_LLM_TIMEOUT", "60"))
 #verify env variables
 #print(f"AZURE_MODEL_NAME: {os.environ['AZURE_MODEL_NAME']}")
 #print(f"AZURE_ENDPOINT: {os.environ['AZURE_OPENAI_ENDPOINT']}")
 
-llm = AzureChatOpenAI(
-    azure_deployment=os.environ["AZURE_MODEL_NAME"],  # or your deployment
-    api_version="2024-12-01-preview",  # or your api version
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    # other params...
-)
-# Set up LangSmith tracing if API key is available
+
+def load_deployments() -> list:
+    """
+    Read the chat deployments to route across.
+
+    AZURE_OPENAI_DEPLOYMENTS holds a JSON list such as
+    [{"deployment": "gpt-4o", "endpoint": "https://a.openai.azure.com", "api_key_env": "AZURE_OPENAI_API_KEY_A", "weight": 2}].
+    endpoint and api_key_env default to AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY, weight to 1.
+    Without it, the single AZURE_MODEL_NAME deployment is used.
+    """
+    configured = os.environ.get("AZURE_OPENAI_DEPLOYMENTS")
+    if not configured:
+        return [{"deployment": os.environ["AZURE_MODEL_NAME"]}]
+    deployments = json.loads(configured)
+    if not isinstance(deployments, list) or not deployments:
+        raise ValueError("AZURE_OPENAI_DEPLOYMENTS must be a non-empty JSON list")
+    return deployments
+
+
+def build_chat_model(deployment: dict, max_retries: int) -> AzureChatOpenAI:
+    kwargs = {}
+    if deployment.get("endpoint"):
+        kwargs["azure_endpoint"] = deployment["endpoint"]
+    if deployment.get("api_key_env"):
+        kwargs["api_key"] = os.environ[deployment["api_key_env"]]
+    return AzureChatOpenAI(
+        azure_deployment=deployment["deployment"],  # or your deployment
+        api_version=deployment.get("api_version", "2024-12-01-preview"),  # or your api version
+        temperature=0,
+        max_tokens=None,
+        timeout=LLM_TIMEOUT,
+        # With several deployments the router fails over instead of retrying the same one
+        max_retries=max_retries,
+        include_response_headers=True,
+        **kwargs
+    )
+
+
+deployments = load_deployments()
+llm = LLMRouter([
+    RoutedDeployment(
+        name=deployment.get("name") or f"{deployment['deployment']}@{deployment.get('endpoint') or 'default'}",
+        client=build_chat_model(deployment, max_retries=2 if len(deployments) == 1 else 0),
+        weight=float(deployment.get("weight", 1.0)),
+    )
+    for deployment in deployments
+])
+# Set up LangSmith tracing if API key is available; request traces (utils/tracing.py) do not need it
 tracing_enabled = os.environ.get("LANGCHAIN_API_KEY") is not None
 if tracing_enabled:
+    from langsmith import Client
+    from langchain_core.tracers import LangChainTracer
+    from langchain_core.callbacks.manager import CallbackManager
+
     langsmith_client = Client()
     tracer = LangChainTracer(
         project_name=os.environ.get("LANGCHAIN_PROJECT")
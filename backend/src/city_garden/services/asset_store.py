@@ -0,0 +1,205 @@
+"""
+Content-addressed asset store on Azure Blob Storage.
+
+Every asset is stored under the SHA-256 of its bytes, so identical outputs are
+stored once, names never collide and URLs can be cached immutably by the CDN
+and the browser. This is the single upload path for generated and uploaded
+assets; photos streamed in by users go through BlockUpload instead, because
+their hash is only known once the last byte has arrived.
+"""
+import base64
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobClient, ContentSettings
+from dotenv import load_dotenv
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Bytes staged per block of a streamed upload
+UPLOAD_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+class BlockUpload:
+    """A blob written as a series of staged blocks and committed once complete."""
+
+    def __init__(self, blob_client: BlobClient, block_bytes: int = UPLOAD_BLOCK_BYTES):
+        """
+        Initialize the BlockUpload.
+
+        Args:
+            blob_client (BlobClient): Client of the blob to write
+            block_bytes (int): Bytes buffered before a block is staged
+        """
+        self.blob_client = blob_client
+        self.block_bytes = block_bytes
+        self.url = blob_client.url
+        self.size = 0
+        self._pending = bytearray()
+        self._block_ids: List[str] = []
+
+    def write(self, data: bytes) -> bool:
+        """Buffer data. Returns True once a full block is waiting for stage()."""
+        self._pending += data
+        self.size += len(data)
+        return len(self._pending) >= self.block_bytes
+
+    def stage(self) -> None:
+        """Upload the full blocks buffered so far. Blocking."""
+        while len(self._pending) >= self.block_bytes:
+            self._stage_block(bytes(self._pending[:self.block_bytes]))
+            del self._pending[:self.block_bytes]
+
+    def commit(self, content_type: str) -> str:
+        """
+        Stage what is left and commit all blocks as the blob's content. Blocking.
+
+        Args:
+            content_type (str): MIME type stored on the blob
+
+        Returns:
+            str: ETag of the committed blob
+        """
+        self.stage()
+        if self._pending or not self._block_ids:
+            self._stage_block(bytes(self._pending))
+            self._pending.clear()
+        response = self.blob_client.commit_block_list(
+            self._block_ids,
+            content_settings=ContentSettings(content_type=content_type, cache_control=IMMUTABLE_CACHE_CONTROL)
+        )
+        logger.info("Committed streamed upload", extra=fields(blob=self.blob_client.blob_name, bytes=self.size, blocks=len(self._block_ids)))
+        return response["etag"]
+
+    def _stage_block(self, data: bytes) -> None:
+        # Block ids must all have the same length within a blob
+        block_id = base64.b64encode(f"{len(self._block_ids):08d}".encode("ascii")).decode("ascii")
+        self.blob_client.stage_block(block_id, data)
+        self._block_ids.append(block_id)
+
+
+class AssetStore:
+    """Store blobs by content hash, skipping uploads of content that already exists."""
+
+    def __init__(self, account_name: str, account_key: str, container_name: str = "images", max_known_hashes: int = 100_000):
+        """
+        Initialize the AssetStore.
+
+        Args:
+            account_name (str): Azure Storage account name
+            account_key (str): Azure Storage account key
+            container_name (str): Default container for assets
+            max_known_hashes (int): Size of the local index of blobs known to exist
+        """
+        self.account_name = account_name
+        self.account_key = account_key
+        self.container_name = container_name
+        self.max_known_hashes = max_known_hashes
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.skipped_uploads = 0
+
+    @staticmethod
+    def blob_name_for(data: bytes, extension: str) -> str:
+        """Return the content-addressed blob name for data."""
+        return f"{hashlib.sha256(data).hexdigest()}.{extension.lstrip('.')}"
+
+    def url_for(self, container_name: str, blob_name: str) -> str:
+        return f"https://{self.account_name}.blob.core.windows.net/{container_name}/{blob_name}"
+
+    def _blob_client(self, container_name: str, blob_name: str) -> BlobClient:
+        return BlobClient(
+            account_url=f"https://{self.account_name}.blob.core.windows.net",
+            container_name=container_name,
+            blob_name=blob_name,
+            credential=self.account_key
+        )
+
+    def open_upload(self, blob_name: str, container_name: Optional[str] = None) -> BlockUpload:
+        """Start a streamed upload of a blob whose content is not known up front."""
+        return BlockUpload(self._blob_client(container_name or self.container_name, blob_name))
+
+    def _is_known(self, key) -> bool:
+        with self._lock:
+            if key in self._known:
+                self._known.move_to_end(key)
+                return True
+            return False
+
+    def _remember(self, key) -> None:
+        with self._lock:
+            self._known[key] = True
+            self._known.move_to_end(key)
+            while len(self._known) > self.max_known_hashes:
+                self._known.popitem(last=False)
+
+    def put(self, data: bytes, content_type: str, extension: str, container_name: Optional[str] = None) -> str:
+        """
+        Store data under its content hash and return its URL.
+
+        The upload is skipped when the blob is already in the local index or a
+        HEAD request shows it exists.
+
+        Args:
+            data (bytes): The asset content
+            content_type (str): MIME type stored on the blob
+            extension (str): File extension of the blob name
+            container_name (Optional[str]): Target container, defaults to the store's container
+
+        Returns:
+            str: The blob URL
+        """
+        container_name = container_name or self.container_name
+        blob_name = self.blob_name_for(data, extension)
+        url = self.url_for(container_name, blob_name)
+        key = (container_name, blob_name)
+
+        if self._is_known(key):
+            self.skipped_uploads += 1
+            return url
+
+        blob_client = self._blob_client(container_name, blob_name)
+        if blob_client.exists():
+            self.skipped_uploads += 1
+        else:
+            try:
+                blob_client.upload_blob(
+                    data,
+                    overwrite=False,
+                    content_settings=ContentSettings(content_type=content_type, cache_control=IMMUTABLE_CACHE_CONTROL)
+                )
+                self.uploads += 1
+                logger.info("Uploaded asset", extra=fields(container=container_name, blob=blob_name, bytes=len(data)))
+            except ResourceExistsError:
+                # Another request stored the same content first
+                self.skipped_uploads += 1
+
+        self._remember(key)
+        return url
+
+
+_asset_store: Optional[AssetStore] = None
+_asset_store_lock = threading.Lock()
+
+
+def get_asset_store() -> AssetStore:
+    """Return the process-wide AssetStore, so the index of known hashes is shared by all requests."""
+    global _asset_store
+    with _asset_store_lock:
+        if _asset_store is None:
+            load_dotenv()
+            _asset_store = AssetStore(
+                account_name=os.environ["AZURE_STORAGE_ACCOUNT_NAME"],
+                account_key=os.environ["AZURE_STORAGE_ACCOUNT_KEY"]
+            )
+        return _asset_store
@@ -0,0 +1,227 @@
+"""
+Per-plan arenas for large payloads referenced from the graph state.
+
+LangGraph copies and checkpoints the state after every node, so a photo kept
+in the state as base64 is stored once per step and per re-plan fork. Instead
+the API puts a plan's photos into an arena and the state only carries short
+handles ("arena:<plan id>:<sha256>"); nodes resolve a handle to bytes when
+they build an upstream request and drop the bytes again afterwards.
+
+Blobs are content-addressed and reference-counted across arenas, so the same
+facade photo used by several units of a batch is held once. An arena lives as
+long as its plan session: releasing it (when the session expires) frees every
+blob no other arena uses.
+
+Memory only holds the photos of plans in flight, plus finished plans while
+everything fits in CITY_GARDEN_ARENA_MAX_BYTES. When a plan finishes its
+arena becomes idle; once the blobs in memory exceed the budget, the blobs of
+the oldest idle arenas are spilled to CITY_GARDEN_ARENA_SPILL_DIR and read
+from there by later re-plans, resumes and background refinements. A blob
+that cannot be spilled is dropped with its arena, which then reads as
+released.
+
+Configuration (environment variables):
+    CITY_GARDEN_ARENA_MAX_BYTES   Bytes of photos kept in memory beyond plans in flight (default 256 MiB)
+    CITY_GARDEN_ARENA_SPILL_DIR   Where idle arenas are spilled (default: a directory in the temp dir)
+"""
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+HANDLE_PREFIX = "arena:"
+
+ARENA_MAX_BYTES = int(os.environ.get("CITY_GARDEN_ARENA_MAX_BYTES", str(256 * 1024 * 1024)))
+ARENA_SPILL_DIR = os.environ.get("CITY_GARDEN_ARENA_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "city-garden-arenas")
+
+
+def is_handle(value: str) -> bool:
+    return isinstance(value, str) and value.startswith(HANDLE_PREFIX)
+
+
+def _parse_handle(handle: str) -> Tuple[str, str]:
+    _, arena_id, digest = handle.split(":", 2)
+    return arena_id, digest
+
+
+class MissingBlob(KeyError):
+    """The handle's arena was released, e.g. because its plan session expired."""
+
+
+class BlobArenas:
+    """Process-wide store of reference-counted blobs, grouped into one arena per plan."""
+
+    def __init__(self, max_bytes: int = ARENA_MAX_BYTES, spill_dir: Optional[str] = ARENA_SPILL_DIR):
+        """
+        Initialize the BlobArenas.
+
+        Args:
+            max_bytes (int): Bytes kept in memory before idle arenas are spilled; plans in flight may exceed it
+            spill_dir (Optional[str]): Where idle arenas are spilled; None drops them instead
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self._blobs: Dict[str, bytes] = {}
+        self._spilled: Dict[str, int] = {}
+        self._references: Dict[str, int] = {}
+        self._arenas: Dict[str, Set[str]] = {}
+        # Arenas whose plan is not running; those with blobs still in memory, oldest first
+        self._finished: Set[str] = set()
+        self._idle: "OrderedDict[str, bool]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.spills = 0
+        self.dropped = 0
+
+    def put(self, arena_id: str, data: bytes) -> str:
+        """
+        Store data in an arena.
+
+        Args:
+            arena_id (str): Arena to add to, e.g. the plan id; created on first use
+            data (bytes): The payload
+
+        Returns:
+            str: Handle to keep in the graph state instead of the payload
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._finished.discard(arena_id)
+            self._idle.pop(arena_id, None)
+            members = self._arenas.setdefault(arena_id, set())
+            if digest not in members:
+                members.add(digest)
+                self._references[digest] = self._references.get(digest, 0) + 1
+                if digest not in self._blobs and digest not in self._spilled:
+                    self._blobs[digest] = data
+                    self._bytes += len(data)
+        return f"{HANDLE_PREFIX}{arena_id}:{digest}"
+
+    def get(self, handle: str) -> bytes:
+        """
+        Return the payload of a handle.
+
+        Raises:
+            MissingBlob: If the handle's arena has been released
+        """
+        arena_id, digest = _parse_handle(handle)
+        with self._lock:
+            if digest not in self._arenas.get(arena_id, ()):
+                raise MissingBlob(f"Blob {handle} is no longer available")
+            data = self._blobs.get(digest)
+        if data is not None:
+            return data
+        try:
+            with open(self._spill_path(digest), "rb") as spilled:
+                return spilled.read()
+        except OSError as e:
+            raise MissingBlob(f"Blob {handle} is no longer available: {e}") from e
+
+    def finish(self, arena_id: str) -> None:
+        """Mark a plan's arena idle (its run ended), and spill idle arenas beyond the memory budget."""
+        with self._lock:
+            if arena_id not in self._arenas:
+                return
+            self._finished.add(arena_id)
+            self._idle[arena_id] = True
+            self._idle.move_to_end(arena_id)
+        self._enforce_budget()
+
+    def _enforce_budget(self) -> None:
+        with self._lock:
+            while self._bytes > self.max_bytes and self._idle:
+                arena_id, _ = self._idle.popitem(last=False)
+                # Blobs a plan in flight also uses stay in memory
+                busy = set().union(*(
+                    members for other, members in self._arenas.items() if other not in self._finished
+                ))
+                for digest in self._arenas[arena_id] - busy:
+                    data = self._blobs.get(digest)
+                    if data is None:
+                        continue
+                    if not self._spill(digest, data):
+                        self._drop(arena_id)
+                        break
+                    del self._blobs[digest]
+                    self._spilled[digest] = len(data)
+                    self._bytes -= len(data)
+                    self.spills += 1
+
+    def _spill_path(self, digest: str) -> str:
+        # Per process: releasing an arena deletes its files, which another worker may not do for it
+        return os.path.join(self.spill_dir or "", str(os.getpid()), digest)
+
+    def _spill(self, digest: str, data: bytes) -> bool:
+        if self.spill_dir is None:
+            return False
+        path = self._spill_path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as spilled:
+                spilled.write(data)
+        except OSError as e:
+            logger.warning("Could not spill arena blob, dropping its arena", extra=fields(blob=digest, error=e))
+            return False
+        return True
+
+    def _drop(self, arena_id: str) -> None:
+        # Called with the lock held
+        self.dropped += 1
+        self._release(arena_id)
+
+    def release(self, arena_id: str) -> None:
+        """Drop an arena and every blob no other arena references."""
+        with self._lock:
+            self._release(arena_id)
+
+    def _release(self, arena_id: str) -> None:
+        self._finished.discard(arena_id)
+        self._idle.pop(arena_id, None)
+        for digest in self._arenas.pop(arena_id, ()):
+            self._references[digest] -= 1
+            if self._references[digest] > 0:
+                continue
+            del self._references[digest]
+            data = self._blobs.pop(digest, None)
+            if data is not None:
+                self._bytes -= len(data)
+            if self._spilled.pop(digest, None) is not None:
+                try:
+                    os.unlink(self._spill_path(digest))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "arenas": len(self._arenas),
+                "idle_arenas": len(self._idle),
+                "blobs": len(self._blobs),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "spilled_blobs": len(self._spilled),
+                "spilled_bytes": sum(self._spilled.values()),
+                "spills": self.spills,
+                "dropped_arenas": self.dropped,
+            }
+
+
+_arenas = BlobArenas()
+
+
+def get_blob_arenas() -> BlobArenas:
+    """Return the process-wide BlobArenas."""
+    return _arenas
+
+
+def resolve_images(images: List[str]) -> List[bytes]:
+    """Return the bytes of state images given as arena handles or, as before, as base64 strings."""
+    return [_arenas.get(image) if is_handle(image) else base64.b64decode(image) for image in images]
@@ -0,0 +1,461 @@
+"""
+Pluggable cache for results that are worth sharing across requests and workers.
+
+All backends store bytes under string keys with an optional TTL, evict the
+least recently used entries beyond a byte budget and count hits and misses.
+get_or_compute() is single-flight: concurrent callers of a missing key wait
+for one computation instead of repeating it. The SQLite backend extends that
+across processes with a lease row, so every worker on a host shares one
+cache file (WAL mode keeps readers from blocking the writer). The Redis
+backend is optional and needs the redis package.
+
+Waiters keep their own request deadline: they stop waiting (in process or
+on another process' lease) with DeadlineExceeded once it has passed, and
+when the computing caller fails because its own deadline ran out or its
+upstream call timed out, a waiter with time left computes the value itself.
+
+Configuration (environment variables):
+    CITY_GARDEN_CACHE_BACKEND    "memory" (default, per process; server.py defaults to "sqlite"), "sqlite", "redis" or "none"
+    CITY_GARDEN_CACHE_MAX_MB     Byte budget of the memory and SQLite backends (default 256)
+    CITY_GARDEN_CACHE_PATH       SQLite file (default: city_garden_cache.sqlite3 in the temp directory)
+    CITY_GARDEN_CACHE_REDIS_URL  Redis URL (default redis://localhost:6379/0)
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from city_garden.utils.deadline import DeadlineExceeded, check_deadline, remaining
+from city_garden.utils.shared_work import OWNER_TIME_ERRORS
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+# How long a cross-process computation may hold its lease before others take over
+LEASE_SECONDS = 120.0
+_POLL_INTERVAL = 0.05
+
+
+def cache_key(namespace: str, *parts: Any) -> str:
+    """Build a fixed-length key from a namespace and any JSON-serializable parts."""
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{namespace}:{digest[:40]}"
+
+
+def _namespace(key: str) -> str:
+    return key.split(":", 1)[0]
+
+
+class CacheBackend(ABC):
+    """Byte-valued cache with TTLs, single-flight get_or_compute and per-namespace metrics."""
+
+    name = "base"
+
+    def __init__(self):
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._counters: Counter = Counter()
+        self._counters_lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the value stored under key, or None if missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        """Store value under key for ttl seconds (None: until evicted)."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove key if present."""
+
+    def _count(self, key: str, outcome: str) -> None:
+        with self._counters_lock:
+            self._counters[(_namespace(key), outcome)] += 1
+
+    def _compute_and_store(self, key: str, compute: Callable[[], Optional[bytes]], ttl: Optional[float]) -> Optional[bytes]:
+        """Compute a missing value; backends shared between processes coordinate here."""
+        value = compute()
+        if value is not None:
+            self.set(key, value, ttl)
+        return value
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[bytes]], ttl: Optional[float] = None) -> Optional[bytes]:
+        """
+        Return the cached value of key, computing and storing it once if missing.
+
+        Args:
+            key (str): Cache key, e.g. from cache_key()
+            compute (Callable[[], Optional[bytes]]): Produces the value; None results are returned but not stored
+            ttl (Optional[float]): Seconds the value stays valid, None for no expiry
+
+        Returns:
+            Optional[bytes]: The cached or computed value
+
+        Raises:
+            DeadlineExceeded: If the caller's deadline passes while it waits for another computation
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self._count(key, "hits")
+                return value
+            with self._inflight_lock:
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._inflight[key] = future
+            if owner:
+                break
+            self._count(key, "waits")
+            left = remaining()
+            try:
+                return future.result(timeout=None if left is None else max(left, 0.0))
+            except Exception as e:
+                if not future.done():
+                    raise DeadlineExceeded("Request deadline exceeded while waiting for a cached value") from None
+                if not isinstance(e, OWNER_TIME_ERRORS):
+                    raise
+            # The owner ran out of its own time; the first waiter with time left computes instead
+            self._count(key, "takeovers")
+
+        self._count(key, "misses")
+        try:
+            value = self._compute_and_store(key, compute, ttl)
+            future.set_result(value)
+        except BaseException as e:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+        return value
+
+    def get_or_compute_json(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """get_or_compute() for JSON-serializable values; a None result is not cached."""
+        def compute_encoded() -> Optional[bytes]:
+            result = compute()
+            return None if result is None else json.dumps(result).encode("utf-8")
+
+        value = self.get_or_compute(key, compute_encoded, ttl)
+        return None if value is None else json.loads(value)
+
+    def usage(self) -> Dict[str, Any]:
+        """Entries and bytes currently stored, where the backend can tell cheaply."""
+        return {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counters_lock:
+            namespaces: Dict[str, Dict[str, int]] = {}
+            for (namespace, outcome), count in self._counters.items():
+                namespaces.setdefault(namespace, {"hits": 0, "misses": 0, "waits": 0, "takeovers": 0})[outcome] = count
+        return {"backend": self.name, "namespaces": namespaces, **self.usage()}
+
+
+class NullCache(CacheBackend):
+    """Caches nothing; get_or_compute still collapses concurrent computations in this process."""
+
+    name = "none"
+
+    def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """Per-process LRU bounded by total bytes."""
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize the MemoryCache.
+
+        Args:
+            max_bytes (int): Capacity; least recently used entries are evicted beyond it
+        """
+        super().__init__()
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.time() + ttl if ttl is not None else None)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def usage(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+
+class SQLiteCache(CacheBackend):
+    """Cache in one SQLite file in WAL mode, shared by every process on the host."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, lease_seconds: float = LEASE_SECONDS):
+        """
+        Initialize the SQLiteCache.
+
+        Args:
+            path (str): Database file; created if missing
+            max_bytes (int): Capacity; least recently used entries are evicted beyond it
+            lease_seconds (float): How long a computation may run before another process takes it over
+        """
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+                CREATE TABLE IF NOT EXISTS leases (
+                    key TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections must not cross fork()
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= now:
+            connection.execute("DELETE FROM entries WHERE key = ? AND expires_at <= ?", (key, now))
+            return None
+        connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(value)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now + ttl if ttl is not None else None, now)
+            )
+            self._evict(connection, now)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        connection.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        (total,) = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+        # Walk from the least recently used entry until enough bytes are freed
+        excess, victims = total - self.max_bytes, []
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        connection.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _acquire_lease(self, key: str, owner: str) -> bool:
+        now = time.time()
+        cursor = self._connection().execute(
+            """
+            INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.expires_at <= ?
+            """,
+            (key, owner, now + self.lease_seconds, now)
+        )
+        return cursor.rowcount == 1
+
+    def _lease_held(self, key: str) -> bool:
+        row = self._connection().execute(
+            "SELECT 1 FROM leases WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def _compute_and_store(self, key: str, compute: Callable[[], Optional[bytes]], ttl: Optional[float]) -> Optional[bytes]:
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        while not self._acquire_lease(key, owner):
+            # Another process is computing the value; wait for it to appear or for the lease to lapse
+            while self._lease_held(key):
+                check_deadline("waiting for a value cached by another process")
+                time.sleep(_POLL_INTERVAL)
+                value = self.get(key)
+                if value is not None:
+                    self._count(key, "waits")
+                    return value
+            value = self.get(key)
+            if value is not None:
+                self._count(key, "waits")
+                return value
+        try:
+            # Another process may have finished between our miss and taking the lease
+            value = self.get(key)
+            if value is None:
+                value = super()._compute_and_store(key, compute, ttl)
+            return value
+        finally:
+            self._connection().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def usage(self) -> Dict[str, Any]:
+        entries, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": entries, "bytes": size, "path": self.path}
+
+
+class RedisCache(CacheBackend):
+    """Cache in Redis, shared across hosts; eviction is left to the server's maxmemory policy."""
+
+    name = "redis"
+
+    def __init__(self, url: str, lease_seconds: float = LEASE_SECONDS):
+        """
+        Initialize the RedisCache.
+
+        Args:
+            url (str): Redis URL, e.g. redis://localhost:6379/0
+            lease_seconds (float): How long a computation may run before another process takes it over
+
+        Raises:
+            ImportError: If the redis package is not installed
+        """
+        super().__init__()
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("CITY_GARDEN_CACHE_BACKEND=redis needs the redis package (pip install redis)") from e
+        self.lease_seconds = lease_seconds
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self._client.set(key, value, px=int(ttl * 1000) if ttl is not None else None)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(key)
+
+    def _compute_and_store(self, key: str, compute: Callable[[], Optional[bytes]], ttl: Optional[float]) -> Optional[bytes]:
+        lease = f"{key}:lease"
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        while not self._client.set(lease, owner, nx=True, px=int(self.lease_seconds * 1000)):
+            check_deadline("waiting for a value cached by another process")
+            time.sleep(_POLL_INTERVAL)
+            value = self.get(key)
+            if value is not None:
+                self._count(key, "waits")
+                return value
+        try:
+            value = self.get(key)
+            if value is None:
+                value = super()._compute_and_store(key, compute, ttl)
+            return value
+        finally:
+            if self._client.get(lease) == owner.encode("utf-8"):
+                self._client.delete(lease)
+
+
+def create_cache_backend(kind: str) -> CacheBackend:
+    """Build the backend named kind, configured from the environment."""
+    max_bytes = int(float(os.environ.get("CITY_GARDEN_CACHE_MAX_MB", "256")) * 1024 * 1024)
+    if kind == "memory":
+        return MemoryCache(max_bytes=max_bytes)
+    if kind == "sqlite":
+        path = os.environ.get("CITY_GARDEN_CACHE_PATH") or os.path.join(tempfile.gettempdir(), "city_garden_cache.sqlite3")
+        return SQLiteCache(path, max_bytes=max_bytes)
+    if kind == "redis":
+        return RedisCache(os.environ.get("CITY_GARDEN_CACHE_REDIS_URL", "redis://localhost:6379/0"))
+    if kind == "none":
+        return NullCache()
+    raise ValueError(f"Unknown cache backend '{kind}'")
+
+
+_cache: Optional[CacheBackend] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CacheBackend:
+    """Return the process-wide cache backend selected by CITY_GARDEN_CACHE_BACKEND."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = create_cache_backend(os.environ.get("CITY_GARDEN_CACHE_BACKEND", "memory"))
+            logger.info("Configured cache backend", extra=fields(backend=_cache.name))
+        return _cache
@@ -0,0 +1,349 @@
+"""
+LangGraph checkpoints of plan runs in a local SQLite file.
+
+Every graph step of a plan is checkpointed under its plan id, together with
+the writes of the nodes that ran in it, including the error of a node that
+failed. A plan that failed late (for example while creating plant images)
+can therefore be resumed from its last checkpoint, and only the failed node
+and the ones after it run again. Checkpoints survive a restart of the
+process and are shared by every worker on the host; the file is in WAL
+mode, so readers do not block the writer.
+
+Retention is by age, not by any one process' view of the plans: a plan whose
+last checkpoint is older than CITY_GARDEN_CHECKPOINT_TTL_HOURS is deleted by
+a sweep that runs when a saver opens the file and then at most every
+SWEEP_INTERVAL seconds while checkpoints are written.
+
+Configuration (environment variables):
+    CITY_GARDEN_CHECKPOINT_PATH       SQLite file (default: city_garden_checkpoints.sqlite3 in the
+                                      temp directory); "memory" keeps checkpoints in process memory
+    CITY_GARDEN_CHECKPOINT_TTL_HOURS  Hours a plan is kept after its last checkpoint (default 24)
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+CHECKPOINT_TTL = float(os.environ.get("CITY_GARDEN_CHECKPOINT_TTL_HOURS", "24")) * 3600
+# Seconds between sweeps of expired plans
+SWEEP_INTERVAL = 600.0
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        parent_checkpoint_id TEXT,
+        checkpoint_type TEXT NOT NULL,
+        checkpoint BLOB NOT NULL,
+        metadata_type TEXT NOT NULL,
+        metadata BLOB NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+    );
+    CREATE TABLE IF NOT EXISTS blobs (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        version TEXT NOT NULL,
+        value_type TEXT NOT NULL,
+        value BLOB,
+        PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+    );
+    CREATE TABLE IF NOT EXISTS writes (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        task_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        channel TEXT NOT NULL,
+        value_type TEXT NOT NULL,
+        value BLOB,
+        task_path TEXT NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+    );
+    CREATE TABLE IF NOT EXISTS threads (
+        thread_id TEXT PRIMARY KEY,
+        updated_at REAL NOT NULL
+    );
+"""
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver[str]):
+    """Checkpoint saver storing checkpoints, channel values and pending writes in SQLite."""
+
+    def __init__(self, path: str, ttl: float = CHECKPOINT_TTL):
+        """
+        Initialize the SQLiteCheckpointSaver.
+
+        Args:
+            path (str): Database file; created if missing
+            ttl (float): Seconds a plan is kept after its last checkpoint
+        """
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+        # Plans written before their age was tracked start aging now
+        connection.execute(
+            "INSERT OR IGNORE INTO threads SELECT DISTINCT thread_id, ? FROM checkpoints", (time.time(),)
+        )
+        self.sweep()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections must not cross fork()
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _config(thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> RunnableConfig:
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+    def _tuple(self, row: Tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata = row
+        connection = self._connection()
+        checkpoint_ = self.serde.loads_typed((checkpoint_type, checkpoint))
+
+        channel_values = {}
+        for channel, version in checkpoint_["channel_versions"].items():
+            blob = connection.execute(
+                "SELECT value_type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version))
+            ).fetchone()
+            if blob is not None and blob[0] != "empty":
+                channel_values[channel] = self.serde.loads_typed((blob[0], blob[1]))
+
+        writes = connection.execute(
+            "SELECT task_id, idx, channel, value_type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id)
+        ).fetchall()
+        writes.sort(key=lambda write: writes_sort_key(write[5], write[0], write[1]))
+
+        return CheckpointTuple(
+            config=self._config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint={**checkpoint_, "channel_values": channel_values},
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=self._config(thread_id, checkpoint_ns, parent_id) if parent_id else None,
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, _, channel, value_type, value, _ in writes
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, "
+            "metadata_type, metadata FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        )
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id:
+            row = self._connection().execute(query + " AND checkpoint_id = ?", (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+        else:
+            # Checkpoint ids sort by creation time
+            row = self._connection().execute(query + " ORDER BY checkpoint_id DESC LIMIT 1", (thread_id, checkpoint_ns)).fetchone()
+        return self._tuple(row) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        conditions: List[str] = []
+        parameters: List[Any] = []
+        if config:
+            conditions.append("thread_id = ?")
+            parameters.append(config["configurable"]["thread_id"])
+            checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            if checkpoint_ns is not None:
+                conditions.append("checkpoint_ns = ?")
+                parameters.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                parameters.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            parameters.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection().execute(
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, "
+            f"metadata_type, metadata FROM checkpoints {where} ORDER BY checkpoint_id DESC",
+            parameters
+        ).fetchall()
+
+        remaining = limit
+        for row in rows:
+            if remaining is not None and remaining <= 0:
+                break
+            if filter:
+                metadata = self.serde.loads_typed((row[6], row[7]))
+                if not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+            if remaining is not None:
+                remaining -= 1
+            yield self._tuple(row)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        checkpoint_ = checkpoint.copy()
+        values: Dict[str, Any] = checkpoint_.pop("channel_values")
+        blobs = [
+            (thread_id, checkpoint_ns, channel, str(version), *(
+                self.serde.dumps_typed(values[channel]) if channel in values else ("empty", None)
+            ))
+            for channel, version in new_versions.items()
+        ]
+        checkpoint_type, checkpoint_data = self.serde.dumps_typed(checkpoint_)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs)
+            connection.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 checkpoint_type, checkpoint_data, metadata_type, metadata_data)
+            )
+            connection.execute("INSERT OR REPLACE INTO threads VALUES (?, ?)", (thread_id, time.time()))
+        if time.monotonic() >= self._next_sweep:
+            self.sweep()
+        return self._config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        replace, keep = [], []
+        for index, (channel, value) in enumerate(writes):
+            value_type, value_data = self.serde.dumps_typed(value)
+            row = (thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, index),
+                   channel, value_type, value_data, task_path)
+            # Special writes (errors, interrupts) replace earlier ones; a regular write already stored is kept
+            (replace if row[4] < 0 else keep).append(row)
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", replace)
+            connection.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", keep)
+
+    def delete_thread(self, thread_id: str) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            for table in ("checkpoints", "blobs", "writes", "threads"):
+                connection.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    def sweep(self) -> int:
+        """
+        Delete every plan whose last checkpoint is older than the TTL.
+
+        Returns:
+            int: Number of plans deleted
+        """
+        with self._sweep_lock:
+            self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+        connection = self._connection()
+        expired = [row[0] for row in connection.execute(
+            "SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.ttl,)
+        ).fetchall()]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        return len(expired)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Same scheme as InMemorySaver: zero-padded counter plus a random tie-breaker, so versions sort as strings
+        if current is None:
+            current_version = 0
+        elif isinstance(current, int):
+            current_version = current
+        else:
+            current_version = int(current.split(".")[0])
+        return f"{current_version + 1:032}.{random.random():016}"
+
+
+def create_checkpointer(path: Optional[str] = None) -> BaseCheckpointSaver:
+    """
+    Create the checkpointer for plan runs.
+
+    Args:
+        path (Optional[str]): SQLite file or "memory"; defaults to CITY_GARDEN_CHECKPOINT_PATH
+
+    Returns:
+        BaseCheckpointSaver: A SQLiteCheckpointSaver, or an InMemorySaver for "memory"
+    """
+    path = path or os.environ.get(
+        "CITY_GARDEN_CHECKPOINT_PATH",
+        os.path.join(tempfile.gettempdir(), "city_garden_checkpoints.sqlite3")
+    )
+    if path == "memory":
+        return InMemorySaver()
+    return SQLiteCheckpointSaver(path)
@@ -0,0 +1,194 @@
+"""
+Precomputed climate normals on a regular latitude/longitude grid.
+
+The grid file is built offline by src/build_climate_grid.py and memory-mapped
+at runtime, so a lookup reads the four surrounding cells straight from the
+page cache and interpolates between them without any network call.
+
+File layout:
+    8 bytes   magic b"CGGRID01"
+    4 bytes   little-endian uint32 length of the JSON header
+    n bytes   JSON header: lat_min, lon_min, lat_step, lon_step, rows, cols, fields, months
+    padding   up to a 16 byte boundary
+    data      little-endian float32, C order, shape (rows, cols, len(fields), months);
+              NaN marks cells without data
+"""
+import json
+import logging
+import math
+import os
+import struct
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from city_garden.utils.structured_logging import fields as log_fields
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CGGRID01"
+_ALIGNMENT = 16
+
+
+def _data_offset(header_length: int) -> int:
+    offset = len(MAGIC) + 4 + header_length
+    return offset + (-offset % _ALIGNMENT)
+
+
+def write_climate_grid(
+    path: str,
+    values: np.ndarray,
+    lat_min: float,
+    lon_min: float,
+    lat_step: float,
+    lon_step: float,
+    fields: List[str],
+) -> None:
+    """
+    Write a climate grid file.
+
+    Args:
+        path (str): Output file, replaced atomically
+        values (np.ndarray): Array of shape (rows, cols, len(fields), months)
+        lat_min (float): Latitude of row 0
+        lon_min (float): Longitude of column 0
+        lat_step (float): Degrees between rows
+        lon_step (float): Degrees between columns
+        fields (List[str]): Name of each entry of the third axis
+    """
+    rows, cols, field_count, months = values.shape
+    if field_count != len(fields):
+        raise ValueError(f"Grid has {field_count} fields but {len(fields)} names were given")
+    header = json.dumps({
+        "lat_min": lat_min,
+        "lon_min": lon_min,
+        "lat_step": lat_step,
+        "lon_step": lon_step,
+        "rows": rows,
+        "cols": cols,
+        "fields": fields,
+        "months": months,
+    }).encode("utf-8")
+    offset = _data_offset(len(header))
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.write(b"\0" * (offset - f.tell()))
+        f.write(np.ascontiguousarray(values, dtype="<f4").tobytes())
+    os.replace(tmp_path, path)
+
+
+class ClimateGrid:
+    """Read-only, memory-mapped climate grid with bilinear interpolation."""
+
+    def __init__(self, path: str):
+        """
+        Open a grid file.
+
+        Args:
+            path (str): File written by write_climate_grid
+
+        Raises:
+            ValueError: If the file is not a climate grid
+        """
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a climate grid file")
+            (header_length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+
+        self.path = path
+        self.lat_min = header["lat_min"]
+        self.lon_min = header["lon_min"]
+        self.lat_step = header["lat_step"]
+        self.lon_step = header["lon_step"]
+        self.rows = header["rows"]
+        self.cols = header["cols"]
+        self.fields = header["fields"]
+        self.values = np.memmap(
+            path,
+            dtype="<f4",
+            mode="r",
+            offset=_data_offset(header_length),
+            shape=(self.rows, self.cols, len(self.fields), header["months"]),
+        )
+
+    @property
+    def lat_max(self) -> float:
+        return self.lat_min + (self.rows - 1) * self.lat_step
+
+    @property
+    def lon_max(self) -> float:
+        return self.lon_min + (self.cols - 1) * self.lon_step
+
+    def contains(self, latitude: float, longitude: float) -> bool:
+        return self.lat_min <= latitude <= self.lat_max and self.lon_min <= longitude <= self.lon_max
+
+    def lookup(self, latitude: float, longitude: float) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Interpolate the monthly normals at a point.
+
+        Args:
+            latitude (float): Site latitude
+            longitude (float): Site longitude
+
+        Returns:
+            Optional[Dict[str, np.ndarray]]: Field name to monthly values, or None if the
+                point lies outside the grid or next to a cell without data
+        """
+        if not self.contains(latitude, longitude):
+            return None
+
+        # Fractional cell coordinates; the last row/column interpolates from the one before
+        y = (latitude - self.lat_min) / self.lat_step
+        x = (longitude - self.lon_min) / self.lon_step
+        row = min(int(math.floor(y)), max(self.rows - 2, 0))
+        col = min(int(math.floor(x)), max(self.cols - 2, 0))
+        dy = min(max(y - row, 0.0), 1.0)
+        dx = min(max(x - col, 0.0), 1.0)
+
+        cells = np.asarray(self.values[row:row + 2, col:col + 2], dtype=np.float64)
+        if cells.shape[0] == 1:
+            cells = np.concatenate([cells, cells], axis=0)
+        if cells.shape[1] == 1:
+            cells = np.concatenate([cells, cells], axis=1)
+        weights = np.array([[(1 - dy) * (1 - dx), (1 - dy) * dx], [dy * (1 - dx), dy * dx]])
+        # Cells that do not contribute must not spread their NaNs
+        cells[weights == 0] = 0.0
+        normals = np.tensordot(weights, cells, axes=([0, 1], [0, 1]))
+        if np.isnan(normals).any():
+            return None
+        return dict(zip(self.fields, normals))
+
+
+_climate_grid: Optional[ClimateGrid] = None
+_climate_grid_path: Optional[str] = None
+_climate_grid_lock = threading.Lock()
+
+
+def get_climate_grid() -> Optional[ClimateGrid]:
+    """Return the process-wide ClimateGrid from CITY_GARDEN_CLIMATE_GRID, or None if not configured."""
+    global _climate_grid, _climate_grid_path
+    path = os.environ.get("CITY_GARDEN_CLIMATE_GRID")
+    if not path:
+        return None
+    with _climate_grid_lock:
+        if _climate_grid_path != path:
+            _climate_grid_path = path
+            try:
+                _climate_grid = ClimateGrid(path)
+                logger.info("Opened climate grid", extra=log_fields(
+                    path=path,
+                    rows=_climate_grid.rows,
+                    cols=_climate_grid.cols,
+                    lat_range=(_climate_grid.lat_min, _climate_grid.lat_max),
+                    lon_range=(_climate_grid.lon_min, _climate_grid.lon_max)
+                ))
+            except (OSError, ValueError) as e:
+                logger.warning("Climate grid unavailable, using live climate data", extra=log_fields(path=path, error=e))
+                _climate_grid = None
+        return _climate_grid
@@ -1,3 +1,17 @@
+"""
+Azure Content Safety screening of photos and text.
+
+Verdicts (the four category severities) are cached in the shared cache,
+keyed by the SHA-256 of the screened bytes and the service API version, so a
+retried or regenerated request with the same photo is a local lookup
+instead of a paid call. Entries expire after CITY_GARDEN_SAFETY_CACHE_TTL
+seconds and are evicted with the rest of the cache when it is full.
+
+Configuration (environment variables):
+    CITY_GARDEN_SAFETY_CACHE_TTL  Seconds a verdict is reused (default 7 days, 0 disables caching)
+"""
+import base64
+import hashlib
 import os
 import requests
 from azure.ai.contentsafety import ContentSafetyClient
@@ -10,10 +24,20 @@ from azure.ai.contentsafety.models import (
     TextCategory
 )
 from azure.core.exceptions import HttpResponseError
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import asdict, dataclass
+from typing import Optional, Union
 from urllib.parse import urlparse
 from dotenv import load_dotenv
+import logging
+
+from city_garden.services.cache_backend import CacheBackend, cache_key, get_cache
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+SAFETY_CACHE_TTL = float(os.environ.get("CITY_GARDEN_SAFETY_CACHE_TTL", str(7 * 24 * 3600)))
+# A URL's content can change, so a verdict looked up by URL is only reused briefly
+URL_VERDICT_TTL = 300.0
 
 @dataclass
 class ImageAnalysisResult:
@@ -34,15 +58,28 @@ class TextAnalysisResult:
 class ContentAnalyzer:
     """Class for analyzing images and text using Azure Content Safety."""
     
-    def __init__(self, endpoint: str, key: str):
+    def __init__(self, endpoint: str, key: str, cache: Optional[CacheBackend] = None):
         """
         Initialize the ContentAnalyzer with Azure Content Safety credentials.
         
         Args:
             endpoint (str): Azure Content Safety endpoint URL
             key (str): Azure Content Safety API key
+            cache (Optional[CacheBackend]): Verdict cache, defaults to the shared cache
         """
         self.client = ContentSafetyClient(endpoint, AzureKeyCredential(key))
+        self.cache = cache if cache is not None else get_cache()
+        # Part of every cache key: a new service version may grade the same content differently
+        self.api_version = getattr(getattr(self.client, "_config", None), "api_version", None) or "unknown"
+
+    def _cached_verdict(self, kind: str, identity: str, analyze, ttl: float = SAFETY_CACHE_TTL) -> dict:
+        if ttl <= 0:
+            return asdict(analyze())
+        return self.cache.get_or_compute_json(
+            cache_key("content_safety", kind, self.api_version, identity),
+            lambda: asdict(analyze()),
+            ttl=ttl
+        )
     
     def _download_image(self, image_url: str) -> bytes:
         """
@@ -86,40 +123,21 @@ class ContentAnalyzer:
             requests.RequestException: If the image download fails
             HttpResponseError: If the analysis request fails
         """
-        # Download image from URL
-        image_content = self._download_image(image_url)
+        def download_and_analyze() -> ImageAnalysisResult:
+            return self.analyze_image_data(self._download_image(image_url))
 
-        # Build request
-        request = AnalyzeImageOptions(image=ImageData(content=image_content))
+        # Verdicts by URL are short-lived; the download is skipped while one is fresh
+        return ImageAnalysisResult(**self._cached_verdict("url", image_url, download_and_analyze, ttl=min(URL_VERDICT_TTL, SAFETY_CACHE_TTL)))
 
-        # Analyze image
-        try:
-            response = self.client.analyze_image(request)
-        except HttpResponseError as e:
-            print("Analyze image failed.")
-            if e.error:
-                print(f"Error code: {e.error.code}")
-                print(f"Error message: {e.error.message}")
-            raise
-
-        # Extract results for each category
-        hate_result = next(item for item in response.categories_analysis if item.category == ImageCategory.HATE)
-        self_harm_result = next(item for item in response.categories_analysis if item.category == ImageCategory.SELF_HARM)
-        sexual_result = next(item for item in response.categories_analysis if item.category == ImageCategory.SEXUAL)
-        violence_result = next(item for item in response.categories_analysis if item.category == ImageCategory.VIOLENCE)
-
-        return ImageAnalysisResult(
-            hate_severity=hate_result.severity,
-            self_harm_severity=self_harm_result.severity,
-            sexual_severity=sexual_result.severity,
-            violence_severity=violence_result.severity
-        )
-        
-    def analyze_image_data(self, image_data: bytes) -> ImageAnalysisResult:
+    def analyze_image_data(self, image_data: Union[bytes, str]) -> ImageAnalysisResult:
         """
         Analyze an image from raw bytes for safety concerns.
+
+        The verdict is cached by the SHA-256 of the image bytes, so screening the same photo
+        again does not call the service.
+
         Args:
-            image_data (bytes): Raw image data to analyze
+            image_data (Union[bytes, str]): Raw image data to analyze, or its base64 encoding
             
         Returns:
             ImageAnalysisResult: Object containing severity levels for different categories
@@ -127,6 +145,15 @@ class ContentAnalyzer:
         Raises:
             HttpResponseError: If the analysis request fails
         """
+        raw = base64.b64decode(image_data) if isinstance(image_data, str) else image_data
+        verdict = self._cached_verdict(
+            "image",
+            hashlib.sha256(raw).hexdigest(),
+            lambda: self._analyze_image_data(image_data)
+        )
+        return ImageAnalysisResult(**verdict)
+
+    def _analyze_image_data(self, image_data: Union[bytes, str]) -> ImageAnalysisResult:
         # Build request
         request = AnalyzeImageOptions(image=ImageData(content=image_data))
 
@@ -134,10 +161,10 @@ class ContentAnalyzer:
         try:
             response = self.client.analyze_image(request)
         except HttpResponseError as e:
-            print("Analyze image failed.")
-            if e.error:
-                print(f"Error code: {e.error.code}")
-                print(f"Error message: {e.error.message}")
+            logger.error("Analyze image failed", extra=fields(
+                code=e.error.code if e.error else None,
+                error=e.error.message if e.error else e
+            ))
             raise
 
         # Extract results for each category
@@ -155,7 +182,7 @@ class ContentAnalyzer:
 
     def analyze_text(self, text: str) -> TextAnalysisResult:
         """
-        Analyze text for safety concerns.
+        Analyze text for safety concerns. Verdicts are cached by the SHA-256 of the text.
         
         Args:
             text (str): Text content to analyze
@@ -166,6 +193,14 @@ class ContentAnalyzer:
         Raises:
             HttpResponseError: If the analysis request fails
         """
+        verdict = self._cached_verdict(
+            "text",
+            hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            lambda: self._analyze_text(text)
+        )
+        return TextAnalysisResult(**verdict)
+
+    def _analyze_text(self, text: str) -> TextAnalysisResult:
         # Construct request
         request = AnalyzeTextOptions(text=text)
 
@@ -173,10 +208,10 @@ class ContentAnalyzer:
         try:
             response = self.client.analyze_text(request)
         except HttpResponseError as e:
-            print("Analyze text failed.")
-            if e.error:
-                print(f"Error code: {e.error.code}")
-                print(f"Error message: {e.error.message}")
+            logger.error("Analyze text failed", extra=fields(
+                code=e.error.code if e.error else None,
+                error=e.error.message if e.error else e
+            ))
             raise
 
         # Extract results for each category
@@ -0,0 +1,232 @@
+"""
+Two-level cache for photos downloaded from Azure Blob Storage.
+
+Entries are keyed by blob identity (account host, container and blob name),
+never by the SAS query string, so a rotated SAS token still hits. Each entry
+remembers the blob's ETag: fresh entries are served without any request,
+stale ones are revalidated with a conditional GET.
+
+Level 1 is an in-memory LRU bounded by total bytes. Level 2 is an optional
+on-disk directory with its own byte cap; disk hits are promoted to memory.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedImage:
+    """A cached blob and the ETag it was downloaded with."""
+    identity: str
+    etag: str
+    data: bytes
+    validated_at: float
+
+
+class ImageCache:
+    """Byte-bounded in-memory LRU with an optional byte-bounded disk tier."""
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        fresh_for: float = 300.0,
+    ):
+        """
+        Initialize the ImageCache.
+
+        Args:
+            max_memory_bytes (int): Capacity of the in-memory tier
+            disk_dir (Optional[str]): Directory of the disk tier, None disables it
+            max_disk_bytes (int): Capacity of the disk tier
+            fresh_for (float): Seconds an entry is served without revalidation
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.fresh_for = fresh_for
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def is_fresh(self, entry: CachedImage) -> bool:
+        return time.time() - entry.validated_at < self.fresh_for
+
+    def get(self, identity: str) -> Optional[CachedImage]:
+        """Return the cached entry for identity, or None."""
+        with self._lock:
+            entry = self._memory.get(identity)
+            if entry is not None:
+                self._memory.move_to_end(identity)
+                self.hits += 1
+                return entry
+
+            entry = self._read_disk(identity)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put_memory(entry)
+            return entry
+
+    def put(self, identity: str, etag: str, data: bytes) -> CachedImage:
+        """Store data downloaded with etag, replacing any older version."""
+        entry = CachedImage(identity=identity, etag=etag, data=data, validated_at=time.time())
+        with self._lock:
+            self._put_memory(entry)
+            self._write_disk(entry)
+        return entry
+
+    def mark_validated(self, entry: CachedImage) -> None:
+        """Record that the server confirmed entry is still current."""
+        with self._lock:
+            entry.validated_at = time.time()
+            self.revalidations += 1
+            self._write_disk(entry, data_unchanged=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # In-memory tier
+
+    def _put_memory(self, entry: CachedImage) -> None:
+        previous = self._memory.pop(entry.identity, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous.data)
+        if len(entry.data) > self.max_memory_bytes:
+            return
+        self._memory[entry.identity] = entry
+        self._memory_bytes += len(entry.data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted.data)
+
+    # Disk tier: <key>.bin holds the bytes, <key>.json the identity, ETag and validation time
+
+    @staticmethod
+    def _disk_key(identity: str) -> str:
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _disk_paths(self, key: str):
+        return os.path.join(self.disk_dir, f"{key}.bin"), os.path.join(self.disk_dir, f"{key}.json")
+
+    def _scan_disk(self) -> None:
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".bin"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _read_disk(self, identity: str) -> Optional[CachedImage]:
+        if not self.disk_dir:
+            return None
+        key = self._disk_key(identity)
+        if key not in self._disk:
+            return None
+        data_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            with open(data_path, "rb") as f:
+                data = f.read()
+        except (OSError, ValueError) as e:
+            logger.warning("Dropping unreadable disk cache entry", extra=fields(key=key, error=e))
+            self._remove_disk(key)
+            return None
+        os.utime(data_path)
+        self._disk.move_to_end(key)
+        return CachedImage(identity=identity, etag=meta["etag"], data=data, validated_at=meta["validated_at"])
+
+    def _write_disk(self, entry: CachedImage, data_unchanged: bool = False) -> None:
+        if not self.disk_dir or len(entry.data) > self.max_disk_bytes:
+            return
+        key = self._disk_key(entry.identity)
+        data_path, meta_path = self._disk_paths(key)
+        try:
+            if not (data_unchanged and key in self._disk):
+                # Write to a temporary file first so readers never see a partial image
+                tmp_path = f"{data_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(entry.data)
+                os.replace(tmp_path, data_path)
+                self._disk_bytes += len(entry.data) - self._disk.pop(key, 0)
+                self._disk[key] = len(entry.data)
+            with open(meta_path, "w") as f:
+                json.dump({"identity": entry.identity, "etag": entry.etag, "validated_at": entry.validated_at}, f)
+        except OSError as e:
+            logger.warning("Failed to write disk cache entry", extra=fields(key=key, error=e))
+            return
+        self._evict_disk()
+
+    def _remove_disk(self, key: str) -> None:
+        self._disk_bytes -= self._disk.pop(key, 0)
+        for path in self._disk_paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict_disk(self) -> None:
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            self._remove_disk(next(iter(self._disk)))
+
+
+_image_cache: Optional[ImageCache] = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """Return the process-wide ImageCache configured from the environment.
+
+    Environment variables:
+        CITY_GARDEN_IMAGE_CACHE_MEMORY_MB     In-memory capacity (default 64)
+        CITY_GARDEN_IMAGE_CACHE_DIR           Disk tier directory (default: disabled)
+        CITY_GARDEN_IMAGE_CACHE_DISK_MB       Disk capacity (default 512)
+        CITY_GARDEN_IMAGE_CACHE_FRESH_SECONDS Seconds before an entry is revalidated (default 300)
+    """
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache(
+                max_memory_bytes=int(float(os.environ.get("CITY_GARDEN_IMAGE_CACHE_MEMORY_MB", "64")) * 1024 * 1024),
+                disk_dir=os.environ.get("CITY_GARDEN_IMAGE_CACHE_DIR") or None,
+                max_disk_bytes=int(float(os.environ.get("CITY_GARDEN_IMAGE_CACHE_DISK_MB", "512")) * 1024 * 1024),
+                fresh_for=float(os.environ.get("CITY_GARDEN_IMAGE_CACHE_FRESH_SECONDS", "300")),
+            )
+        return _image_cache
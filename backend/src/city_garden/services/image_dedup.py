@@ -0,0 +1,153 @@
+"""
+Near-duplicate detection for a request's uploaded photos.
+
+Each photo gets a 64-bit perceptual hash (pHash: low-frequency DCT
+coefficients of a 32x32 grey thumbnail, thresholded at their median), so
+re-shot, re-encoded or slightly re-exposed frames of the same view end up a
+few bits apart. Photos within the Hamming-distance threshold of each other
+are collapsed to the sharpest, best-exposed frame, before anything is sent
+to the vision nodes or to the image editor.
+"""
+import logging
+import os
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+# Side length used for the quality measurements
+_QUALITY_SIZE = 512
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so that dct(x) == M @ x."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _grey(image_bytes: bytes, size: int) -> np.ndarray:
+    with Image.open(BytesIO(image_bytes)) as image:
+        image.draft("L", (size, size))
+        grey = image.convert("L")
+        grey.thumbnail((size, size))
+        return np.asarray(grey, dtype=np.float64)
+
+
+def perceptual_hash(image_bytes: bytes) -> int:
+    """Return the 64-bit pHash of an encoded image."""
+    with Image.open(BytesIO(image_bytes)) as image:
+        image.draft("L", (_DCT_SIZE * 4, _DCT_SIZE * 4))
+        pixels = np.asarray(image.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    coefficients = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].ravel()
+    # The DC term only encodes overall brightness; leave it out of the median
+    bits = coefficients > np.median(coefficients[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def image_quality(image_bytes: bytes) -> float:
+    """Score sharpness and exposure of a photo; higher is better.
+
+    Sharpness is the variance of the Laplacian, discounted by how far the mean
+    brightness is from mid-grey and by the share of clipped pixels.
+    """
+    grey = _grey(image_bytes, _QUALITY_SIZE)
+    laplacian = (
+        grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] + grey[1:-1, 2:] - 4 * grey[1:-1, 1:-1]
+    )
+    sharpness = float(laplacian.var())
+    exposure = 1.0 - abs(grey.mean() - 128.0) / 128.0
+    clipped = float(((grey <= 2) | (grey >= 253)).mean())
+    return sharpness * exposure * (1.0 - clipped)
+
+
+@dataclass
+class CollapsedImage:
+    """A photo dropped as a near-duplicate of a kept one."""
+    index: int
+    kept_index: int
+    distance: int
+
+
+@dataclass
+class DedupResult:
+    """Which photos of a request were kept and which were collapsed into them."""
+    kept: List[int]
+    collapsed: List[CollapsedImage] = field(default_factory=list)
+    hashes: List[str] = field(default_factory=list)
+
+
+def collapse_near_duplicates(images: List[bytes], max_distance: Optional[int] = None) -> DedupResult:
+    """
+    Collapse near-duplicate photos to the best frame of each group.
+
+    Args:
+        images (List[bytes]): Encoded photos in request order
+        max_distance (Optional[int]): Largest Hamming distance between pHashes still considered the same view;
+            defaults to CITY_GARDEN_DEDUP_MAX_DISTANCE or 10, negative disables collapsing
+
+    Returns:
+        DedupResult: Kept indices in request order, and each collapsed photo with the index it was merged into
+    """
+    if max_distance is None:
+        max_distance = int(os.environ.get("CITY_GARDEN_DEDUP_MAX_DISTANCE", "10"))
+    hashes = [perceptual_hash(image_bytes) for image_bytes in images]
+    hex_hashes = [f"{value:016x}" for value in hashes]
+    if max_distance < 0 or len(images) < 2:
+        return DedupResult(kept=list(range(len(images))), hashes=hex_hashes)
+
+    # Union-find over all pairs within the threshold; requests carry only a handful of photos
+    parent = list(range(len(images)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(images)):
+        for j in range(i + 1, len(images)):
+            if hamming_distance(hashes[i], hashes[j]) <= max_distance:
+                parent[find(j)] = find(i)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(images)):
+        groups.setdefault(find(i), []).append(i)
+
+    kept, collapsed = [], []
+    for members in groups.values():
+        if len(members) == 1:
+            kept.append(members[0])
+            continue
+        best = max(members, key=lambda i: image_quality(images[i]))
+        kept.append(best)
+        collapsed.extend(
+            CollapsedImage(index=i, kept_index=best, distance=hamming_distance(hashes[i], hashes[best]))
+            for i in members if i != best
+        )
+
+    result = DedupResult(kept=sorted(kept), collapsed=sorted(collapsed, key=lambda c: c.index), hashes=hex_hashes)
+    if result.collapsed:
+        logger.info("Collapsed near-duplicate photos", extra=fields(
+            uploaded=len(images),
+            kept=result.kept,
+            collapsed=[(c.index, c.kept_index, c.distance) for c in result.collapsed]
+        ))
+    return result
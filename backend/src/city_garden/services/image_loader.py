@@ -1,3 +1,5 @@
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotModifiedError
 from azure.storage.blob import BlobClient
 from io import BytesIO
 from PIL import Image
@@ -6,13 +8,21 @@ import requests
 from dotenv import load_dotenv
 import os
 import base64
+import logging
+from typing import Optional
 from urllib.parse import urlparse, parse_qs
 
+from city_garden.services.image_cache import ImageCache, get_image_cache
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
 class AzureImageLoader:
-    def __init__(self, account_name: str, account_key: str):
+    def __init__(self, account_name: str, account_key: str, cache: Optional[ImageCache] = None):
         load_dotenv()
         self.account_name = os.environ["AZURE_STORAGE_ACCOUNT_NAME"]
         self.account_key = os.environ["AZURE_STORAGE_ACCOUNT_KEY"]
+        self.cache = cache if cache is not None else get_image_cache()
 
     def _parse_blob_url(self, blob_url):
         # Parse the URL to handle SAS tokens
@@ -31,8 +41,20 @@ class AzureImageLoader:
         else:
             return container_name, blob_name, None
 
-    def load_image(self, blob_url):
+    def _blob_identity(self, blob_url):
+        # Identity of the blob independent of the SAS token, so rotated tokens share cache entries
+        container_name, blob_name, _ = self._parse_blob_url(blob_url)
+        host = urlparse(blob_url).netloc or f"{self.account_name}.blob.core.windows.net"
+        return f"{host}/{container_name}/{blob_name}"
+
+    def load_image_bytes(self, blob_url):
         container_name, blob_name, sas_token = self._parse_blob_url(blob_url)
+        identity = self._blob_identity(blob_url)
+        
+        cached = self.cache.get(identity) if self.cache else None
+        if cached is not None and self.cache.is_fresh(cached):
+            logger.info("Image served from cache", extra=fields(container=container_name, blob=blob_name))
+            return cached.data
         
         # Construct the blob URL with SAS token if present
         if sas_token:
@@ -45,33 +67,35 @@ class AzureImageLoader:
                 credential=self.account_key
             )
             
-        print(f"Loading image from: {blob_url}")
+        logger.info("Loading image", extra=fields(container=container_name, blob=blob_name, revalidate=cached is not None))
         try:
-            blob_data = blob_client.download_blob().readall()
-            image_content = base64.b64encode(blob_data).decode("utf-8")
-            return image_content
+            if cached is not None:
+                # Conditional GET: the body is only transferred if the blob changed
+                downloader = blob_client.download_blob(etag=cached.etag, match_condition=MatchConditions.IfModified)
+            else:
+                downloader = blob_client.download_blob()
+            blob_data = downloader.readall()
+        except ResourceNotModifiedError:
+            self.cache.mark_validated(cached)
+            return cached.data
         except Exception as e:
-            print(f"Error loading image: {str(e)}")
+            logger.error("Error loading image", extra=fields(blob=blob_name, error=e))
             raise
+        
+        if self.cache:
+            self.cache.put(identity, downloader.properties.etag, blob_data)
+        return blob_data
+
+    def load_image(self, blob_url):
+        return base64.b64encode(self.load_image_bytes(blob_url)).decode("utf-8")
 
     def load_images(self, blob_urls):
-        print(f"Loading {len(blob_urls)} images from Azure Blob Storage")
+        logger.info("Loading images from Azure Blob Storage", extra=fields(count=len(blob_urls)))
         image_contents = []
         for blob_url in blob_urls:
             try:
                 image_contents.append(self.load_image(blob_url))
             except Exception as e:
-                print(f"Failed to load image {blob_url}: {str(e)}")
+                logger.error("Failed to load image", extra=fields(url=urlparse(blob_url).path, error=e))
                 raise
         return image_contents
-    
-    # upload image to azure blob storage
-    def upload_image(self, image_content, container_name, blob_name):
-        blob_client = BlobClient(
-            account_url=f"https://{self.account_name}.blob.core.windows.net",
-            container_name=container_name,
-            blob_name=blob_name,
-            credential=self.account_key
-        )
-        blob_client.upload_blob(image_content)
-        return blob_client.url
@@ -0,0 +1,268 @@
+"""
+Local pre-screen for uploaded photos.
+
+Runs before any paid call (content safety, the compliance vision call) and
+catches uploads that are obviously unusable: corrupt or unsupported files,
+tiny images, blank, black or blown-out frames, screenshots and duplicates
+within a request. Every check works on Pillow metadata or a reduced-size
+decode, so an image is screened in a few milliseconds.
+
+Each check has an action: "reject" fails the request, "flag" lets the image
+through but records it, "off" disables the check. Duplicates are always
+dropped from the request; with "reject" they fail it instead.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ACTIONS = {
+    "corrupt": "reject",
+    "format": "reject",
+    "too_small": "reject",
+    "too_large": "reject",
+    "blank": "reject",
+    "too_dark": "reject",
+    "too_bright": "flag",
+    "screenshot": "flag",
+    "duplicate": "flag",
+}
+
+# EXIF tags written by cameras but not by screenshot tools
+_EXIF_MAKE = 0x010F
+_EXIF_MODEL = 0x0110
+
+# Side length the image is reduced to before computing statistics
+_ANALYSIS_SIZE = 256
+
+
+@dataclass
+class PrescreenRules:
+    """Thresholds and per-check actions of the pre-screen."""
+    allowed_formats: frozenset = frozenset({"JPEG", "MPO", "PNG", "WEBP", "HEIF", "AVIF"})
+    min_side: int = 256
+    max_pixels: int = 50_000_000
+    min_entropy: float = 0.5            # bits, over the 256-level grey histogram
+    min_brightness: float = 12.0        # mean grey level 0..255
+    max_brightness: float = 245.0
+    screenshot_flat_fraction: float = 0.6
+    actions: Dict[str, str] = field(default_factory=lambda: dict(DEFAULT_ACTIONS))
+
+    @classmethod
+    def from_env(cls) -> "PrescreenRules":
+        """Build rules from the environment.
+
+        Environment variables:
+            CITY_GARDEN_PRESCREEN_MIN_SIDE        Minimum width and height in pixels (default 256)
+            CITY_GARDEN_PRESCREEN_MIN_ENTROPY     Minimum grey-level entropy in bits (default 0.5)
+            CITY_GARDEN_PRESCREEN_BRIGHTNESS      "min,max" mean grey level (default "12,245")
+            CITY_GARDEN_PRESCREEN_ACTIONS         Overrides such as "screenshot=reject,too_bright=off"
+        """
+        rules = cls()
+        rules.min_side = int(os.environ.get("CITY_GARDEN_PRESCREEN_MIN_SIDE", rules.min_side))
+        rules.min_entropy = float(os.environ.get("CITY_GARDEN_PRESCREEN_MIN_ENTROPY", rules.min_entropy))
+        brightness = os.environ.get("CITY_GARDEN_PRESCREEN_BRIGHTNESS")
+        if brightness:
+            rules.min_brightness, rules.max_brightness = (float(value) for value in brightness.split(","))
+        for override in filter(None, os.environ.get("CITY_GARDEN_PRESCREEN_ACTIONS", "").split(",")):
+            check, _, action = override.partition("=")
+            check, action = check.strip(), action.strip()
+            if check not in DEFAULT_ACTIONS or action not in ("reject", "flag", "off"):
+                raise ValueError(f"Invalid pre-screen action override '{override}'")
+            rules.actions[check] = action
+        return rules
+
+
+@dataclass
+class PrescreenResult:
+    """Outcome of screening one image."""
+    accepted: bool
+    rejected_by: List[str] = field(default_factory=list)
+    flagged_by: List[str] = field(default_factory=list)
+    stats: Dict[str, object] = field(default_factory=dict)
+    duplicate_of: Optional[int] = None
+
+
+@dataclass
+class RequestPrescreen:
+    """Outcome of screening all images of one request."""
+    accepted: bool
+    kept: List[int]
+    results: List[PrescreenResult]
+
+    @property
+    def rejected_by(self) -> List[str]:
+        return sorted({reason for result in self.results for reason in result.rejected_by})
+
+
+class ImagePrescreener:
+    """Apply PrescreenRules to images and count what the gate saved."""
+
+    def __init__(self, rules: PrescreenRules):
+        """
+        Initialize the ImagePrescreener.
+
+        Args:
+            rules (PrescreenRules): Thresholds and actions
+        """
+        self.rules = rules
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._reasons = Counter()
+
+    def _findings(self, image_bytes: bytes, stats: Dict[str, object]) -> List[str]:
+        rules = self.rules
+        try:
+            with Image.open(BytesIO(image_bytes)) as image:
+                stats.update(format=image.format, width=image.width, height=image.height)
+                if image.format not in rules.allowed_formats:
+                    return ["format"]
+                if image.width * image.height > rules.max_pixels:
+                    return ["too_large"]
+                findings = []
+                if min(image.width, image.height) < rules.min_side:
+                    findings.append("too_small")
+
+                exif = image.getexif()
+                has_camera_exif = bool(exif.get(_EXIF_MAKE) or exif.get(_EXIF_MODEL))
+
+                # Decode at reduced size: JPEG decodes straight to a DCT-scaled image
+                image.draft("RGB", (_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+                image.load()
+                small = image.convert("RGB")
+                small.thumbnail((_ANALYSIS_SIZE, _ANALYSIS_SIZE))
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+            stats["error"] = str(e)
+            return ["corrupt"]
+
+        rgb = np.asarray(small, dtype=np.int16)
+        grey = rgb.mean(axis=2)
+
+        histogram = np.bincount(grey.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+        probabilities = histogram[histogram > 0] / histogram.sum()
+        entropy = float(-(probabilities * np.log2(probabilities)).sum())
+        brightness = float(grey.mean())
+        # Share of horizontally adjacent pixels with (almost) the same colour: UI renders have large flat areas
+        flat_fraction = float((np.abs(np.diff(rgb, axis=1)).max(axis=2) <= 2).mean()) if rgb.shape[1] > 1 else 1.0
+        stats.update(entropy=round(entropy, 2), brightness=round(brightness, 1), flat_fraction=round(flat_fraction, 3))
+
+        if entropy < rules.min_entropy:
+            findings.append("blank")
+        if brightness < rules.min_brightness:
+            findings.append("too_dark")
+        elif brightness > rules.max_brightness:
+            findings.append("too_bright")
+        if not has_camera_exif and flat_fraction >= rules.screenshot_flat_fraction:
+            findings.append("screenshot")
+        return findings
+
+    def screen(self, image_bytes: bytes) -> PrescreenResult:
+        """
+        Screen a single image.
+
+        Args:
+            image_bytes (bytes): The encoded image
+
+        Returns:
+            PrescreenResult: Whether the image passes, which checks rejected or flagged it,
+                and the measured statistics
+        """
+        started = time.perf_counter()
+        stats: Dict[str, object] = {"bytes": len(image_bytes)}
+        result = PrescreenResult(accepted=True, stats=stats)
+        for finding in self._findings(image_bytes, stats):
+            action = self.rules.actions.get(finding, "reject")
+            if action == "reject":
+                result.rejected_by.append(finding)
+            elif action == "flag":
+                result.flagged_by.append(finding)
+        result.accepted = not result.rejected_by
+        stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        with self._lock:
+            self._counters["screened_images"] += 1
+            self._counters["rejected_images"] += not result.accepted
+            self._counters["flagged_images"] += bool(result.flagged_by)
+            self._reasons.update(result.rejected_by + result.flagged_by)
+        return result
+
+    def screen_request(self, images: List[bytes]) -> RequestPrescreen:
+        """
+        Screen all images of a request before any paid call is made for them.
+
+        Args:
+            images (List[bytes]): The encoded images in request order
+
+        Returns:
+            RequestPrescreen: Whether the request may proceed and the indices of the images
+                to keep (duplicates removed)
+        """
+        results, kept, seen = [], [], {}
+        for index, image_bytes in enumerate(images):
+            digest = hashlib.sha256(image_bytes).digest()
+            if digest in seen and self.rules.actions["duplicate"] != "off":
+                duplicate = self.rules.actions["duplicate"] == "reject"
+                results.append(PrescreenResult(
+                    accepted=not duplicate,
+                    rejected_by=["duplicate"] if duplicate else [],
+                    flagged_by=[] if duplicate else ["duplicate"],
+                    duplicate_of=seen[digest],
+                ))
+                with self._lock:
+                    self._reasons["duplicate"] += 1
+                    self._counters["duplicates_dropped"] += not duplicate
+                    # The duplicate never reaches content safety
+                    self._counters["saved_content_safety_calls"] += not duplicate
+                continue
+            seen.setdefault(digest, index)
+            results.append(self.screen(image_bytes))
+            kept.append(index)
+
+        accepted = all(result.accepted for result in results)
+        if not accepted:
+            with self._lock:
+                self._counters["rejected_requests"] += 1
+                # Every unique image would have gone to content safety, then one compliance call
+                self._counters["saved_content_safety_calls"] += len(kept)
+                self._counters["saved_compliance_calls"] += 1
+        return RequestPrescreen(accepted=accepted, kept=kept, results=results)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            counters = {name: self._counters[name] for name in (
+                "screened_images",
+                "rejected_images",
+                "flagged_images",
+                "duplicates_dropped",
+                "rejected_requests",
+                "saved_content_safety_calls",
+                "saved_compliance_calls",
+            )}
+            counters["reasons"] = dict(self._reasons)
+            return counters
+
+
+_prescreener = None
+_prescreener_lock = threading.Lock()
+
+
+def get_image_prescreener() -> ImagePrescreener:
+    """Return the process-wide ImagePrescreener, so its counters cover all requests."""
+    global _prescreener
+    with _prescreener_lock:
+        if _prescreener is None:
+            _prescreener = ImagePrescreener(PrescreenRules.from_env())
+            logger.info("Configured image pre-screen", extra=fields(actions=_prescreener.rules.actions))
+        return _prescreener
@@ -0,0 +1,196 @@
+"""
+Streamed photo uploads straight into Blob Storage.
+
+The request body is consumed chunk by chunk: each chunk is hashed, fed to an
+incremental image decoder and buffered into blocks that are staged on the
+blob while the rest is still arriving, so no more than one block of the raw
+photo is held at a time. Once the body is complete the blocks are committed
+and a thumbnail is stored. The caller gets a handle ("upload:<blob name>")
+that /api/garden_plan accepts in place of a SAS URL; the first plan using it
+downloads the photo into the photo cache, where later plans find it.
+
+Configuration (environment variables):
+    CITY_GARDEN_UPLOAD_CONTAINER  Container for uploaded photos (default "uploads")
+    CITY_GARDEN_UPLOAD_MAX_MB     Largest accepted photo (default 20)
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+from io import BytesIO
+from typing import AsyncIterator, Optional, Tuple
+from urllib.parse import urlparse
+
+from PIL import Image, ImageFile, ImageOps
+
+from city_garden.services.asset_store import AssetStore
+from city_garden.services.image_cache import get_image_cache
+from city_garden.services.image_variants import DERIVATIVE_WIDTHS, IMAGE_FORMATS, resolve_format
+from city_garden.utils.multipart_stream import MultipartFileStream, parse_boundary
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_HANDLE_PREFIX = "upload:"
+UPLOAD_CONTAINER = os.environ.get("CITY_GARDEN_UPLOAD_CONTAINER", "uploads")
+UPLOAD_MAX_BYTES = int(float(os.environ.get("CITY_GARDEN_UPLOAD_MAX_MB", "20")) * 1024 * 1024)
+
+# Pillow format -> content type stored on the blob
+UPLOAD_CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+class UploadRejected(ValueError):
+    """The upload is not an acceptable photo."""
+
+
+class UploadTooLarge(UploadRejected):
+    """The upload is larger than CITY_GARDEN_UPLOAD_MAX_MB."""
+
+
+@dataclass
+class UploadResult:
+    """A stored upload and what was learned about it while streaming."""
+    handle: str
+    url: str
+    sha256: str
+    size: int
+    content_type: str
+    width: int
+    height: int
+    thumbnail_url: str
+
+
+def is_upload_handle(value: str) -> bool:
+    return value.startswith(UPLOAD_HANDLE_PREFIX)
+
+
+def upload_url(store: AssetStore, handle: str) -> str:
+    """
+    Return the blob URL of an upload handle.
+
+    Raises:
+        UploadRejected: If the handle is malformed
+    """
+    blob_name = handle[len(UPLOAD_HANDLE_PREFIX):]
+    if not is_upload_handle(handle) or not blob_name or "/" in blob_name:
+        raise UploadRejected(f"Invalid upload handle {handle!r}")
+    return store.url_for(UPLOAD_CONTAINER, blob_name)
+
+
+def _cache_identity(url: str) -> str:
+    # Same identity AzureImageLoader uses: host, container and blob name
+    parsed = urlparse(url)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def cached_upload(url: str) -> Optional[bytes]:
+    """Return an upload's bytes if this process still has them cached."""
+    entry = get_image_cache().get(_cache_identity(url))
+    # Upload blobs are never overwritten, so a cached copy needs no revalidation
+    return entry.data if entry is not None else None
+
+
+def _thumbnail(image: Image.Image) -> Tuple[bytes, str, str]:
+    pil_format, content_type, extension = IMAGE_FORMATS[resolve_format()]
+    thumbnail = ImageOps.exif_transpose(image).convert("RGB")
+    width = DERIVATIVE_WIDTHS["thumbnail"]
+    thumbnail.thumbnail((width, width), Image.LANCZOS)
+    buffer = BytesIO()
+    thumbnail.save(buffer, format=pil_format, quality=80)
+    return buffer.getvalue(), content_type, extension
+
+
+async def receive_upload(
+    chunks: AsyncIterator[bytes],
+    content_type: str,
+    store: AssetStore,
+    max_bytes: int = UPLOAD_MAX_BYTES,
+) -> UploadResult:
+    """
+    Stream an upload into Blob Storage.
+
+    Args:
+        chunks (AsyncIterator[bytes]): The request body as it arrives
+        content_type (str): The request's Content-Type: multipart/form-data with a "file"
+            field, or the photo's own image/* type for a raw body
+        store (AssetStore): Store of the blob and its thumbnail
+        max_bytes (int): Largest accepted photo
+
+    Returns:
+        UploadResult: Handle, hash, dimensions and thumbnail of the stored photo
+
+    Raises:
+        UploadRejected: If the body holds no photo or one that cannot be decoded
+        UploadTooLarge: If the photo exceeds max_bytes
+    """
+    boundary = parse_boundary(content_type)
+    if boundary is not None:
+        multipart = MultipartFileStream(boundary, field="file")
+    elif content_type.startswith("image/"):
+        multipart = None
+    else:
+        raise UploadRejected("Expected multipart/form-data with a 'file' field or an image/* body")
+
+    blob_name = uuid.uuid4().hex
+    upload = store.open_upload(blob_name, UPLOAD_CONTAINER)
+    digest = hashlib.sha256()
+    decoder = ImageFile.Parser()
+
+    async for chunk in chunks:
+        content = multipart.feed(chunk) if multipart is not None else chunk
+        if not content:
+            continue
+        if upload.size + len(content) > max_bytes:
+            raise UploadTooLarge(f"Upload larger than {max_bytes // (1024 * 1024)} MB")
+        digest.update(content)
+        # Decoding proceeds while the body streams, so only the tail is left once it ends
+        try:
+            decoder.feed(content)
+        except Image.DecompressionBombError as e:
+            raise UploadRejected(f"Image too large to decode: {e}")
+        if upload.write(content):
+            await asyncio.to_thread(upload.stage)
+
+    if multipart is not None and not multipart.complete:
+        raise UploadRejected("No complete 'file' field in the upload")
+    if not upload.size:
+        raise UploadRejected("Empty upload")
+    try:
+        image = decoder.close()
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(f"Image too large to decode: {e}")
+    except (OSError, SyntaxError) as e:
+        raise UploadRejected(f"Not a supported image: {e}")
+    if image.format not in UPLOAD_CONTENT_TYPES:
+        raise UploadRejected(f"Unsupported image format {image.format}")
+    photo_type = UPLOAD_CONTENT_TYPES[image.format]
+
+    thumbnail, thumbnail_type, thumbnail_extension = await asyncio.to_thread(_thumbnail, image)
+    _, thumbnail_url = await asyncio.gather(
+        asyncio.to_thread(upload.commit, photo_type),
+        asyncio.to_thread(store.put, thumbnail, thumbnail_type, thumbnail_extension),
+    )
+
+    result = UploadResult(
+        handle=f"{UPLOAD_HANDLE_PREFIX}{blob_name}",
+        url=upload.url,
+        sha256=digest.hexdigest(),
+        size=upload.size,
+        content_type=photo_type,
+        width=image.width,
+        height=image.height,
+        thumbnail_url=thumbnail_url,
+    )
+    logger.info("Stored upload", extra=fields(
+        handle=result.handle,
+        bytes=result.size,
+        sha256=result.sha256,
+        filename=multipart.filename if multipart is not None else None
+    ))
+    return result
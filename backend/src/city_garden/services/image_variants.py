@@ -0,0 +1,133 @@
+"""
+Responsive derivatives for generated images.
+
+gpt-image-1 returns a full-size PNG. Before it is stored, the image is
+re-encoded to a compact format (WebP by default, AVIF or JPEG optionally) at
+several widths, so the UI can download a small card-sized image instead of
+the multi-megabyte original.
+"""
+import contextvars
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image, features
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+# Target widths per derivative label; None keeps the original width
+DERIVATIVE_WIDTHS: Dict[str, Optional[int]] = {
+    "thumbnail": 256,
+    "card": 512,
+    "full": None,
+}
+
+# format name -> (Pillow format, content type, file extension)
+IMAGE_FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp"),
+    "avif": ("AVIF", "image/avif", "avif"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+
+@dataclass
+class ImageVariant:
+    """One encoded derivative of a generated image."""
+    label: str
+    width: int
+    height: int
+    content_type: str
+    extension: str
+    data: bytes
+
+
+def resolve_format(preferred: Optional[str] = None) -> str:
+    """Return the configured output format, falling back to JPEG if Pillow cannot encode it."""
+    name = (preferred or os.environ.get("CITY_GARDEN_IMAGE_FORMAT", "webp")).lower()
+    if name not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format '{name}', expected one of {sorted(IMAGE_FORMATS)}")
+    if name != "jpeg" and not features.check(name):
+        logger.warning("Image format not supported by Pillow, using JPEG", extra=fields(format=name))
+        return "jpeg"
+    return name
+
+
+def encode_variants(
+    image_bytes: bytes,
+    image_format: Optional[str] = None,
+    widths: Optional[Dict[str, Optional[int]]] = None,
+    quality: Optional[int] = None,
+) -> List[ImageVariant]:
+    """
+    Encode an image at each derivative width in a compact format.
+
+    Args:
+        image_bytes (bytes): The source image, e.g. the PNG returned by gpt-image-1
+        image_format (Optional[str]): "webp", "avif" or "jpeg"; defaults to CITY_GARDEN_IMAGE_FORMAT
+        widths (Optional[Dict[str, Optional[int]]]): Label to target width, defaults to DERIVATIVE_WIDTHS
+        quality (Optional[int]): Encoder quality, defaults to CITY_GARDEN_IMAGE_QUALITY or 80
+
+    Returns:
+        List[ImageVariant]: One variant per label. Images are never upscaled.
+    """
+    name = resolve_format(image_format)
+    pil_format, content_type, extension = IMAGE_FORMATS[name]
+    quality = quality or int(os.environ.get("CITY_GARDEN_IMAGE_QUALITY", "80"))
+    widths = widths or DERIVATIVE_WIDTHS
+
+    with Image.open(BytesIO(image_bytes)) as source:
+        source.load()
+        # JPEG has no alpha channel; WebP/AVIF keep it
+        mode = "RGB" if name == "jpeg" or source.mode not in ("RGB", "RGBA") else source.mode
+        source = source.convert(mode)
+
+        variants = []
+        for label, width in widths.items():
+            if width is None or width >= source.width:
+                resized = source
+            else:
+                height = max(1, round(source.height * width / source.width))
+                resized = source.resize((width, height), Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, format=pil_format, quality=quality)
+            variants.append(ImageVariant(
+                label=label,
+                width=resized.width,
+                height=resized.height,
+                content_type=content_type,
+                extension=extension,
+                data=buffer.getvalue(),
+            ))
+
+    logger.info("Encoded image variants", extra=fields(
+        format=name,
+        source_bytes=len(image_bytes),
+        variant_bytes={variant.label: len(variant.data) for variant in variants}
+    ))
+    return variants
+
+
+def upload_variants(
+    variants: List[ImageVariant],
+    upload: Callable[[ImageVariant], str],
+) -> Dict[str, str]:
+    """
+    Upload all variants concurrently.
+
+    Args:
+        variants (List[ImageVariant]): The encoded derivatives
+        upload (Callable[[ImageVariant], str]): Uploads one variant and returns its URL
+
+    Returns:
+        Dict[str, str]: srcset-style map of derivative label to URL
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(variants))) as executor:
+        # Each upload runs in a copy of the caller's context, so request ids and trace spans carry over
+        futures = [executor.submit(contextvars.copy_context().run, upload, variant) for variant in variants]
+        urls = [future.result() for future in futures]
+    return {variant.label: url for variant, url in zip(variants, urls)}
@@ -0,0 +1,368 @@
+"""
+Route chat calls across several Azure OpenAI deployments.
+
+Each deployment has its own TPM quota, so spreading calls over several of
+them raises the throughput ceiling. For every call the router picks the
+healthy deployment with the fewest outstanding requests per unit of weight,
+preferring deployments whose remaining quota (read from the
+x-ratelimit-remaining-* response headers) is not exhausted. Deployments
+that answer 5xx or cannot be reached trip a circuit breaker and are skipped
+until a cool-down has passed; the failed call is retried on the next
+deployment, so callers never see the failover. The last deployment whose
+circuit is not open keeps taking calls, so a single deployment never fails
+fast. A 429 is a quota, not an outage: the deployment is skipped for its
+Retry-After, and a call that finds every deployment throttled waits for the
+first one to come back (within the request deadline) instead of failing.
+
+The router exposes invoke/ainvoke/stream like a chat model, so nodes keep calling
+one llm object.
+"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import openai
+
+from city_garden.utils.admission import record_upstream
+from city_garden.utils.deadline import remaining
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+# Below this many remaining tokens a deployment is treated as out of quota
+LOW_QUOTA_TOKENS = 2000
+# Seconds a deployment is skipped after a 429 without Retry-After
+RATE_LIMIT_BACKOFF = 1.0
+# A call waits at most this often, and this long each time, for a throttled deployment
+MAX_THROTTLE_WAITS = 3
+MAX_THROTTLE_WAIT = 30.0
+
+
+class CircuitBreaker:
+    """Closed -> open after consecutive failures -> half-open trial after a cool-down."""
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0):
+        """
+        Initialize the CircuitBreaker.
+
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            cooldown (float): Seconds the circuit stays open unless the upstream asks for longer
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.open_until == 0.0:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def allows_call(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # One trial call at a time once the cool-down has passed
+        return state == "half_open" and not self._trial_running
+
+    def on_start(self) -> None:
+        if self.state == "half_open":
+            self._trial_running = True
+
+    def on_success(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+        self._trial_running = False
+
+    def on_cancel(self) -> None:
+        self._trial_running = False
+
+    def on_failure(self, retry_after: Optional[float] = None, may_open: bool = True) -> None:
+        """
+        Count a failed call.
+
+        Args:
+            retry_after (Optional[float]): Cool-down asked for by the upstream, instead of the default one
+            may_open (bool): False for the last deployment still taking calls, whose circuit stays closed
+        """
+        self.failures += 1
+        self._trial_running = False
+        if not may_open:
+            self.open_until = 0.0
+        elif self.failures >= self.failure_threshold or self.open_until:
+            self.open_until = time.monotonic() + max(self.cooldown if retry_after is None else retry_after, 0.1)
+
+
+@dataclass
+class DeploymentState:
+    """Live load and quota of one deployment."""
+    outstanding: int = 0
+    calls: int = 0
+    failures: int = 0
+    remaining_requests: Optional[int] = None
+    remaining_tokens: Optional[int] = None
+    # Monotonic time until which the deployment is skipped after a 429
+    throttled_until: float = 0.0
+
+
+class RoutedDeployment:
+    """A chat model client for one deployment plus its routing state."""
+
+    def __init__(self, name: str, client: Any, weight: float = 1.0, breaker: Optional[CircuitBreaker] = None):
+        """
+        Initialize the RoutedDeployment.
+
+        Args:
+            name (str): Deployment name, used in logs and metrics
+            client (Any): Chat model for the deployment, e.g. an AzureChatOpenAI
+            weight (float): Relative share of traffic, e.g. proportional to the deployment's TPM quota
+            breaker (Optional[CircuitBreaker]): Circuit breaker, a default one if None
+        """
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.breaker = breaker or CircuitBreaker()
+        self.state = DeploymentState()
+
+    def quota_exhausted(self) -> bool:
+        state = self.state
+        return (state.remaining_requests is not None and state.remaining_requests <= 0) or \
+            (state.remaining_tokens is not None and state.remaining_tokens < LOW_QUOTA_TOKENS)
+
+    def throttled(self) -> bool:
+        return self.state.throttled_until > time.monotonic()
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header in ("retry-after-ms", "retry-after"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if header == "retry-after-ms" else seconds
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """429s, 5xx, timeouts and connection errors are the deployment's fault; try another one."""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, TimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class NoHealthyDeployment(RuntimeError):
+    """Every deployment is unavailable or failed for this call."""
+
+
+class LLMRouter:
+    """Chat-model facade that balances and fails over across deployments."""
+
+    def __init__(self, deployments: List[RoutedDeployment]):
+        """
+        Initialize the LLMRouter.
+
+        Args:
+            deployments (List[RoutedDeployment]): The deployments to route across
+        """
+        if not deployments:
+            raise ValueError("At least one deployment is required")
+        self.deployments = deployments
+        self._lock = threading.Lock()
+
+    @property
+    def callbacks(self):
+        return self.deployments[0].client.callbacks
+
+    @callbacks.setter
+    def callbacks(self, callbacks) -> None:
+        for deployment in self.deployments:
+            deployment.client.callbacks = callbacks
+
+    def _acquire(self, tried: Set[str]) -> Optional[RoutedDeployment]:
+        """Pick the least-loaded healthy deployment not tried yet and count the call as outstanding."""
+        with self._lock:
+            candidates = [
+                deployment for deployment in self.deployments
+                if deployment.name not in tried and deployment.breaker.allows_call() and not deployment.throttled()
+            ]
+            if not candidates:
+                return None
+            chosen = min(candidates, key=lambda deployment: (
+                deployment.quota_exhausted(),
+                (deployment.state.outstanding + 1) / deployment.weight,
+                -(deployment.state.remaining_tokens or 0),
+            ))
+            chosen.breaker.on_start()
+            chosen.state.outstanding += 1
+            chosen.state.calls += 1
+            tried.add(chosen.name)
+            return chosen
+
+    def _release(self, deployment: RoutedDeployment, response: Any = None, error: Optional[Exception] = None) -> None:
+        # 429s feed admission control as well as the breaker
+        record_upstream(throttled=isinstance(error, openai.RateLimitError))
+        with self._lock:
+            deployment.state.outstanding -= 1
+            if error is None:
+                deployment.breaker.on_success()
+                headers = (getattr(response, "response_metadata", None) or {}).get("headers") or {}
+                for header, attribute in (
+                    ("x-ratelimit-remaining-requests", "remaining_requests"),
+                    ("x-ratelimit-remaining-tokens", "remaining_tokens"),
+                ):
+                    if header in headers:
+                        try:
+                            setattr(deployment.state, attribute, int(float(headers[header])))
+                        except ValueError:
+                            pass
+                return
+            if not _is_retryable(error):
+                # A bad request (e.g. a content-filter 400) is the caller's problem, not the deployment's
+                deployment.breaker.on_cancel()
+                return
+            deployment.state.failures += 1
+            if isinstance(error, openai.RateLimitError):
+                # Out of quota, not down: skip it for a while without opening the circuit
+                retry_after = _retry_after(error)
+                deployment.state.remaining_requests = 0
+                deployment.state.throttled_until = time.monotonic() + (RATE_LIMIT_BACKOFF if retry_after is None else retry_after)
+                deployment.breaker.on_cancel()
+            else:
+                last_healthy = not any(
+                    other.breaker.state != "open" for other in self.deployments if other is not deployment
+                )
+                deployment.breaker.on_failure(retry_after=_retry_after(error), may_open=not last_healthy)
+        logger.warning("Deployment call failed", extra=fields(
+            deployment=deployment.name,
+            error=error,
+            circuit=deployment.breaker.state
+        ))
+
+    def _throttle_delay(self, tried: Set[str], last_error: Optional[Exception], waits: int) -> float:
+        """
+        Seconds to wait before trying the rate-limited deployments again, when no other one is left.
+
+        The throttled deployments are made eligible again for the call.
+
+        Raises:
+            Exception: The last error of the call (or NoHealthyDeployment) if there is nothing to wait
+                for, or waiting would exceed MAX_THROTTLE_WAITS, MAX_THROTTLE_WAIT or the request deadline
+        """
+        with self._lock:
+            throttled = [
+                deployment for deployment in self.deployments
+                if deployment.throttled() and deployment.breaker.allows_call()
+            ]
+            delay = min((deployment.state.throttled_until for deployment in throttled), default=0.0) - time.monotonic()
+        left = remaining()
+        if not throttled or waits >= MAX_THROTTLE_WAITS or delay > MAX_THROTTLE_WAIT or (left is not None and delay >= left):
+            if last_error is not None:
+                raise last_error
+            raise NoHealthyDeployment("No healthy LLM deployment available")
+        tried.difference_update(deployment.name for deployment in throttled)
+        return max(delay, 0.0)
+
+    def invoke(self, messages, *args, **kwargs):
+        tried, last_error, waits = set(), None, 0
+        while True:
+            deployment = self._acquire(tried)
+            if deployment is None:
+                time.sleep(self._throttle_delay(tried, last_error, waits))
+                waits += 1
+                continue
+            try:
+                response = deployment.client.invoke(messages, *args, **kwargs)
+            except Exception as e:
+                self._release(deployment, error=e)
+                if not _is_retryable(e):
+                    raise
+                last_error = e
+                continue
+            self._release(deployment, response=response)
+            return response
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        tried, last_error, waits = set(), None, 0
+        while True:
+            deployment = self._acquire(tried)
+            if deployment is None:
+                await asyncio.sleep(self._throttle_delay(tried, last_error, waits))
+                waits += 1
+                continue
+            try:
+                response = await deployment.client.ainvoke(messages, *args, **kwargs)
+            except asyncio.CancelledError:
+                # A hedged call lost the race; not the deployment's fault
+                with self._lock:
+                    deployment.state.outstanding -= 1
+                    deployment.breaker.on_cancel()
+                raise
+            except Exception as e:
+                self._release(deployment, error=e)
+                if not _is_retryable(e):
+                    raise
+                last_error = e
+                continue
+            self._release(deployment, response=response)
+            return response
+
+    def stream(self, messages, *args, **kwargs) -> Iterator[Any]:
+        """Stream chunks from one deployment; failover is only possible before the first chunk."""
+        tried, last_error, waits = set(), None, 0
+        while True:
+            deployment = self._acquire(tried)
+            if deployment is None:
+                time.sleep(self._throttle_delay(tried, last_error, waits))
+                waits += 1
+                continue
+            first_chunk = None
+            try:
+                for chunk in deployment.client.stream(messages, *args, **kwargs):
+                    if first_chunk is None:
+                        # Response headers arrive with the first chunk
+                        first_chunk = chunk
+                    yield chunk
+            except GeneratorExit:
+                # The caller stopped reading; not the deployment's fault
+                with self._lock:
+                    deployment.state.outstanding -= 1
+                    deployment.breaker.on_cancel()
+                raise
+            except Exception as e:
+                self._release(deployment, error=e)
+                if first_chunk is not None or not _is_retryable(e):
+                    raise
+                last_error = e
+                continue
+            self._release(deployment, response=first_chunk)
+            return
+
+    def bind_tools(self, *args, **kwargs):
+        return self.deployments[0].client.bind_tools(*args, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                deployment.name: {
+                    "weight": deployment.weight,
+                    "outstanding": deployment.state.outstanding,
+                    "calls": deployment.state.calls,
+                    "failures": deployment.state.failures,
+                    "remaining_requests": deployment.state.remaining_requests,
+                    "remaining_tokens": deployment.state.remaining_tokens,
+                    "circuit": deployment.breaker.state,
+                    "throttled_seconds": round(max(deployment.state.throttled_until - time.monotonic(), 0.0), 2),
+                }
+                for deployment in self.deployments
+            }
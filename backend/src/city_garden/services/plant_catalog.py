@@ -0,0 +1,298 @@
+"""
+Local plant catalog and vectorized suitability ranking.
+
+The catalog is held as columnar NumPy arrays, one array per attribute, so a
+query scores every species at once with a handful of array operations. This
+keeps ranking of catalogs with thousands of species in the low milliseconds.
+
+Ordinal columns:
+    sun_min / sun_max   0 = shade, 1 = partial sun, 2 = full sun
+    wind_tolerance      0 = needs shelter, 1 = moderate wind, 2 = exposed sites
+    container           0..1, how well the plant does in a pot
+    winter_indoors      1 if the plant can be overwintered indoors
+"""
+import csv
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))),
+    "data",
+    "plant_catalog.csv"
+)
+
+NUMERIC_COLUMNS = ["min_temp_c", "max_temp_c", "sun_min", "sun_max", "wind_tolerance", "container", "winter_indoors"]
+CATEGORY_COLUMNS = ["category", "subtype", "cycle"]
+TEXT_COLUMNS = ["description", "growingConditions", "plantingTips", "care_tips", "harvestingTips"]
+
+# Values the frontend sends (see my-app/hooks/usePlantPreferences.ts)
+GROW_TYPES = {"edible", "ornamental", "both"}
+SUB_TYPES = {"herbs", "vegetables", "fruits", "foliage", "flowering", "ornamental and edible"}
+CYCLE_TYPES = {"annual", "perennial"}
+WINTER_TYPES = {"indoors", "outdoors"}
+
+# Relative weight of each score component; components without input are left out
+WEIGHTS = {
+    "sun": 3.0,
+    "wind": 2.0,
+    "hardiness": 3.0,
+    "heat": 1.0,
+    "container": 1.0,
+    "subtype": 2.0,
+}
+
+# Coldest-month mean temperature is far above the coldest night; this approximates the gap
+COLDEST_NIGHT_OFFSET_C = 12.0
+
+
+def _keywords(groups) -> List[Tuple[re.Pattern, int]]:
+    """Compile (phrases, level) groups into whole-word patterns, checked in order."""
+    return [(re.compile(r"\b(?:" + "|".join(phrases) + r")\b"), level) for phrases, level in groups]
+
+
+# Negated and qualified phrases come before the plain ones they contain ("no direct sun" before
+# "direct sun", "partial shade" before "shade")
+SUN_KEYWORDS = _keywords([
+    ((r"no (?:direct )?sun(?:light)?", r"without (?:direct )?sun(?:light)?", r"little (?:direct )?sun(?:light)?",
+      r"not sunny", r"(?:full|deep|heavy|mostly) shade"), 0),
+    ((r"partial(?:ly)?", r"part[- ](?:sun|shade)", r"semi[- ]shade", r"half", r"dappled",
+      r"morning sun", r"afternoon sun"), 1),
+    ((r"shade", r"shady", r"shaded"), 0),
+    ((r"full[- ]sun", r"direct sun(?:light)?", r"sunny", r"sun all day"), 2),
+])
+# Only consulted when the text names no exposure: the facing of the balcony
+SUN_COMPASS_KEYWORDS = _keywords([
+    ((r"north[- ]?(?:east|west)",), 1),
+    ((r"south[- ]?(?:east|west)",), 2),
+    ((r"north",), 0),
+    ((r"south",), 2),
+    ((r"east", r"west"), 1),
+])
+WIND_KEYWORDS = _keywords([
+    ((r"no shelter", r"little shelter", r"unsheltered", r"not sheltered"), 2),
+    ((r"no wind", r"little wind", r"not exposed", r"sheltered from", r"protected from"), 0),
+    ((r"strong", r"high", r"exposed", r"gusts?", r"gusty", r"windy"), 2),
+    ((r"moderate", r"medium"), 1),
+    ((r"light", r"low", r"sheltered", r"calm", r"protected"), 0),
+])
+
+
+def _level_from_text(text: Optional[str], *keyword_sets) -> Optional[int]:
+    """Level of the first matching group of the first keyword set that matches at all."""
+    if not text:
+        return None
+    text = str(text).lower()
+    for keywords in keyword_sets:
+        for pattern, level in keywords:
+            if pattern.search(text):
+                return level
+    return None
+
+
+def _clean(value: Optional[str], allowed) -> Optional[str]:
+    if not value:
+        return None
+    value = value.strip().lower()
+    return value if value in allowed else None
+
+
+@dataclass
+class SuitabilityQuery:
+    """What a plan asks of a plant: site conditions, climate and the user's preferences."""
+    sun_level: Optional[int] = None
+    wind_level: Optional[int] = None
+    coldest_month_c: Optional[float] = None
+    warmest_month_c: Optional[float] = None
+    grow_type: Optional[str] = None
+    sub_type: Optional[str] = None
+    cycle_type: Optional[str] = None
+    winter_type: Optional[str] = None
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "SuitabilityQuery":
+        """Build a query from the free-text site analysis, climate profile and preferences in the state."""
+        preferences = state.get("user_preferences") or {}
+        climate = state.get("climate_profile") or {}
+        return cls(
+            sun_level=_level_from_text(state.get("sun_exposure"), SUN_KEYWORDS, SUN_COMPASS_KEYWORDS),
+            wind_level=_level_from_text(state.get("wind_pattern"), WIND_KEYWORDS),
+            coldest_month_c=climate.get("coldest_month_c"),
+            warmest_month_c=climate.get("warmest_month_c"),
+            grow_type=_clean(preferences.get("growType"), GROW_TYPES),
+            sub_type=_clean(preferences.get("subType"), SUB_TYPES),
+            cycle_type=_clean(preferences.get("cycleType"), CYCLE_TYPES),
+            winter_type=_clean(preferences.get("winterType"), WINTER_TYPES),
+        )
+
+    def is_standard_profile(self) -> bool:
+        """True if the site and every preference are ones the catalog fully understands, so it can answer on its own."""
+        # Without light and wind the score rests on container and climate fit alone
+        if self.sun_level is None or self.wind_level is None:
+            return False
+        if self.grow_type is None or self.cycle_type is None:
+            return False
+        if self.cycle_type == "perennial" and self.winter_type is None:
+            return False
+        return self.coldest_month_c is not None
+
+
+@dataclass
+class RankedPlant:
+    """A catalog entry and its suitability score in [0, 1]."""
+    index: int
+    name: str
+    score: float
+    components: Dict[str, float] = field(default_factory=dict)
+
+
+class PlantCatalog:
+    """Columnar plant catalog with a vectorized suitability scorer."""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        """
+        Initialize the PlantCatalog.
+
+        Args:
+            columns (Dict[str, np.ndarray]): One equally long array per catalog column
+        """
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Catalog columns have different lengths: {sorted(lengths)}")
+        self.columns = columns
+        self.names = columns["name"]
+        for name in NUMERIC_COLUMNS:
+            setattr(self, name, columns[name])
+        for name in CATEGORY_COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "PlantCatalog":
+        columns = {"name": np.array([record["name"] for record in records], dtype=object)}
+        for name in NUMERIC_COLUMNS:
+            columns[name] = np.array([float(record[name]) for record in records], dtype=np.float32)
+        for name in CATEGORY_COLUMNS:
+            columns[name] = np.array([record[name].strip().lower() for record in records], dtype=object)
+        for name in TEXT_COLUMNS:
+            columns[name] = np.array([record.get(name, "") for record in records], dtype=object)
+        return cls(columns)
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CATALOG_PATH) -> "PlantCatalog":
+        """Load a catalog from a CSV file with one row per species."""
+        with open(path, newline="", encoding="utf-8") as f:
+            records = list(csv.DictReader(f))
+        catalog = cls.from_records(records)
+        logger.info("Loaded plant catalog", extra=fields(path=path, species=len(catalog)))
+        return catalog
+
+    def score(self, query: SuitabilityQuery) -> Dict[str, np.ndarray]:
+        """
+        Score every species against query.
+
+        Args:
+            query (SuitabilityQuery): Site, climate and preferences
+
+        Returns:
+            Dict[str, np.ndarray]: "score" (weighted mean of the components, -1 where a hard
+                preference rules the species out) plus one array per component used
+        """
+        n = len(self)
+        eligible = np.ones(n, dtype=bool)
+        if query.grow_type in ("edible", "ornamental"):
+            eligible &= self.category == query.grow_type
+        if query.cycle_type is not None:
+            eligible &= self.cycle == query.cycle_type
+
+        components: Dict[str, np.ndarray] = {
+            "container": self.container,
+        }
+
+        if query.sun_level is not None:
+            # Full marks inside the tolerated range, half a point off per level outside it
+            distance = np.maximum(self.sun_min - query.sun_level, 0) + np.maximum(query.sun_level - self.sun_max, 0)
+            components["sun"] = np.clip(1.0 - 0.5 * distance, 0.0, 1.0)
+
+        if query.wind_level is not None:
+            components["wind"] = np.clip(1.0 - 0.5 * np.maximum(query.wind_level - self.wind_tolerance, 0), 0.0, 1.0)
+
+        if query.coldest_month_c is not None:
+            coldest_night = query.coldest_month_c - COLDEST_NIGHT_OFFSET_C
+            hardy = 1.0 / (1.0 + np.exp(-(coldest_night - self.min_temp_c) / 3.0))
+            # Annuals are replanted each year and overwintered plants only need a bright room
+            needs_hardiness = self.cycle == "perennial"
+            if query.winter_type == "indoors":
+                needs_hardiness &= self.winter_indoors < 0.5
+            components["hardiness"] = np.where(needs_hardiness, hardy, 1.0).astype(np.float32)
+
+        if query.warmest_month_c is not None:
+            # Hot spells run roughly 10°C above the warmest-month mean
+            components["heat"] = (1.0 / (1.0 + np.exp(-(self.max_temp_c - query.warmest_month_c - 10.0) / 3.0))).astype(np.float32)
+
+        if query.sub_type in ("herbs", "vegetables", "fruits", "foliage", "flowering"):
+            components["subtype"] = (self.subtype == query.sub_type).astype(np.float32)
+
+        total_weight = sum(WEIGHTS[name] for name in components)
+        score = sum(WEIGHTS[name] * values for name, values in components.items()) / total_weight
+        components["score"] = np.where(eligible, score, -1.0).astype(np.float32)
+        return components
+
+    def rank(self, query: SuitabilityQuery, top_k: int = 8) -> List[RankedPlant]:
+        """Return the top_k eligible species for query, best first."""
+        scored = self.score(query)
+        scores = scored["score"]
+        top_k = min(top_k, len(scores))
+        if top_k <= 0:
+            return []
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [
+            RankedPlant(
+                index=int(i),
+                name=str(self.names[i]),
+                score=float(scores[i]),
+                components={name: float(values[i]) for name, values in scored.items() if name != "score"}
+            )
+            for i in candidates
+            if scores[i] >= 0
+        ]
+
+    def recommendation(self, plant: RankedPlant, plant_id: int) -> Dict[str, str]:
+        """Render a catalog entry in the plant_recommendations format the LLM also produces."""
+        recommendation = {"id": str(plant_id), "name": plant.name}
+        for name in TEXT_COLUMNS:
+            recommendation[name] = str(self.columns[name][plant.index])
+        return recommendation
+
+    def describe(self, plant: RankedPlant) -> str:
+        """One-line summary of a shortlisted species for the LLM prompt."""
+        i = plant.index
+        return (
+            f"{plant.name} ({self.category[i]} {self.subtype[i]}, {self.cycle[i]}, "
+            f"hardy to {self.min_temp_c[i]:.0f}°C, suitability {plant.score:.2f})"
+        )
+
+
+_plant_catalog: Optional[PlantCatalog] = None
+_plant_catalog_lock = threading.Lock()
+
+
+def get_plant_catalog() -> PlantCatalog:
+    """Return the process-wide PlantCatalog loaded from CITY_GARDEN_PLANT_CATALOG or the bundled CSV."""
+    global _plant_catalog
+    with _plant_catalog_lock:
+        if _plant_catalog is None:
+            _plant_catalog = PlantCatalog.load(os.environ.get("CITY_GARDEN_PLANT_CATALOG") or DEFAULT_CATALOG_PATH)
+        return _plant_catalog
@@ -5,51 +5,50 @@ It get monthly average temperature, monthly rain fall, wind pattern of the locat
 https://open-meteo.com/
 """
 
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
 from langchain_core.tools import tool
+import logging
 import requests
 import openmeteo_requests
 import requests_cache
 import pandas as pd
 from retry_requests import retry
 
-API_URL = "https://archive-api.open-meteo.com/v1/archive"
+from city_garden.services.cache_backend import cache_key, get_cache
+from city_garden.services.climate_grid import get_climate_grid
+from city_garden.utils.shared_work import shared
+from city_garden.utils.structured_logging import fields, debug_sampled
 
-@tool
-def get_monthly_average_temperature(latitude: float, longitude: float) -> str:
-    """Get the monthly average temperature of 2024 for the location.
+logger = logging.getLogger(__name__)
 
-    Args:
-        latitude: float
-        longitude: float
+API_URL = "https://archive-api.open-meteo.com/v1/archive"
 
-    Returns:
-        str: The monthly average temperature of 2024 for the location.
+def _monthly_average(latitude: float, longitude: float, variable: str) -> pd.DataFrame:
+    """Fetch a daily Open-Meteo variable for 2024 and average it per month.
+
+    Within a batch submission the result is shared between all plans for the same site.
     """
-    print(f"Getting monthly average temperature for {latitude}, {longitude}")
+    key = ("climate", round(latitude, 3), round(longitude, 3), variable)
+    return shared(key, lambda: _fetch_monthly_average(latitude, longitude, variable))
+
+def _openmeteo_client() -> openmeteo_requests.Client:
     cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
     retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
-    
-    params = {
-        "latitude": latitude,
-        "longitude": longitude,
-        "start_date": "2024-01-01",
-        "end_date": "2024-12-31",
-        "daily": "temperature_2m_mean",
-        "timezone": "Europe/Berlin"
-    }
-    responses = openmeteo.weather_api(API_URL, params=params)
-    
-    # Process first location. Add a for-loop for multiple locations or weather models
-    response = responses[0]
-    print(f"Coordinates {response.Latitude()}°N {response.Longitude()}°E")
-    print(f"Elevation {response.Elevation()} m asl")
-    print(f"Timezone {response.Timezone()}{response.TimezoneAbbreviation()}")
-    print(f"Timezone difference to GMT+0 {response.UtcOffsetSeconds()} s")
+    return openmeteo_requests.Client(session=retry_session)
+
+def _daily_dataframe(response, variables: List[str]) -> pd.DataFrame:
+    """Turn the daily block of one Open-Meteo response into a DataFrame with a date column."""
+    logger.debug("Open-Meteo response", extra=fields(
+        latitude=response.Latitude(),
+        longitude=response.Longitude(),
+        elevation=response.Elevation(),
+        utc_offset_seconds=response.UtcOffsetSeconds()
+    ))
 
     # Process daily data. The order of variables needs to be the same as requested.
     daily = response.Daily()
-    daily_temperature_2m_mean = daily.Variables(0).ValuesAsNumpy()
 
     daily_data = {"date": pd.date_range(
         start=pd.to_datetime(daily.Time(), unit="s", utc=True),
@@ -58,74 +57,169 @@ def get_monthly_average_temperature(latitude: float, longitude: float) -> str:
         inclusive="left"
     )}
 
-    daily_data["temperature_2m_mean"] = daily_temperature_2m_mean
+    for index, variable in enumerate(variables):
+        daily_data[variable] = daily.Variables(index).ValuesAsNumpy()
 
-    daily_dataframe = pd.DataFrame(data=daily_data)
-    print(daily_dataframe)   
+    return pd.DataFrame(data=daily_data)
+
+def _fetch_monthly_average(latitude: float, longitude: float, variable: str) -> pd.DataFrame:
+    params = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "start_date": "2024-01-01",
+        "end_date": "2024-12-31",
+        "daily": variable,
+        "timezone": "Europe/Berlin"
+    }
+    responses = _openmeteo_client().weather_api(API_URL, params=params)
+    
+    # Process first location. Add a for-loop for multiple locations or weather models
+    daily_dataframe = _daily_dataframe(responses[0], [variable])
 
     # Now group by month and calculate monthly average
-    monthly_avg = daily_dataframe.resample('M', on='date').mean()
+    monthly_avg = daily_dataframe.resample('ME', on='date').mean()
 
-    print("\nMonthly Average Temperature Data:")
-    print(monthly_avg)
+    if debug_sampled(logger):
+        logger.debug("Monthly average", extra=fields(
+            variable=variable,
+            monthly=monthly_avg.iloc[:, 0].round(2).tolist()
+        ))
 
     return monthly_avg
 
-@tool
-def get_wind_pattern(latitude: float, longitude: float) -> str:
-    """Get the wind pattern for the location.
+# Daily variables behind a climate profile, in request order
+NORMALS_VARIABLES = ["temperature_2m_mean", "precipitation_sum", "wind_speed_10m_max", "temperature_2m_min"]
+
+def fetch_climate_normals(
+    latitudes: List[float],
+    longitudes: List[float],
+    start_date: str = "2024-01-01",
+    end_date: str = "2024-12-31",
+) -> List["ClimateProfile"]:
+    """Fetch monthly climate normals for one or more sites in a single Open-Meteo request.
+
+    Daily values are averaged per calendar month over the whole date range, and
+    frost days (minimum below 0°C) are counted per month and divided by the
+    number of years.
+
     Args:
-        latitude: float
-        longitude: float
+        latitudes (List[float]): Site latitudes
+        longitudes (List[float]): Site longitudes, same length as latitudes
+        start_date (str): First day of the reference period (YYYY-MM-DD)
+        end_date (str): Last day of the reference period (YYYY-MM-DD)
 
     Returns:
-        str: The wind pattern for the location.
+        List[ClimateProfile]: One profile per site, in input order
     """
-    print(f"Getting wind pattern for {latitude}, {longitude}")
-    cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
-    
     params = {
-        "latitude": latitude,
-        "longitude": longitude,
-        "start_date": "2024-01-01",
-        "end_date": "2024-12-31",
-        "daily": "wind_speed_10m_max",
-        "timezone": "Europe/Berlin"
+        "latitude": latitudes,
+        "longitude": longitudes,
+        "start_date": start_date,
+        "end_date": end_date,
+        "daily": NORMALS_VARIABLES,
+        "timezone": "GMT"
     }
-    responses = openmeteo.weather_api(API_URL, params=params)
-    
-    # Process first location. Add a for-loop for multiple locations or weather models
-    response = responses[0]
-    print(f"Coordinates {response.Latitude()}°N {response.Longitude()}°E")
-    print(f"Elevation {response.Elevation()} m asl")
-    print(f"Timezone {response.Timezone()}{response.TimezoneAbbreviation()}")
-    print(f"Timezone difference to GMT+0 {response.UtcOffsetSeconds()} s")
+    responses = _openmeteo_client().weather_api(API_URL, params=params)
+
+    profiles = []
+    for response in responses:
+        daily = _daily_dataframe(response, NORMALS_VARIABLES)
+        month = daily["date"].dt.month
+        years = max(1, daily["date"].dt.year.nunique())
+        normals = daily.groupby(month)[NORMALS_VARIABLES[:3]].mean().reindex(range(1, 13))
+        frost_days = (daily["temperature_2m_min"] < 0).groupby(month).sum().reindex(range(1, 13), fill_value=0) / years
+        profiles.append(ClimateProfile(
+            monthly_temperature_c=normals["temperature_2m_mean"].round(2).tolist(),
+            monthly_daily_precipitation_mm=normals["precipitation_sum"].round(2).tolist(),
+            monthly_wind_max_kmh=normals["wind_speed_10m_max"].round(2).tolist(),
+            monthly_frost_days=frost_days.round(2).tolist(),
+        ))
+    return profiles
+
+# ClimateProfile fields stored in the precomputed climate grid, in grid order
+GRID_FIELDS = ["monthly_temperature_c", "monthly_daily_precipitation_mm", "monthly_wind_max_kmh", "monthly_frost_days"]
+
+# Normals barely change; cached sites are refreshed monthly
+CLIMATE_CACHE_TTL = 30 * 24 * 3600
+
+@dataclass
+class ClimateProfile:
+    """Monthly climate normals of a site, as used to score plant suitability."""
+    monthly_temperature_c: List[float]
+    monthly_daily_precipitation_mm: List[float]
+    monthly_wind_max_kmh: List[float]
+    monthly_frost_days: List[float]
+
+    @property
+    def coldest_month_c(self) -> float:
+        return min(self.monthly_temperature_c)
+
+    @property
+    def warmest_month_c(self) -> float:
+        return max(self.monthly_temperature_c)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Plain dict for the graph state, including the derived extremes."""
+        profile = asdict(self)
+        profile["coldest_month_c"] = self.coldest_month_c
+        profile["warmest_month_c"] = self.warmest_month_c
+        profile["frost_days"] = round(sum(self.monthly_frost_days), 1)
+        return profile
+
+def get_climate_profile(latitude: float, longitude: float) -> Optional[ClimateProfile]:
+    """Return the monthly temperature, precipitation, wind and frost days of a site.
+
+    Sites inside the precomputed climate grid (CITY_GARDEN_CLIMATE_GRID) are read
+    locally; everything else is fetched from Open-Meteo for the site rounded to
+    about a kilometre and kept in the shared cache, so every worker reuses it.
+    Returns None if the
+    climate data cannot be retrieved, so callers can fall back to the LLM's own
+    estimate instead of failing the plan.
+    """
+    grid = get_climate_grid()
+    if grid is not None:
+        normals = grid.lookup(latitude, longitude)
+        if normals is not None:
+            return ClimateProfile(**{field: [round(float(value), 2) for value in normals[field]] for field in GRID_FIELDS})
+
+    latitude, longitude = round(latitude, 2), round(longitude, 2)
+    try:
+        normals = get_cache().get_or_compute_json(
+            cache_key("climate_normals", latitude, longitude),
+            lambda: asdict(fetch_climate_normals([latitude], [longitude])[0]),
+            ttl=CLIMATE_CACHE_TTL
+        )
+        return ClimateProfile(**normals)
+    except Exception as e:
+        logger.warning("Climate data unavailable", extra=fields(latitude=latitude, longitude=longitude, error=e))
+        return None
 
-    # Process daily data. The order of variables needs to be the same as requested.
-    daily = response.Daily()
-    daily_wind_speed_10m_max = daily.Variables(0).ValuesAsNumpy()
+@tool
+def get_monthly_average_temperature(latitude: float, longitude: float) -> str:
+    """Get the monthly average temperature of 2024 for the location.
 
-    daily_data = {"date": pd.date_range(
-        start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-        end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-        freq=pd.Timedelta(seconds=daily.Interval()),
-        inclusive="left"
-    )}
+    Args:
+        latitude: float
+        longitude: float
 
-    daily_data["wind_speed_10m_max"] = daily_wind_speed_10m_max
+    Returns:
+        str: The monthly average temperature of 2024 for the location.
+    """
+    logger.info("Getting monthly average temperature", extra=fields(latitude=latitude, longitude=longitude))
+    return _monthly_average(latitude, longitude, "temperature_2m_mean")
 
-    daily_dataframe = pd.DataFrame(data=daily_data)
-    print(daily_dataframe)
-    
-    # Now group by month and calculate monthly average
-    monthly_avg = daily_dataframe.resample('M', on='date').mean()
-    
-    print("\nMonthly Average Wind Speed Data:")
-    print(monthly_avg)
-    
-    return monthly_avg
+@tool
+def get_wind_pattern(latitude: float, longitude: float) -> str:
+    """Get the wind pattern for the location.
+    Args:
+        latitude: float
+        longitude: float
+
+    Returns:
+        str: The wind pattern for the location.
+    """
+    logger.info("Getting wind pattern", extra=fields(latitude=latitude, longitude=longitude))
+    return _monthly_average(latitude, longitude, "wind_speed_10m_max")
 
 @tool
 def get_monthly_precipitation(latitude: float, longitude: float) -> str:
@@ -137,48 +231,5 @@ def get_monthly_precipitation(latitude: float, longitude: float) -> str:
     Returns:
         str: The monthly precipitation of 2024 for the location.
     """
-    print(f"Getting monthly precipitation for {latitude}, {longitude}")
-    cache_session = requests_cache.CachedSession('.cache', expire_after=-1)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
-    
-    params = {
-        "latitude": latitude,
-        "longitude": longitude,
-        "start_date": "2024-01-01",
-        "end_date": "2024-12-31",
-        "daily": "precipitation_sum",
-        "timezone": "Europe/Berlin"
-    }
-    responses = openmeteo.weather_api(API_URL, params=params)
-    
-    # Process first location. Add a for-loop for multiple locations or weather models
-    response = responses[0]
-    print(f"Coordinates {response.Latitude()}°N {response.Longitude()}°E")
-    print(f"Elevation {response.Elevation()} m asl")
-    print(f"Timezone {response.Timezone()}{response.TimezoneAbbreviation()}")
-    print(f"Timezone difference to GMT+0 {response.UtcOffsetSeconds()} s")
-
-    # Process daily data. The order of variables needs to be the same as requested.
-    daily = response.Daily()
-    daily_precipitation_sum = daily.Variables(0).ValuesAsNumpy()
-
-    daily_data = {"date": pd.date_range(
-        start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-        end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-        freq=pd.Timedelta(seconds=daily.Interval()),
-        inclusive="left"
-    )}
-
-    daily_data["precipitation_sum"] = daily_precipitation_sum
-
-    daily_dataframe = pd.DataFrame(data=daily_data)
-    print(daily_dataframe)
-    
-    # Now group by month and calculate monthly average
-    monthly_avg = daily_dataframe.resample('M', on='date').mean()
-    
-    print("\nMonthly Average Precipitation Data:")
-    print(monthly_avg)
-    
-    return monthly_avg
\ No newline at end of file
+    logger.info("Getting monthly precipitation", extra=fields(latitude=latitude, longitude=longitude))
+    return _monthly_average(latitude, longitude, "precipitation_sum")
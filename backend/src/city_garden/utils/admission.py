@@ -0,0 +1,221 @@
+"""
+Admission control with stepwise quality degradation.
+
+Every plan passes through admit() before it starts. The controller turns
+three load signals into one pressure value: plans in flight (relative to
+CITY_GARDEN_ADMISSION_MAX_IN_FLIGHT), how long plans recently waited for a
+worker thread (relative to CITY_GARDEN_ADMISSION_TARGET_WAIT) and the share
+of upstream calls answered with 429 (relative to
+CITY_GARDEN_ADMISSION_MAX_THROTTLE_RATE). The pressure picks a degradation
+level, from full quality through cheaper garden images, fewer and then
+deferred plant images to fast rejection, so that under overload plans keep
+finishing within their deadline instead of all timing out together.
+
+The admitted level lives in a ContextVar like the request deadline, so it
+follows the plan into worker threads and graph nodes, which read it with
+current_degradation().
+
+Configuration (environment variables):
+    CITY_GARDEN_ADMISSION_MAX_IN_FLIGHT      Plans in flight at pressure 1.0 (default 16)
+    CITY_GARDEN_ADMISSION_TARGET_WAIT        Queue wait in seconds at pressure 1.0 (default 2)
+    CITY_GARDEN_ADMISSION_MAX_THROTTLE_RATE  Share of 429 answers at pressure 1.0 (default 0.1)
+    CITY_GARDEN_ADMISSION_THRESHOLDS         Pressure at which levels 1-4 start (default 0.5,0.7,0.85,1.0)
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+
+# Upstream calls older than this no longer count towards the 429 rate
+THROTTLE_WINDOW = 30.0
+# Fewer upstream calls than this in the window say nothing about throttling
+THROTTLE_MIN_SAMPLES = 10
+# Weight of the newest queue wait in its moving average
+WAIT_SMOOTHING = 0.3
+
+
+@dataclass(frozen=True)
+class Degradation:
+    """What a plan admitted at one load level may cost. None means the node's normal setting."""
+    level: int
+    name: str
+    garden_image_size: Optional[str] = None
+    garden_image_quality: Optional[str] = None
+    refine_garden_image: bool = True
+    max_plant_images: Optional[int] = None
+    defer_plant_images: bool = False
+    reject: bool = False
+
+
+DEGRADATION_LEVELS: Tuple[Degradation, ...] = (
+    Degradation(0, "full"),
+    Degradation(1, "reduced_image_quality", "1024x1024", "low", refine_garden_image=False),
+    Degradation(2, "fewer_plant_images", "1024x1024", "low", refine_garden_image=False, max_plant_images=3),
+    Degradation(3, "deferred_plant_images", "1024x1024", "low", refine_garden_image=False, max_plant_images=3,
+                defer_plant_images=True),
+    Degradation(4, "rejected", reject=True),
+)
+
+_degradation_var: ContextVar[Degradation] = ContextVar("degradation", default=DEGRADATION_LEVELS[0])
+_arrived_var: ContextVar[Optional[float]] = ContextVar("admission_arrived", default=None)
+
+
+class Overloaded(Exception):
+    """The plan was rejected at admission because the service is overloaded."""
+
+    def __init__(self, pressure: float, retry_after: int):
+        super().__init__(f"Service overloaded (pressure {pressure:.2f}), retry in {retry_after} s")
+        self.pressure = pressure
+        self.retry_after = retry_after
+        self.level = DEGRADATION_LEVELS[-1].level
+
+
+def current_degradation() -> Degradation:
+    """The degradation the current plan was admitted with (full quality outside admission)."""
+    return _degradation_var.get()
+
+
+@contextmanager
+def degradation_scope(degradation: Degradation) -> Iterator[Degradation]:
+    """Run the block with the given degradation."""
+    token = _degradation_var.set(degradation)
+    try:
+        yield degradation
+    finally:
+        _degradation_var.reset(token)
+
+
+class AdmissionController:
+    """Admits plans at a degradation level chosen from in-flight count, queue wait and upstream 429 rate."""
+
+    def __init__(
+        self,
+        max_in_flight: int = 16,
+        target_wait: float = 2.0,
+        max_throttle_rate: float = 0.1,
+        thresholds: Tuple[float, ...] = (0.5, 0.7, 0.85, 1.0),
+    ):
+        """
+        Initialize the AdmissionController.
+
+        Args:
+            max_in_flight (int): Plans in flight that count as pressure 1.0
+            target_wait (float): Queue wait (seconds) that counts as pressure 1.0
+            max_throttle_rate (float): Share of 429 answers that counts as pressure 1.0
+            thresholds (Tuple[float, ...]): Ascending pressure at which each level above 0 starts
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.target_wait = target_wait
+        self.max_throttle_rate = max_throttle_rate
+        self.thresholds = tuple(sorted(thresholds))[:len(DEGRADATION_LEVELS) - 1]
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._wait_average = 0.0
+        self._wait_updated = 0.0
+        self._upstream = deque()
+        self.admitted = {level.name: 0 for level in DEGRADATION_LEVELS}
+
+    def _signals(self, now: float) -> Dict[str, float]:
+        while self._upstream and now - self._upstream[0][0] > THROTTLE_WINDOW:
+            self._upstream.popleft()
+        calls = len(self._upstream)
+        throttle_rate = sum(throttled for _, throttled in self._upstream) / calls if calls >= THROTTLE_MIN_SAMPLES else 0.0
+        # A queue wait nobody has measured for a while is stale; the queue has drained since
+        wait = self._wait_average if now - self._wait_updated <= THROTTLE_WINDOW else 0.0
+        return {
+            "in_flight": self._in_flight / self.max_in_flight,
+            "queue_wait": wait / self.target_wait if self.target_wait > 0 else 0.0,
+            "throttling": throttle_rate / self.max_throttle_rate if self.max_throttle_rate > 0 else 0.0,
+        }
+
+    def _level(self, pressure: float) -> Degradation:
+        # Pressure counts the plans already admitted: with max_in_flight in flight the next one is at 1.0
+        return DEGRADATION_LEVELS[sum(pressure >= threshold for threshold in self.thresholds)]
+
+    @contextmanager
+    def admit(self) -> Iterator[Degradation]:
+        """
+        Admit one plan for the duration of the block.
+
+        Returns:
+            Degradation: The level the plan runs at; it is also current inside the block
+
+        Raises:
+            Overloaded: If the service is too loaded to start the plan at all
+        """
+        now = time.monotonic()
+        with self._lock:
+            pressure = max(self._signals(now).values())
+            degradation = self._level(pressure)
+            self.admitted[degradation.name] += 1
+            if degradation.reject:
+                raise Overloaded(pressure, retry_after=max(1, round(self._wait_average or self.target_wait)))
+            self._in_flight += 1
+        arrived = _arrived_var.set(now)
+        try:
+            with degradation_scope(degradation):
+                yield degradation
+        finally:
+            _arrived_var.reset(arrived)
+            with self._lock:
+                self._in_flight -= 1
+
+    def started(self) -> None:
+        """Record that the current plan got a worker; the time since admit() is its queue wait."""
+        arrived = _arrived_var.get()
+        if arrived is None:
+            return
+        # Only the first call of a plan counts
+        _arrived_var.set(None)
+        now = time.monotonic()
+        with self._lock:
+            self._wait_average += WAIT_SMOOTHING * ((now - arrived) - self._wait_average)
+            self._wait_updated = now
+
+    def record_upstream(self, throttled: bool) -> None:
+        """Record the outcome of one upstream call; throttled means it was answered with 429."""
+        with self._lock:
+            self._upstream.append((time.monotonic(), throttled))
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            signals = self._signals(time.monotonic())
+            return {
+                "in_flight": self._in_flight,
+                "queue_wait_seconds": round(self._wait_average, 3),
+                "pressure": {name: round(value, 3) for name, value in signals.items()},
+                "level": self._level(max(signals.values())).level,
+                "admitted": dict(self.admitted),
+            }
+
+
+def _thresholds() -> Tuple[float, ...]:
+    value = os.environ.get("CITY_GARDEN_ADMISSION_THRESHOLDS", "0.5,0.7,0.85,1.0")
+    return tuple(float(part) for part in value.split(",") if part.strip())
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """Return the process-wide AdmissionController."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                max_in_flight=int(os.environ.get("CITY_GARDEN_ADMISSION_MAX_IN_FLIGHT", "16")),
+                target_wait=float(os.environ.get("CITY_GARDEN_ADMISSION_TARGET_WAIT", "2")),
+                max_throttle_rate=float(os.environ.get("CITY_GARDEN_ADMISSION_MAX_THROTTLE_RATE", "0.1")),
+                thresholds=_thresholds(),
+            )
+        return _controller
+
+
+def record_upstream(throttled: bool) -> None:
+    """Record one upstream call with the process-wide controller."""
+    get_admission().record_upstream(throttled)
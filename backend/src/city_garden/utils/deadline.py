@@ -0,0 +1,62 @@
+"""
+Request-level deadlines.
+
+A request binds an absolute deadline with deadline_scope(); every upstream
+call made on its behalf asks call_timeout() for its timeout, which is the
+call's own limit capped by the time the request has left. Once the deadline
+has passed, check_deadline() raises DeadlineExceeded instead of starting
+more work. The deadline lives in a ContextVar, so it follows the request
+into worker threads started with asyncio.to_thread and into graph nodes.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+_deadline_var: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before the named stage could start or finish."""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float], detached: bool = False):
+    """Give everything inside the block at most `seconds` (None or <= 0 means no deadline).
+
+    A nested scope can only shorten the deadline of the enclosing one, unless it
+    is detached: background work that outlives the request ignores its deadline.
+    """
+    deadline = time.monotonic() + seconds if seconds and seconds > 0 else None
+    outer = None if detached else _deadline_var.get()
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    token = _deadline_var.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline_var.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    deadline = _deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(stage: str) -> None:
+    """Raise DeadlineExceeded if the current deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage}")
+
+
+def call_timeout(default: Optional[float], stage: str) -> Optional[float]:
+    """Timeout for one upstream call: default capped by the time left on the deadline."""
+    check_deadline(stage)
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
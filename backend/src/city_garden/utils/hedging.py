@@ -0,0 +1,207 @@
+"""
+Hedged requests for idempotent upstream calls.
+
+A Hedger tracks the latency of successful calls. Once the primary call has
+been running longer than a configurable percentile of that history, a
+backup call is started; whichever finishes first wins and the other one is
+cancelled. Because only the slowest few percent of calls are hedged, the
+extra spend stays small while the tail latency drops. A ratio cap keeps a
+slow upstream from doubling our traffic.
+
+Calls run as coroutines on one background event loop, so cancelling the
+loser really aborts its HTTP request and async clients keep a single loop.
+
+Configuration (environment variables):
+    CITY_GARDEN_HEDGE_PERCENTILE   Latency percentile after which to hedge, e.g. 95 (default: hedging off)
+    CITY_GARDEN_HEDGE_MIN_SAMPLES  Observed calls needed before hedging starts (default 20)
+    CITY_GARDEN_HEDGE_MAX_RATIO    Max share of calls that may be hedged (default 0.1)
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import numpy as np
+
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies."""
+
+    def __init__(self, window: int = 256):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            return float(np.percentile(np.fromiter(self._samples, dtype=float), p))
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="hedging-loop", daemon=True).start()
+        return _loop
+
+
+def _reset_after_fork() -> None:
+    # The loop thread does not survive fork(); a worker process starts its own on first use
+    global _loop, _loop_lock
+    _loop = None
+    _loop_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Hedger:
+    """Race a backup call against a slow primary call."""
+
+    def __init__(self, name: str, percentile: Optional[float], min_samples: int = 20, max_hedge_ratio: float = 0.1):
+        """
+        Initialize the Hedger.
+
+        Args:
+            name (str): Name of the hedged call, used in logs and metrics
+            percentile (Optional[float]): Latency percentile after which a backup is started; None disables hedging
+            min_samples (int): Successful calls to observe before hedging
+            max_hedge_ratio (float): Max share of calls that may start a backup
+        """
+        self.name = name
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.backup_wins = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.percentile is not None
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait for the primary before starting a backup, or None to not hedge this call."""
+        if not self.enabled or len(self.latency) < self.min_samples:
+            return None
+        with self._lock:
+            if self.hedges >= self.max_hedge_ratio * max(self.calls, 1):
+                return None
+        return self.latency.percentile(self.percentile)
+
+    async def _race(self, make_call: Callable[[], Awaitable[T]], timeout: Optional[float], context: contextvars.Context) -> T:
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        # Attempts run in the caller's context, so their log records keep the request id
+        primary = loop.create_task(make_call(), context=context.copy())
+        tasks = {primary}
+        delay = self.hedge_delay()
+        try:
+            if delay is not None:
+                if deadline is not None:
+                    delay = min(delay, max(deadline - time.monotonic(), 0))
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    with self._lock:
+                        self.hedges += 1
+                    logger.info("Hedging slow call", extra=fields(call=self.name, after_seconds=round(delay, 3)))
+                    tasks.add(loop.create_task(make_call(), context=context.copy()))
+
+            pending, error = set(tasks), None
+            while pending:
+                wait_for = None if deadline is None else max(deadline - time.monotonic(), 0)
+                done, pending = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"{self.name} timed out after {timeout:.1f}s")
+                for task in done:
+                    if task.exception() is None:
+                        self.latency.record(time.monotonic() - started)
+                        if task is not primary:
+                            with self._lock:
+                                self.backup_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def call(self, make_call: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """
+        Run make_call(), hedging it if the primary is slow. Blocking.
+
+        Args:
+            make_call (Callable[[], Awaitable[T]]): Starts one attempt, e.g. lambda: llm.ainvoke(messages)
+            timeout (Optional[float]): Overall time limit for the call, including any backup
+
+        Returns:
+            T: The result of the first attempt that succeeded
+
+        Raises:
+            TimeoutError: If no attempt succeeded within timeout
+        """
+        with self._lock:
+            self.calls += 1
+        race = self._race(make_call, timeout, contextvars.copy_context())
+        future = asyncio.run_coroutine_threadsafe(race, _background_loop())
+        return future.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "backup_wins": self.backup_wins,
+                "p50_seconds": self.latency.percentile(50),
+                "hedge_after_seconds": self.latency.percentile(self.percentile) if self.enabled else None,
+            }
+
+
+_hedgers: Dict[str, Hedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(name: str) -> Hedger:
+    """Return the process-wide Hedger for a call name, configured from the environment."""
+    with _hedgers_lock:
+        if name not in _hedgers:
+            percentile = os.environ.get("CITY_GARDEN_HEDGE_PERCENTILE")
+            _hedgers[name] = Hedger(
+                name,
+                percentile=float(percentile) if percentile else None,
+                min_samples=int(os.environ.get("CITY_GARDEN_HEDGE_MIN_SAMPLES", "20")),
+                max_hedge_ratio=float(os.environ.get("CITY_GARDEN_HEDGE_MAX_RATIO", "0.1")),
+            )
+        return _hedgers[name]
+
+
+def hedging_stats() -> Dict[str, Dict[str, Any]]:
+    with _hedgers_lock:
+        hedgers = list(_hedgers.values())
+    return {hedger.name: hedger.stats() for hedger in hedgers}
@@ -0,0 +1,109 @@
+"""
+Incremental extraction of array items from a streamed JSON document.
+
+The chat model streams its recommendation JSON token by token. ArrayItemStream
+is fed those chunks and hands back every object element of one top-level
+array (for example "plant_recommendations") as soon as that element's closing
+brace has arrived, long before the document itself is complete. It only tracks nesting
+and string state, so each character is looked at once; text around the JSON,
+such as a Markdown code fence, is skipped.
+"""
+import json
+from typing import Any, List, Optional
+
+
+class ArrayItemStream:
+    """Yield the elements of doc[key] while the JSON document is still arriving."""
+
+    def __init__(self, key: str):
+        """
+        Initialize the ArrayItemStream.
+
+        Args:
+            key (str): Key of the array in the top-level object
+        """
+        self.key = key
+        self.items: List[Any] = []
+        # Unconsumed tail of the document; only the part an open item or key still needs is kept
+        self._text = ""
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start: Optional[int] = None
+        self._last_string: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._finished = False
+
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        Consume the next piece of the document.
+
+        Args:
+            chunk (str): Text as received from the stream
+
+        Returns:
+            List[Any]: Array elements completed by this chunk, in document order
+        """
+        if self._finished:
+            return []
+        scanned = len(self._text)
+        text = self._text = self._text + chunk
+        completed = []
+        for position in range(scanned, len(text)):
+            char = text[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._array_depth is None:
+                        self._last_string = text[self._string_start + 1:position]
+                    self._string_start = None
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char in "{[":
+                if char == "[" and self._depth == 1 and self._array_depth is None and self._last_string == self.key:
+                    self._array_depth = self._depth + 1
+                elif self._depth == self._array_depth:
+                    self._item_start = position
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._item_start is not None and self._depth == self._array_depth:
+                    item = self._parse(text[self._item_start:position + 1])
+                    self._item_start = None
+                    if item is not None:
+                        completed.append(item)
+                elif self._array_depth is not None and self._depth < self._array_depth:
+                    # The array is closed; nothing more to extract
+                    self._finished = True
+                    self._text = ""
+                    break
+        else:
+            self._trim()
+        self.items.extend(completed)
+        return completed
+
+    def _trim(self) -> None:
+        keep_from = len(self._text)
+        for start in (self._item_start, self._string_start):
+            if start is not None:
+                keep_from = min(keep_from, start)
+        self._text = self._text[keep_from:]
+        if self._item_start is not None:
+            self._item_start -= keep_from
+        if self._string_start is not None:
+            self._string_start -= keep_from
+
+    @staticmethod
+    def _parse(fragment: str) -> Optional[Any]:
+        try:
+            return json.loads(fragment)
+        except json.JSONDecodeError:
+            return None
@@ -0,0 +1,125 @@
+"""
+Incremental extraction of one file field from a multipart/form-data body.
+
+Uploads arrive as a multipart body streamed in arbitrary chunks. MultipartFileStream
+is fed those chunks and hands back the bytes of the requested field as soon
+as they are known not to be part of the closing boundary, so the file can
+be forwarded (hashed, decoded, uploaded) without the body ever being held in
+memory. Other fields are skipped.
+"""
+import re
+from typing import Dict, Optional
+
+# Part headers longer than this are rejected instead of buffered
+MAX_HEADER_BYTES = 16 * 1024
+
+_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+
+def parse_boundary(content_type: str) -> Optional[bytes]:
+    """Return the boundary of a multipart/form-data Content-Type header, or None."""
+    media_type, _, params = content_type.partition(";")
+    if media_type.strip().lower() != "multipart/form-data":
+        return None
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary" and value:
+            return value.strip('"').encode("latin-1")
+    return None
+
+
+class MultipartError(ValueError):
+    """The body is not well-formed multipart/form-data."""
+
+
+class MultipartFileStream:
+    """Yield the bytes of one field of a multipart/form-data body while it is still arriving."""
+
+    def __init__(self, boundary: bytes, field: str = "file"):
+        """
+        Initialize the MultipartFileStream.
+
+        Args:
+            boundary (bytes): Boundary from the request's Content-Type header
+            field (str): Name of the form field to extract
+        """
+        self.field = field
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        # Set once the field's closing boundary has been seen
+        self.complete = False
+        self._delimiter = b"\r\n--" + boundary
+        # The first boundary is not preceded by a line break; pretend it is
+        self._buffer = b"\r\n"
+        self._state = "preamble"
+        self._capturing = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        """
+        Consume the next piece of the body.
+
+        Args:
+            chunk (bytes): Bytes as received from the client
+
+        Returns:
+            bytes: Content of the field made available by this chunk (possibly empty)
+
+        Raises:
+            MultipartError: If part headers are malformed or too long
+        """
+        buffer = self._buffer + chunk
+        content = bytearray()
+        while True:
+            if self._state in ("preamble", "body"):
+                index = buffer.find(self._delimiter)
+                if index < 0:
+                    # Hold back what could be the start of a delimiter split across chunks
+                    safe = max(0, len(buffer) - len(self._delimiter) + 1)
+                    if self._capturing:
+                        content += buffer[:safe]
+                    buffer = buffer[safe:]
+                    break
+                if self._capturing:
+                    content += buffer[:index]
+                    self._capturing = False
+                    self.complete = True
+                buffer = buffer[index + len(self._delimiter):]
+                self._state = "delimiter"
+            elif self._state == "delimiter":
+                if len(buffer) < 2:
+                    break
+                if buffer[:2] == b"--":
+                    self._state = "epilogue"
+                    continue
+                buffer = buffer[2:]
+                self._state = "headers"
+            elif self._state == "headers":
+                end = buffer.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(buffer) > MAX_HEADER_BYTES:
+                        raise MultipartError("Part headers too long")
+                    break
+                headers = self._parse_headers(buffer[:end])
+                buffer = buffer[end + 4:]
+                params = dict(_PARAM.findall(headers.get("content-disposition", "")))
+                if params.get("name") == self.field and not self.complete:
+                    self._capturing = True
+                    self.filename = params.get("filename")
+                    self.content_type = headers.get("content-type")
+                self._state = "body"
+            else:
+                # Epilogue after the closing boundary
+                buffer = b""
+                break
+        self._buffer = buffer
+        return bytes(content)
+
+    @staticmethod
+    def _parse_headers(block: bytes) -> Dict[str, str]:
+        headers = {}
+        for line in block.decode("utf-8", errors="replace").split("\r\n"):
+            name, separator, value = line.partition(":")
+            if not separator:
+                raise MultipartError(f"Malformed part header: {line[:80]!r}")
+            headers[name.strip().lower()] = value.strip()
+        return headers
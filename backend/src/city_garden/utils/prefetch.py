@@ -0,0 +1,120 @@
+"""
+Start work for a later graph node ahead of time.
+
+A node that learns early what a later node will need (for example the plant
+names, while the recommendation JSON is still streaming) starts that work
+under a job group. The later node collects the group's futures and only
+computes what was not started. The group id is a plain string, so it can
+travel in the graph state; work runs in the caller's context, so request
+ids, deadlines and shared-work scopes carry over.
+
+Configuration (environment variables):
+    CITY_GARDEN_PREFETCH_WORKERS  Threads running prefetched work (default 8)
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Groups never collected (e.g. the request failed in between) are dropped after this many seconds
+GROUP_TTL = 900.0
+
+
+class Prefetcher:
+    """Thread pool plus a registry of started work, grouped per request."""
+
+    def __init__(self, max_workers: int = 8):
+        """
+        Initialize the Prefetcher.
+
+        Args:
+            max_workers (int): Threads running prefetched work
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._groups: Dict[str, Tuple[float, Dict[Hashable, Future]]] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.used = 0
+        self.unused = 0
+
+    @staticmethod
+    def new_group() -> str:
+        return uuid.uuid4().hex
+
+    def start(self, group: str, key: Hashable, compute: Callable[[], Any]) -> Future:
+        """
+        Run compute() in the background unless the group already started it.
+
+        Args:
+            group (str): Job group, e.g. one per plan
+            key (Hashable): What is being computed within the group
+            compute (Callable[[], Any]): The work
+
+        Returns:
+            Future: The future of the (possibly earlier started) work
+        """
+        now = time.monotonic()
+        with self._lock:
+            for stale in [name for name, (created, _) in self._groups.items() if now - created > GROUP_TTL]:
+                self._discard(self._groups.pop(stale)[1])
+            futures = self._groups.setdefault(group, (now, {}))[1]
+            if key not in futures:
+                context = contextvars.copy_context()
+                futures[key] = self._executor.submit(context.run, compute)
+                self.started += 1
+            return futures[key]
+
+    def collect(self, group: Optional[str]) -> Dict[Hashable, Future]:
+        """Remove a group and return its futures by key (empty for an unknown group)."""
+        if group is None:
+            return {}
+        with self._lock:
+            _, futures = self._groups.pop(group, (None, {}))
+        return futures
+
+    def release(self, futures: Dict[Hashable, Future], used: int) -> None:
+        """Record how many collected futures were used and cancel the rest if they have not started."""
+        with self._lock:
+            self.used += used
+            self.unused += len(futures)
+        self._discard(futures)
+
+    @staticmethod
+    def _discard(futures: Dict[Hashable, Future]) -> None:
+        for future in futures.values():
+            future.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "started": self.started,
+                "used": self.used,
+                "unused": self.unused,
+                "pending_groups": len(self._groups),
+            }
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher() -> Prefetcher:
+    """Return the process-wide Prefetcher."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(max_workers=int(os.environ.get("CITY_GARDEN_PREFETCH_WORKERS", "8")))
+        return _prefetcher
+
+
+def _reset_after_fork() -> None:
+    # Pool threads do not survive fork(); a worker process builds its own pool on first use
+    global _prefetcher, _prefetcher_lock
+    _prefetcher = None
+    _prefetcher_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
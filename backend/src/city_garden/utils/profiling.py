@@ -0,0 +1,306 @@
+"""
+On-demand sampling profiler for live requests.
+
+A profiled request gets a ProfileSession for its lifetime. While any session
+is open, one background thread wakes every CITY_GARDEN_PROFILE_INTERVAL_MS,
+reads the stacks of the threads currently working for a profiled request
+(sys._current_frames) and counts each stack. Threads are attributed to a
+request by sampled_thread(), which trace spans enter (see utils/tracing.py),
+so graph nodes, worker threads and prefetched work of the request are
+sampled while the event loop and other requests are not. Sampling is
+wall-clock: time spent waiting on an upstream call shows up as well.
+
+When the request ends its stacks are written in the folded format
+("frame;frame;frame count" per line) to CITY_GARDEN_PROFILE_DIR, which
+flamegraph.pl, speedscope and inferno read directly.
+
+Requests are profiled at random with CITY_GARDEN_PROFILE_SAMPLE_RATE, or on
+demand when they carry an X-Profile-Token header equal to
+CITY_GARDEN_PROFILE_TOKEN. Nothing is sampled without an open session, at
+most CITY_GARDEN_PROFILE_MAX_SESSIONS requests are profiled at once and only
+the newest CITY_GARDEN_PROFILE_MAX_FILES profiles are kept, so the hook is
+safe to leave enabled at a low rate.
+
+Configuration (environment variables):
+    CITY_GARDEN_PROFILE_SAMPLE_RATE   Fraction of requests profiled (default 0, off)
+    CITY_GARDEN_PROFILE_TOKEN         Secret that X-Profile-Token must match (unset: header ignored)
+    CITY_GARDEN_PROFILE_INTERVAL_MS   Milliseconds between samples (default 10)
+    CITY_GARDEN_PROFILE_MAX_SESSIONS  Requests profiled at the same time (default 2)
+    CITY_GARDEN_PROFILE_DIR           Where profiles are written (default: a directory in the temp dir)
+    CITY_GARDEN_PROFILE_MAX_FILES     Profiles kept on disk (default 200)
+"""
+import hmac
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import CodeType, FrameType
+from typing import Dict, Iterator, List, Optional
+
+# Deeper stacks are cut at the root end
+MAX_STACK_DEPTH = 128
+
+_session_var: ContextVar[Optional["ProfileSession"]] = ContextVar("profile_session", default=None)
+
+
+class ProfileSession:
+    """Stacks sampled from the threads working for one request."""
+
+    def __init__(self, name: str, forced: bool = False):
+        """
+        Initialize the ProfileSession.
+
+        Args:
+            name (str): File-safe name of the profile, e.g. the request's trace id
+            forced (bool): Requested through the profiling header rather than sampled
+        """
+        self.name = name
+        self.forced = forced
+        self.started = time.monotonic()
+        self.samples: Counter = Counter()
+        self.closed = False
+        # Thread ident -> number of active sampled_thread() blocks on that thread
+        self._threads: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def enter(self, ident: int) -> None:
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+
+    def leave(self, ident: int) -> None:
+        with self._lock:
+            count = self._threads.get(ident, 0) - 1
+            if count > 0:
+                self._threads[ident] = count
+            else:
+                self._threads.pop(ident, None)
+
+    def threads(self) -> List[int]:
+        with self._lock:
+            return list(self._threads)
+
+    def folded(self) -> str:
+        """The samples in folded format, most frequent stack first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def current_session() -> Optional[ProfileSession]:
+    return _session_var.get()
+
+
+@contextmanager
+def sampled_thread() -> Iterator[None]:
+    """Sample the calling thread for the current request's profile for the duration of the block (no-op without one)."""
+    session = _session_var.get()
+    if session is None or session.closed:
+        yield
+        return
+    ident = threading.get_ident()
+    session.enter(ident)
+    try:
+        yield
+    finally:
+        session.leave(ident)
+
+
+class SamplingProfiler:
+    """Background stack sampler shared by all profiled requests of the process."""
+
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: float = 0.0,
+        token: Optional[str] = None,
+        interval: float = 0.01,
+        max_sessions: int = 2,
+        max_files: int = 200,
+    ):
+        """
+        Initialize the SamplingProfiler.
+
+        Args:
+            directory (str): Where folded profiles are written
+            sample_rate (float): Fraction of requests profiled at random
+            token (Optional[str]): Secret that forces profiling of a request; None disables forcing
+            interval (float): Seconds between samples
+            max_sessions (int): Requests profiled at the same time; further ones are not profiled
+            max_files (int): Profiles kept; older ones are deleted
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.max_sessions = max_sessions
+        self.max_files = max_files
+        self._sessions: List[ProfileSession] = []
+        self._sampler: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._labels: Dict[CodeType, str] = {}
+        self.profiled = 0
+        self.skipped = 0
+
+    def wants(self, token: Optional[str]) -> Optional[bool]:
+        """
+        Decide whether a request is profiled.
+
+        Args:
+            token (Optional[str]): The request's X-Profile-Token header
+
+        Returns:
+            Optional[bool]: True if forced by a valid token, False if sampled at random, None if not profiled
+        """
+        if token and self.token and hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8")):
+            return True
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return False
+        return None
+
+    @contextmanager
+    def session(self, name: str, forced: bool = False) -> Iterator[Optional[ProfileSession]]:
+        """
+        Profile the block as one request.
+
+        The session is current inside the block; its profile is only written by finish().
+
+        Returns:
+            Optional[ProfileSession]: The session, or None if the profiler is at max_sessions
+        """
+        session = ProfileSession(name, forced)
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                self.skipped += 1
+                session = None
+            else:
+                self._sessions.append(session)
+                self.profiled += 1
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                    self._sampler.start()
+        if session is None:
+            yield None
+            return
+        token = _session_var.set(session)
+        try:
+            yield session
+        finally:
+            _session_var.reset(token)
+            with self._lock:
+                session.closed = True
+                self._sessions.remove(session)
+
+    def finish(self, session: ProfileSession) -> Optional[str]:
+        """
+        Write a closed session's profile.
+
+        Returns:
+            Optional[str]: Path of the folded profile, or None if nothing was sampled or it could not be written
+        """
+        if not session.samples:
+            return None
+        path = self.path(session.name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as profile_file:
+                profile_file.write(session.folded())
+            self._prune()
+        except OSError:
+            # Profiling is diagnostics; a full or read-only disk must not affect requests
+            return None
+        return path
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.folded")
+
+    def load(self, name: str) -> Optional[str]:
+        """Return a written profile in folded format, or None if unknown."""
+        try:
+            with open(self.path(name), encoding="utf-8") as profile_file:
+                return profile_file.read()
+        except FileNotFoundError:
+            return None
+
+    def _sample_loop(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                sessions = list(self._sessions)
+                if not sessions:
+                    self._sampler = None
+                    return
+            frames = sys._current_frames()
+            for session in sessions:
+                for ident in session.threads():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        session.samples[self._fold(frame)] += 1
+            del frames
+
+    def _fold(self, frame: Optional[FrameType]) -> str:
+        labels = []
+        while frame is not None and len(labels) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            labels.append(label)
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+    def _prune(self) -> None:
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".folded")]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"active": len(self._sessions), "profiled": self.profiled, "skipped": self.skipped}
+
+
+def _short_path(filename: str) -> str:
+    # Keep the part that identifies the module: after site-packages, or from the city_garden package on
+    for marker in ("site-packages" + os.sep, "city_garden" + os.sep):
+        index = filename.rfind(marker)
+        if index >= 0:
+            return filename[index + len(marker):] if marker.startswith("site") else filename[index:]
+    return os.path.basename(filename)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> SamplingProfiler:
+    """Return the process-wide SamplingProfiler."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = SamplingProfiler(
+                directory=os.environ.get("CITY_GARDEN_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "city-garden-profiles"),
+                sample_rate=float(os.environ.get("CITY_GARDEN_PROFILE_SAMPLE_RATE", "0")),
+                token=os.environ.get("CITY_GARDEN_PROFILE_TOKEN") or None,
+                interval=float(os.environ.get("CITY_GARDEN_PROFILE_INTERVAL_MS", "10")) / 1000,
+                max_sessions=int(os.environ.get("CITY_GARDEN_PROFILE_MAX_SESSIONS", "2")),
+                max_files=int(os.environ.get("CITY_GARDEN_PROFILE_MAX_FILES", "200")),
+            )
+        return _profiler
+
+
+def _reset_after_fork() -> None:
+    # The sampler thread does not survive fork(); a worker process starts its own with its first session
+    global _profiler, _profiler_lock
+    _profiler = None
+    _profiler_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,6 +1,7 @@
 import yaml
 import os
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, List
 
 def load_prompt(prompt_file: str, prompt_key: str) -> str:
     """
@@ -18,23 +19,41 @@ def load_prompt(prompt_file: str, prompt_key: str) -> str:
         KeyError: If the prompt key doesn't exist in the file
         yaml.YAMLError: If the YAML file is invalid
     """
-    # Get the absolute path to the prompts directory
-    prompts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), 'prompts')
-    prompt_path = os.path.join(prompts_dir, prompt_file)
+    prompts = _load_prompt_file(prompt_file)
+    if prompt_key not in prompts:
+        raise KeyError(f"Prompt key '{prompt_key}' not found in {prompt_file}")
+    return prompts[prompt_key]
+
+
+# Get the absolute path to the prompts directory
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), 'prompts')
+
+
+@lru_cache(maxsize=None)
+def _load_prompt_file(prompt_file: str) -> Dict[str, Any]:
+    """Parse a prompt file once per process; nodes ask for the same prompts on every plan."""
+    prompt_path = os.path.join(PROMPTS_DIR, prompt_file)
     
     if not os.path.exists(prompt_path):
-        raise FileNotFoundError(f"Prompt file '{prompt_file}' not found in {prompts_dir}")
+        raise FileNotFoundError(f"Prompt file '{prompt_file}' not found in {PROMPTS_DIR}")
         
     try:
         with open(prompt_path, 'r') as f:
-            prompts = yaml.safe_load(f)
-            if prompt_key not in prompts:
-                raise KeyError(f"Prompt key '{prompt_key}' not found in {prompt_file}")
-            return prompts[prompt_key]
+            return yaml.safe_load(f)
     except yaml.YAMLError as e:
         raise yaml.YAMLError(f"Error parsing YAML file {prompt_file}: {str(e)}")
-    except KeyError:
-        # Re-raise KeyError without wrapping it
-        raise
     except Exception as e:
-        raise Exception(f"Failed to load prompt from {prompt_file}: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Failed to load prompt from {prompt_file}: {str(e)}") 
+
+
+def preload_prompts() -> List[str]:
+    """
+    Parse every prompt file, e.g. in a server process before it forks its workers.
+    
+    Returns:
+        List[str]: The prompt files loaded
+    """
+    prompt_files = sorted(name for name in os.listdir(PROMPTS_DIR) if name.endswith(('.yml', '.yaml')))
+    for prompt_file in prompt_files:
+        _load_prompt_file(prompt_file)
+    return prompt_files
@@ -0,0 +1,192 @@
+"""
+Background refinement of results that were first returned as a preview.
+
+A node that can answer quickly with a cheap, lower-quality result returns
+that preview and hands the expensive version to start(). The refinement runs
+on a small thread pool; the plan's response and status endpoint read its
+outcome with get(), and a finished refinement replaces the preview. Clients
+show they are still around by polling (touch()) and may cancel() when they
+leave. A refinement whose client has not been seen for
+CITY_GARDEN_REFINE_ABANDON_SECONDS by the time a worker picks it up is
+skipped, so nobody pays for a render no one will look at.
+
+Configuration (environment variables):
+    CITY_GARDEN_REFINE_WORKERS           Threads running refinements (default 2)
+    CITY_GARDEN_REFINE_ABANDON_SECONDS   Skip refinements whose client was not seen for this long (default 60)
+    CITY_GARDEN_REFINE_DEADLINE          Seconds one refinement may take (default 300)
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from city_garden.utils.deadline import deadline_scope
+from city_garden.utils.structured_logging import fields
+
+logger = logging.getLogger(__name__)
+
+REFINE_ABANDON_SECONDS = float(os.environ.get("CITY_GARDEN_REFINE_ABANDON_SECONDS", "60"))
+REFINE_DEADLINE = float(os.environ.get("CITY_GARDEN_REFINE_DEADLINE", "300"))
+
+# Refinement states; the last four are final
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+CANCELLED = "cancelled"
+
+
+@dataclass
+class Refinement:
+    """The refinement of one key and what came of it."""
+    status: str
+    last_seen: float
+    result: Any = None
+    error: Optional[str] = None
+    future: Optional[Future] = None
+
+
+class Refinements:
+    """Thread pool plus a registry of refinements, one per key (e.g. per plan)."""
+
+    def __init__(self, max_workers: int = 2, abandon_after: float = REFINE_ABANDON_SECONDS):
+        """
+        Initialize the Refinements.
+
+        Args:
+            max_workers (int): Threads running refinements
+            abandon_after (float): Seconds without touch() after which a queued refinement is skipped
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="refine")
+        self._refinements: Dict[str, Refinement] = {}
+        self._lock = threading.Lock()
+        self.abandon_after = abandon_after
+        self.counts = {DONE: 0, FAILED: 0, SKIPPED: 0, CANCELLED: 0}
+
+    def start(self, key: str, compute: Callable[[], Any]) -> None:
+        """
+        Refine key in the background, superseding an earlier refinement of the same key.
+
+        compute() runs in the caller's context (request id, shared-work scope) but under its
+        own deadline, since it outlives the request that started it.
+
+        Args:
+            key (str): What is refined, e.g. a plan id
+            compute (Callable[[], Any]): The expensive render; its return value becomes the result
+        """
+        refinement = Refinement(status=PENDING, last_seen=time.monotonic())
+        context = contextvars.copy_context()
+        with self._lock:
+            previous = self._refinements.get(key)
+            self._refinements[key] = refinement
+            refinement.future = self._executor.submit(context.run, self._run, key, refinement, compute)
+        if previous is not None:
+            self._finish(previous, CANCELLED, cancel=True)
+
+    def _run(self, key: str, refinement: Refinement, compute: Callable[[], Any]) -> None:
+        with self._lock:
+            if refinement.status != PENDING:
+                return
+            if time.monotonic() - refinement.last_seen > self.abandon_after:
+                refinement.status = SKIPPED
+                self.counts[SKIPPED] += 1
+                logger.info("Refinement skipped, client gone", extra=fields(key=key))
+                return
+            refinement.status = RUNNING
+        try:
+            with deadline_scope(REFINE_DEADLINE, detached=True):
+                result = compute()
+        except Exception as e:
+            logger.error("Refinement failed", extra=fields(key=key, error=e))
+            with self._lock:
+                refinement.error = str(e)
+            self._finish(refinement, FAILED)
+            return
+        with self._lock:
+            # A superseded or cancelled refinement keeps its status; its result is dropped
+            if refinement.status != RUNNING:
+                return
+            refinement.result = result
+        self._finish(refinement, DONE)
+
+    def _finish(self, refinement: Refinement, status: str, cancel: bool = False) -> None:
+        with self._lock:
+            if refinement.status not in (PENDING, RUNNING):
+                return
+            refinement.status = status
+            self.counts[status] += 1
+        if cancel and refinement.future is not None:
+            refinement.future.cancel()
+
+    def get(self, key: str) -> Optional[Refinement]:
+        """Return the refinement of key, or None if none was started (or it was released)."""
+        with self._lock:
+            return self._refinements.get(key)
+
+    def touch(self, key: str) -> None:
+        """Record that the client waiting for key is still there."""
+        with self._lock:
+            refinement = self._refinements.get(key)
+            if refinement is not None:
+                refinement.last_seen = time.monotonic()
+
+    def cancel(self, key: str) -> Optional[Refinement]:
+        """
+        Stop refining key because its client left.
+
+        A refinement that has not started is never run; one that is running finishes,
+        but its result is dropped.
+
+        Returns:
+            Optional[Refinement]: The refinement, or None if none was started
+        """
+        refinement = self.get(key)
+        if refinement is not None:
+            self._finish(refinement, CANCELLED, cancel=True)
+        return refinement
+
+    def release(self, key: str) -> None:
+        """Cancel and forget the refinement of key, e.g. when its plan session expires."""
+        with self._lock:
+            refinement = self._refinements.pop(key, None)
+        if refinement is not None:
+            self._finish(refinement, CANCELLED, cancel=True)
+
+    def drain(self, timeout: Optional[float] = None) -> None:
+        """Wait until the refinements started so far have finished, or timeout seconds have passed."""
+        with self._lock:
+            futures = [refinement.future for refinement in self._refinements.values() if refinement.future is not None]
+        wait(futures, timeout=timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            active = sum(refinement.status in (PENDING, RUNNING) for refinement in self._refinements.values())
+            return {"active": active, **self.counts}
+
+
+_refinements = None
+_refinements_lock = threading.Lock()
+
+
+def get_refinements() -> Refinements:
+    """Return the process-wide Refinements."""
+    global _refinements
+    with _refinements_lock:
+        if _refinements is None:
+            _refinements = Refinements(max_workers=int(os.environ.get("CITY_GARDEN_REFINE_WORKERS", "2")))
+        return _refinements
+
+
+def _reset_after_fork() -> None:
+    # Pool threads do not survive fork(); a worker process builds its own pool on first use
+    global _refinements, _refinements_lock
+    _refinements = None
+    _refinements_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
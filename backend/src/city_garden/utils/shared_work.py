@@ -0,0 +1,103 @@
+"""
+Compute-once sharing of work between concurrent plans.
+
+A batch submission binds a SharedWork scope; inside it, shared(key, compute)
+runs compute at most once per key and every other plan asking for the same key
+waits for, and reuses, that result. Outside a scope shared() simply calls
+compute, so single plans behave exactly as before.
+
+Every plan keeps its own deadline: a waiter gives up with DeadlineExceeded
+when its own time is up, and when the computing plan fails because its
+deadline ran out (or its upstream call timed out), a waiter with time left
+takes the computation over instead of failing with it.
+"""
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+from openai import APITimeoutError
+
+from city_garden.utils.deadline import DeadlineExceeded, remaining
+
+T = TypeVar("T")
+
+# Failures caused by the computing plan's own time budget rather than by the work itself
+OWNER_TIME_ERRORS = (DeadlineExceeded, TimeoutError, APITimeoutError)
+
+
+class SharedWork:
+    """Single-flight memo: the first caller of a key computes, concurrent callers wait."""
+
+    def __init__(self):
+        self._futures: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.takeovers = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """
+        Return compute() for key, computing it only if no other plan is already doing so.
+
+        Raises:
+            DeadlineExceeded: If the caller's deadline passes while it waits for another plan
+        """
+        while True:
+            with self._lock:
+                future = self._futures.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._futures[key] = future
+                    self.misses += 1
+                else:
+                    self.hits += 1
+
+            if owner:
+                try:
+                    future.set_result(compute())
+                except BaseException as e:
+                    # Do not memoize failures; a later caller may succeed
+                    with self._lock:
+                        self._futures.pop(key, None)
+                    future.set_exception(e)
+                return future.result()
+
+            left = remaining()
+            try:
+                return future.result(timeout=None if left is None else max(left, 0.0))
+            except Exception as e:
+                if not future.done():
+                    raise DeadlineExceeded("Request deadline exceeded while waiting for shared work") from None
+                if not isinstance(e, OWNER_TIME_ERRORS):
+                    raise
+            # The owner ran out of its own time; this plan may still have enough, so the first waiter takes over
+            with self._lock:
+                self.takeovers += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "takeovers": self.takeovers}
+
+
+shared_work_var: ContextVar[Optional[SharedWork]] = ContextVar("shared_work", default=None)
+
+
+@contextmanager
+def shared_work_scope(shared_work: SharedWork):
+    """Share work between every plan run inside the block (including threads started from it)."""
+    token = shared_work_var.set(shared_work)
+    try:
+        yield shared_work
+    finally:
+        shared_work_var.reset(token)
+
+
+def shared(key: Hashable, compute: Callable[[], T]) -> T:
+    """Return compute(), reusing the result for key within the current SharedWork scope."""
+    shared_work = shared_work_var.get()
+    if shared_work is None:
+        return compute()
+    return shared_work.get_or_compute(key, compute)
@@ -0,0 +1,238 @@
+"""
+Structured, non-blocking logging for the city garden pipeline.
+
+Records are handed to a queue by the calling thread and written to stdout by a
+background listener, so request handling never waits on log I/O. Payload
+fields are size-capped when the record is created, which keeps the cost of a
+log call constant no matter how large an LLM response or dataset is.
+Verbose DEBUG output is sampled per request. Tracebacks travel through the
+queue as their own field, capped at EXC_LIMIT characters.
+
+Configuration (environment variables):
+    CITY_GARDEN_LOG_LEVEL              Root log level (default INFO)
+    CITY_GARDEN_LOG_FORMAT             "json" (default) or "text"
+    CITY_GARDEN_LOG_FIELD_LIMIT        Max characters per payload field (default 512)
+    CITY_GARDEN_LOG_DEBUG_SAMPLE_RATE  Fraction of requests whose DEBUG records are kept (default 0.01)
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import reprlib
+import sys
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_field_limit = int(os.environ.get("CITY_GARDEN_LOG_FIELD_LIMIT", "512"))
+_debug_sample_rate = float(os.environ.get("CITY_GARDEN_LOG_DEBUG_SAMPLE_RATE", "0.01"))
+
+_repr = reprlib.Repr()
+_repr.maxstring = _field_limit
+_repr.maxother = _field_limit
+_repr.maxlist = _repr.maxdict = _repr.maxtuple = _repr.maxset = 10
+_repr.maxlevel = 3
+
+# Max characters of a logged traceback
+EXC_LIMIT = 4096
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_request_id() -> str:
+    """Return a fresh request correlation id."""
+    return uuid.uuid4().hex
+
+
+def get_request_id() -> Optional[str]:
+    """Return the correlation id bound to the current context, if any."""
+    return request_id_var.get()
+
+
+@contextmanager
+def request_context(request_id: Optional[str]):
+    """Bind request_id to every record logged inside the block."""
+    token = request_id_var.set(request_id)
+    try:
+        yield request_id
+    finally:
+        request_id_var.reset(token)
+
+
+def cap(value: Any, limit: Optional[int] = None) -> str:
+    """Render value as a string of at most roughly limit characters.
+
+    Strings are sliced, everything else goes through reprlib so that large
+    containers are abbreviated instead of being rendered in full.
+    """
+    limit = limit or _field_limit
+    if isinstance(value, str):
+        text = value
+    elif isinstance(value, (int, float, bool)) or value is None:
+        return str(value)
+    else:
+        text = _repr.repr(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...(+{len(text) - limit} chars)"
+
+
+def fields(**values: Any) -> Dict[str, Any]:
+    """Build the `extra` mapping for a structured log call, capping every field."""
+    return {"fields": {key: cap(value) for key, value in values.items()}}
+
+
+def debug_sampled(logger: logging.Logger) -> bool:
+    """Return True if verbose DEBUG output should be produced for the current request.
+
+    Callers use this to skip building expensive debug payloads entirely.
+    """
+    return logger.isEnabledFor(logging.DEBUG) and _sample(get_request_id())
+
+
+def _sample(request_id: Optional[str]) -> bool:
+    if _debug_sample_rate >= 1:
+        return True
+    if _debug_sample_rate <= 0:
+        return False
+    if request_id is None:
+        return random.random() < _debug_sample_rate
+    # Deterministic per request, so a sampled request keeps all of its debug records
+    return zlib.crc32(request_id.encode("utf-8")) % 10000 < _debug_sample_rate * 10000
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request id to the record and sample DEBUG records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            record.request_id = get_request_id()
+        if record.levelno <= logging.DEBUG:
+            return _sample(record.request_id)
+        return True
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that keeps the traceback out of the message, as a capped `exception` attribute."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The base class formats the traceback into msg and drops exc_info, so formatters never see it
+        exception = None
+        if record.exc_info:
+            exception = cap(logging.Formatter().formatException(record.exc_info), EXC_LIMIT)
+        elif record.exc_text:
+            exception = cap(record.exc_text, EXC_LIMIT)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.exception = exception
+        return record
+
+
+def _exception(formatter: logging.Formatter, record: logging.LogRecord) -> Optional[str]:
+    exception = getattr(record, "exception", None)
+    if exception is None and record.exc_info:
+        exception = cap(formatter.formatException(record.exc_info), EXC_LIMIT)
+    return exception
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            payload["request_id"] = record.request_id
+        payload.update(getattr(record, "fields", None) or {})
+        exception = _exception(self, record)
+        if exception:
+            payload["exc"] = exception
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable formatter that appends structured fields as key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = getattr(record, "fields", None)
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        exception = getattr(record, "exception", None)
+        if exception:
+            line += "\n" + exception
+        return line
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None) -> None:
+    """Route all logging through a queue to a background stdout writer.
+
+    Safe to call more than once; later calls replace the previous configuration.
+    """
+    global _listener
+
+    level = level or os.environ.get("CITY_GARDEN_LOG_LEVEL", "INFO")
+    fmt = fmt or os.environ.get("CITY_GARDEN_LOG_FORMAT", "json")
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener_after_fork() -> None:
+    """Give a forked worker its own queue and writer thread; the parent's thread does not survive fork()."""
+    global _listener
+    if _listener is None:
+        return
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+atexit.register(shutdown_logging)
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
@@ -0,0 +1,316 @@
+"""
+Span tracing of plan requests, exported to local JSONL files.
+
+span() times a block and records it with its parent, the span that was
+current when the block started. The current span lives in a ContextVar, so
+it follows the request into asyncio.to_thread, graph nodes, prefetched and
+background work, which all run in a copy of the caller's context; spans that
+overlap in time on different threads show what ran concurrently. A request's
+root span gets a fresh, server-generated trace id and records the request id
+as an attribute; the request id may come from the client, so it never names
+a trace file, and a client reusing one id cannot grow a trace or mix requests.
+
+Finished spans are handed to a queue and appended by a background writer to
+<CITY_GARDEN_TRACE_DIR>/<trace id>.jsonl, one JSON object per span, so the
+request never waits on disk. Only the newest CITY_GARDEN_TRACE_MAX_FILES
+traces are kept. render_waterfall() draws a trace as an HTML waterfall; the
+API serves it under /api/debug/traces/{trace_id}. Nothing here depends on
+LangSmith.
+
+Configuration (environment variables):
+    CITY_GARDEN_TRACING            "true" (default) or "false"
+    CITY_GARDEN_TRACE_DIR          Where traces are written (default: a directory in the temp dir)
+    CITY_GARDEN_TRACE_MAX_FILES    Traces kept on disk (default 1000)
+    CITY_GARDEN_TRACE_SAMPLE_RATE  Fraction of requests traced (default 1.0)
+"""
+import functools
+import html
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from city_garden.utils.profiling import sampled_thread
+from city_garden.utils.structured_logging import cap, get_request_id
+
+TRACING_ENABLED = os.environ.get("CITY_GARDEN_TRACING", "true").lower() in ("1", "true", "yes")
+TRACE_DIR = os.environ.get("CITY_GARDEN_TRACE_DIR") or os.path.join(tempfile.gettempdir(), "city-garden-traces")
+TRACE_MAX_FILES = int(os.environ.get("CITY_GARDEN_TRACE_MAX_FILES", "1000"))
+TRACE_SAMPLE_RATE = float(os.environ.get("CITY_GARDEN_TRACE_SAMPLE_RATE", "1.0"))
+
+# Old traces are pruned once per this many written spans
+PRUNE_EVERY = 200
+
+_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+@dataclass
+class Span:
+    """One timed block of a trace."""
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    sampled: bool
+    start: float = field(default_factory=time.time)
+    attributes: Dict[str, str] = field(default_factory=dict)
+
+    def set(self, **attributes: Any) -> None:
+        """Add attributes to the span (capped like log fields)."""
+        self.attributes.update({key: cap(value) for key, value in attributes.items()})
+
+
+_span_var: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def is_trace_id(value: str) -> bool:
+    """True for ids new_trace_id() can produce, so nothing else can name a trace file."""
+    return bool(_TRACE_ID.match(value))
+
+
+def _sampled(trace_id: str) -> bool:
+    if not TRACING_ENABLED or TRACE_SAMPLE_RATE <= 0:
+        return False
+    if TRACE_SAMPLE_RATE >= 1:
+        return True
+    return zlib.crc32(trace_id.encode("utf-8")) % 10000 < TRACE_SAMPLE_RATE * 10000
+
+
+def current_span() -> Optional[Span]:
+    return _span_var.get()
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """
+    Record the block as a span, a child of the current span.
+
+    Without a current span the block starts a trace, which records the bound request id.
+
+    Args:
+        name (str): What the block does, e.g. "node:create_garden_image" or "blob_upload"
+        trace_id (Optional[str]): Id of a trace started here (from new_trace_id()); a fresh one if None
+        **attributes: Details shown with the span, e.g. the plan id or image size
+    """
+    parent = _span_var.get()
+    if parent is not None:
+        trace_id, sampled = parent.trace_id, parent.sampled
+    else:
+        trace_id = trace_id or new_trace_id()
+        sampled = _sampled(trace_id)
+        request_id = get_request_id()
+        if request_id:
+            attributes = {"request_id": request_id, **attributes}
+    current = Span(
+        trace_id=trace_id,
+        span_id=uuid.uuid4().hex[:16],
+        parent_id=parent.span_id if parent is not None else None,
+        name=name,
+        sampled=sampled,
+    )
+    current.set(**attributes)
+    started = time.perf_counter()
+    token = _span_var.set(current)
+    error = None
+    try:
+        # Spans below the root mark the thread as working for the request, so a profiled request samples it;
+        # the root span runs on the event loop, which serves every request
+        with sampled_thread() if parent is not None else nullcontext():
+            yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        try:
+            _span_var.reset(token)
+        except ValueError:
+            # A generator holding the span was closed from another context; that context never saw it
+            pass
+        if current.sampled:
+            get_exporter().export({
+                "trace_id": current.trace_id,
+                "span_id": current.span_id,
+                "parent_id": current.parent_id,
+                "name": current.name,
+                "start": current.start,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "thread": threading.current_thread().name,
+                "attributes": current.attributes,
+                "error": cap(f"{type(error).__name__}: {error}") if error is not None else None,
+            })
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Decorator recording every call of the function as a span (the signature is kept, e.g. for LangGraph nodes)."""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class JsonlTraceExporter:
+    """Appends finished spans to one JSONL file per trace from a background thread."""
+
+    def __init__(self, directory: str = TRACE_DIR, max_files: int = TRACE_MAX_FILES):
+        """
+        Initialize the JsonlTraceExporter.
+
+        Args:
+            directory (str): Where trace files are written
+            max_files (int): Traces kept; older ones are deleted
+        """
+        self.directory = directory
+        self.max_files = max_files
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._written = 0
+
+    def export(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="trace-exporter", daemon=True)
+                self._writer.start()
+        self._queue.put(record)
+
+    def flush(self) -> None:
+        """Wait until every span exported so far is on disk."""
+        if self._writer is not None:
+            self._queue.join()
+
+    def path(self, trace_id: str) -> str:
+        return os.path.join(self.directory, f"{trace_id}.jsonl")
+
+    def load(self, trace_id: str) -> List[Dict[str, Any]]:
+        """Return the spans of a trace ordered by start time (empty if unknown)."""
+        if not is_trace_id(trace_id):
+            return []
+        self.flush()
+        try:
+            with open(self.path(trace_id), encoding="utf-8") as trace_file:
+                spans = [json.loads(line) for line in trace_file if line.strip()]
+        except FileNotFoundError:
+            return []
+        return sorted(spans, key=lambda record: record["start"])
+
+    def _write_loop(self) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError:
+            pass
+        while True:
+            record = self._queue.get()
+            try:
+                with open(self.path(record["trace_id"]), "a", encoding="utf-8") as trace_file:
+                    trace_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                self._written += 1
+                if self._written % PRUNE_EVERY == 0:
+                    self._prune()
+            except OSError:
+                # Tracing is diagnostics; a full or read-only disk must not affect requests
+                pass
+            finally:
+                self._queue.task_done()
+
+    def _prune(self) -> None:
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".jsonl")]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+def render_waterfall(spans: List[Dict[str, Any]]) -> str:
+    """
+    Draw a trace as an HTML waterfall.
+
+    Every span is a row, indented under its parent, with a bar placed at its start and as wide as its
+    duration relative to the whole trace; rows are ordered by start time.
+
+    Args:
+        spans (List[Dict[str, Any]]): The spans of one trace, as exported
+
+    Returns:
+        str: A standalone HTML page
+    """
+    if not spans:
+        return "<html><body><p>Empty trace</p></body></html>"
+    by_id = {record["span_id"]: record for record in spans}
+
+    def depth(record: Dict[str, Any]) -> int:
+        level, parent = 0, by_id.get(record.get("parent_id"))
+        while parent is not None and level < 64:
+            level, parent = level + 1, by_id.get(parent.get("parent_id"))
+        return level
+
+    begin = min(record["start"] for record in spans)
+    end = max(record["start"] + record["duration_ms"] / 1000 for record in spans)
+    total = max(end - begin, 1e-6)
+    rows = []
+    for record in sorted(spans, key=lambda record: record["start"]):
+        left = (record["start"] - begin) / total * 100
+        width = max(record["duration_ms"] / 1000 / total * 100, 0.2)
+        details = " ".join(f"{key}={value}" for key, value in (record.get("attributes") or {}).items())
+        title = html.escape(f"{record['name']} {record['duration_ms']:.1f} ms {details} {record.get('error') or ''}".strip())
+        color = "#d9534f" if record.get("error") else "#5b8def"
+        rows.append(
+            f'<tr title="{title}"><td style="padding-left:{depth(record) * 14}px">{html.escape(record["name"])}</td>'
+            f'<td>{html.escape(record.get("thread") or "")}</td>'
+            f'<td class="ms">{(record["start"] - begin) * 1000:.1f}</td><td class="ms">{record["duration_ms"]:.1f}</td>'
+            f'<td class="lane"><div style="margin-left:{left:.3f}%;width:{width:.3f}%;background:{color}"></div></td></tr>'
+        )
+    return (
+        "<html><head><meta charset='utf-8'><title>Trace "
+        f"{html.escape(spans[0]['trace_id'])}</title><style>"
+        "body{font:12px sans-serif}table{border-collapse:collapse;width:100%}"
+        "td{padding:2px 6px;white-space:nowrap;border-bottom:1px solid #eee}"
+        "td.ms{text-align:right}td.lane{width:55%}td.lane div{height:10px}"
+        "</style></head><body>"
+        f"<h3>Trace {html.escape(spans[0]['trace_id'])}: {len(spans)} spans, {total * 1000:.1f} ms</h3>"
+        "<table><tr><th>Span</th><th>Thread</th><th>Start ms</th><th>Duration ms</th><th></th></tr>"
+        + "".join(rows)
+        + "</table></body></html>"
+    )
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> JsonlTraceExporter:
+    """Return the process-wide exporter."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = JsonlTraceExporter()
+        return _exporter
+
+
+def _reset_after_fork() -> None:
+    # The writer thread does not survive fork(); a worker process starts its own on first export
+    global _exporter, _exporter_lock
+    _exporter = None
+    _exporter_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
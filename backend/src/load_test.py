@@ -0,0 +1,506 @@
+"""
+Load-testing harness for the City Garden API.
+
+Drives POST /api/garden_plan with an open-loop arrival process and reports
+throughput, latency percentiles, error rates and event-loop lag.
+
+By default the FastAPI app is run in-process with local stand-in backends
+(blob storage, content safety, chat model and image generation), so the
+numbers reflect our own request handling rather than upstream quotas.
+Pass --replay to answer upstream calls from a recorded cassette instead (see
+cassette.py), with production-shaped payloads and latencies, or --url to
+drive an already running server.
+
+Example:
+    python src/load_test.py --rate 5 --duration 60 --repeat-ratio 0.3
+    python src/load_test.py --rate 5 --duration 60 --replay cassettes/2024-06-prod
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+from unittest import mock
+
+import httpx
+from PIL import Image
+
+
+@lru_cache(maxsize=256)
+def stand_in_photo(blob_url: str) -> bytes:
+    """Deterministic 640x480 JPEG for a blob URL, so repeat users upload identical bytes."""
+    rng = random.Random(blob_url)
+    image = Image.frombytes("RGB", (160, 120), rng.randbytes(160 * 120 * 3)).resize((640, 480))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+STAND_IN_ANALYSIS = json.dumps({
+    "sun_exposure": "South-facing, full sun for most of the day",
+    "micro_climate": "Sheltered by walls, warmer than surroundings",
+    "hardscape_elements": "Concrete floor, metal railing",
+    "plant_inventory": "None",
+    "environment_factors": "Urban, moderate rainfall",
+    "wind_pattern": "Light westerly winds"
+})
+
+STAND_IN_RECOMMENDATIONS = json.dumps({
+    "plant_recommendations": [
+        {
+            "id": str(idx),
+            "name": name,
+            "description": f"{name} grows well in containers.",
+            "growingConditions": "Full sun, well-drained soil",
+            "plantingTips": "Plant after the last frost",
+            "care_tips": "Water when the top soil is dry",
+            "harvestingTips": "Harvest regularly"
+        }
+        for idx, name in enumerate(["Basil", "Cherry Tomato", "Lavender"])
+    ]
+})
+
+
+@dataclass
+class StandInLatency:
+    """Median latencies (seconds) of the stand-in backends."""
+    blob: float = 0.05
+    content_safety: float = 0.1
+    llm: float = 1.5
+    image: float = 4.0
+    # Log-normal sigma applied to every latency to get a realistic tail
+    jitter: float = 0.3
+
+    def sample(self, median: float) -> float:
+        if median <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.jitter) * median
+
+
+class _StandInMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StandInLLM:
+    """Chat model stand-in that answers each pipeline prompt with a canned response."""
+
+    def __init__(self, latency: StandInLatency):
+        self.latency = latency
+
+    def invoke(self, messages, *args, **kwargs):
+        time.sleep(self.latency.sample(self.latency.llm))
+        return self.answer(messages)
+
+    async def ainvoke(self, messages, *args, **kwargs):
+        await asyncio.sleep(self.latency.sample(self.latency.llm))
+        return self.answer(messages)
+
+    def stream(self, messages, *args, **kwargs):
+        # Spread the latency over token-sized chunks, like a streamed completion
+        content = self.answer(messages).content
+        chunks = [content[i:i + 16] for i in range(0, len(content), 16)]
+        delay = self.latency.sample(self.latency.llm) / len(chunks)
+        for chunk in chunks:
+            time.sleep(delay)
+            yield _StandInMessage(chunk)
+
+    def answer(self, messages):
+        system_prompt = str(messages[0].content)
+        if "compliance inspector" in system_prompt:
+            return _StandInMessage("Pass")
+        if "botany expert" in system_prompt:
+            return _StandInMessage(STAND_IN_RECOMMENDATIONS)
+        return _StandInMessage(STAND_IN_ANALYSIS)
+
+
+# Share of the image latency a render of each quality takes
+IMAGE_QUALITY_LATENCY = {"low": 0.25, "medium": 1.0, "high": 2.5}
+
+
+class _StandInImages:
+    def __init__(self, latency: StandInLatency):
+        self.latency = latency
+
+    def _respond(self, prompt: str, quality: str):
+        time.sleep(self.latency.sample(self.latency.image * IMAGE_QUALITY_LATENCY.get(quality, 1.0)))
+        image = stand_in_photo(prompt)
+        item = mock.Mock(b64_json=base64.b64encode(image).decode("utf-8"))
+        return mock.Mock(data=[item])
+
+    def edit(self, *args, **kwargs):
+        return self._respond(kwargs.get("prompt", ""), kwargs.get("quality", "medium"))
+
+    def generate(self, *args, **kwargs):
+        return self._respond(kwargs.get("prompt", ""), kwargs.get("quality", "medium"))
+
+
+class StandInOpenAI:
+    """OpenAI client stand-in exposing images.edit and images.generate."""
+
+    latency = StandInLatency()
+
+    def __init__(self, *args, **kwargs):
+        self.images = _StandInImages(self.latency)
+
+
+class StandInImageLoader:
+    """AzureImageLoader stand-in that serves a generated photo for any blob URL."""
+
+    latency = StandInLatency()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def load_image(self, blob_url):
+        time.sleep(self.latency.sample(self.latency.blob))
+        return base64.b64encode(stand_in_photo(blob_url)).decode("utf-8")
+
+    def load_images(self, blob_urls):
+        return [self.load_image(blob_url) for blob_url in blob_urls]
+
+
+class StandInBlockUpload:
+    """BlockUpload stand-in that counts staged blocks without storing them."""
+
+    def __init__(self, url: str, latency: StandInLatency, block_bytes: int = 4 * 1024 * 1024):
+        self.url = url
+        self.latency = latency
+        self.block_bytes = block_bytes
+        self.size = 0
+        self.staged_blocks = 0
+        self._pending = 0
+
+    def write(self, data):
+        self._pending += len(data)
+        self.size += len(data)
+        return self._pending >= self.block_bytes
+
+    def stage(self):
+        while self._pending >= self.block_bytes:
+            time.sleep(self.latency.sample(self.latency.blob))
+            self._pending -= self.block_bytes
+            self.staged_blocks += 1
+
+    def commit(self, content_type):
+        self.stage()
+        self.staged_blocks += 1
+        time.sleep(self.latency.sample(self.latency.blob))
+        return f'"0x{uuid.uuid4().hex[:16].upper()}"'
+
+
+class StandInAssetStore:
+    """AssetStore stand-in that names assets by content hash without storing them."""
+
+    def __init__(self, latency: StandInLatency):
+        self.latency = latency
+
+    def url_for(self, container_name, blob_name):
+        return f"https://loadtest.blob.core.windows.net/{container_name}/{blob_name}"
+
+    def open_upload(self, blob_name, container_name=None):
+        return StandInBlockUpload(self.url_for(container_name or "images", blob_name), self.latency)
+
+    def put(self, data, content_type, extension, container_name=None):
+        from city_garden.services.asset_store import AssetStore
+        time.sleep(self.latency.sample(self.latency.blob))
+        blob_name = AssetStore.blob_name_for(data, extension)
+        return self.url_for(container_name or "images", blob_name)
+
+
+class StandInContentAnalyzer:
+    """ContentAnalyzer stand-in that reports every image as safe."""
+
+    latency = StandInLatency()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def analyze_image_data(self, image_data):
+        from city_garden.services.content_safety import ImageAnalysisResult
+        time.sleep(self.latency.sample(self.latency.content_safety))
+        return ImageAnalysisResult(0, 0, 0, 0)
+
+
+def stand_in_climate_profile(latitude, longitude):
+    """Temperate central-European climate for any site, instead of querying Open-Meteo."""
+    from city_garden.tools.climate import ClimateProfile
+    return ClimateProfile(
+        monthly_temperature_c=[0.5, 1.5, 5.0, 9.5, 14.0, 17.5, 19.5, 19.0, 15.0, 10.0, 5.0, 1.5],
+        monthly_daily_precipitation_mm=[1.4, 1.2, 1.3, 1.2, 1.8, 2.1, 1.8, 1.9, 1.5, 1.3, 1.5, 1.6],
+        monthly_wind_max_kmh=[24.0, 23.0, 23.0, 20.0, 19.0, 18.0, 18.0, 17.0, 18.0, 20.0, 21.0, 23.0],
+        monthly_frost_days=[14.0, 11.0, 6.0, 1.5, 0.0, 0.0, 0.0, 0.0, 0.0, 0.5, 5.0, 11.0],
+    )
+
+
+def use_stand_in_environment() -> None:
+    """Fill in the settings the API module reads at import, so it loads without real credentials."""
+    for name, value in {
+        "AZURE_MODEL_NAME": "loadtest",
+        "AZURE_OPENAI_ENDPOINT": "https://loadtest.openai.azure.com",
+        "AZURE_OPENAI_API_KEY": "loadtest",
+        "OPENAI_API_VERSION": "2024-12-01-preview",
+        "AZURE_STORAGE_ACCOUNT_NAME": "loadtest",
+        "AZURE_STORAGE_ACCOUNT_KEY": "bG9hZHRlc3Q=",
+        "AZURE_CONTENT_SAFETY_ENDPOINT": "https://loadtest.cognitiveservices.azure.com",
+        "AZURE_CONTENT_SAFETY_KEY": "loadtest",
+    }.items():
+        os.environ.setdefault(name, value)
+
+
+@contextmanager
+def stand_in_backends(latency: StandInLatency):
+    """Wire the API module to local stand-ins for every upstream dependency."""
+    use_stand_in_environment()
+    import api
+    from city_garden import city_garden_nodes
+    from city_garden.utils.refinement import get_refinements
+
+    for stand_in in (StandInOpenAI, StandInImageLoader, StandInContentAnalyzer):
+        stand_in.latency = latency
+
+    with mock.patch.object(api, "AzureImageLoader", StandInImageLoader), \
+            mock.patch.object(api, "get_asset_store", lambda: StandInAssetStore(latency)), \
+            mock.patch.object(api, "ContentAnalyzer", StandInContentAnalyzer), \
+            mock.patch.object(city_garden_nodes, "get_asset_store", lambda: StandInAssetStore(latency)), \
+            mock.patch.object(city_garden_nodes, "OpenAI", StandInOpenAI), \
+            mock.patch.object(city_garden_nodes, "get_climate_profile", stand_in_climate_profile), \
+            mock.patch.object(city_garden_nodes, "llm", StandInLLM(latency)):
+        try:
+            yield api.app
+        finally:
+            # Garden image refinements still running must finish against the stand-ins
+            get_refinements().drain()
+
+
+@dataclass
+class LoadTestConfig:
+    """Shape of the generated traffic."""
+    rate: float = 2.0                # mean arrivals per second
+    duration: float = 30.0           # seconds during which new requests arrive
+    poisson: bool = True             # exponential inter-arrival times, else constant
+    min_images: int = 1
+    max_images: int = 3
+    repeat_ratio: float = 0.0        # fraction of requests reusing an earlier user's photos
+    timeout: float = 300.0           # per-request client timeout
+    lag_interval: float = 0.05       # event-loop lag probe period
+    seed: Optional[int] = None
+
+
+@dataclass
+class LoadTestReport:
+    """Aggregated results of one load test run."""
+    requests: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    throughput: float = 0.0
+    error_rate: float = 0.0
+    latency_p50: float = 0.0
+    latency_p95: float = 0.0
+    latency_p99: float = 0.0
+    latency_max: float = 0.0
+    loop_lag_p50: float = 0.0
+    loop_lag_p99: float = 0.0
+    loop_lag_max: float = 0.0
+    status_codes: Dict[str, int] = field(default_factory=dict)
+    latency_by_image_count: Dict[str, float] = field(default_factory=dict)
+    # Successful plans by the degradation level they were admitted with
+    degradation_levels: Dict[str, int] = field(default_factory=dict)
+    # Upstream calls answered from a cassette (--replay): exact, fallback and missed
+    replay: Dict[str, int] = field(default_factory=dict)
+
+    def format(self) -> str:
+        lines = [
+            f"requests        {self.requests} ({self.succeeded} ok, {self.failed} failed)",
+            f"elapsed         {self.elapsed:.1f} s",
+            f"throughput      {self.throughput:.2f} plans/s",
+            f"error rate      {self.error_rate:.1%}",
+            f"latency         p50 {self.latency_p50:.3f} s  p95 {self.latency_p95:.3f} s  "
+            f"p99 {self.latency_p99:.3f} s  max {self.latency_max:.3f} s",
+            f"event-loop lag  p50 {self.loop_lag_p50 * 1000:.1f} ms  p99 {self.loop_lag_p99 * 1000:.1f} ms  "
+            f"max {self.loop_lag_max * 1000:.1f} ms",
+            f"status codes    {self.status_codes}",
+            f"p50 by images   {self.latency_by_image_count}",
+            f"degradation     {self.degradation_levels}",
+        ]
+        if self.replay:
+            lines.append(f"replayed calls  {self.replay}")
+        return "\n".join(lines)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of values (pct in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _build_payload(config: LoadTestConfig, users: List[List[str]]) -> Dict:
+    if users and random.random() < config.repeat_ratio:
+        image_urls = random.choice(users)
+    else:
+        count = random.randint(config.min_images, config.max_images)
+        image_urls = [
+            f"https://loadtest.blob.core.windows.net/uploads/{uuid.uuid4()}.jpg"
+            for _ in range(count)
+        ]
+        users.append(image_urls)
+    return {
+        "image_urls": image_urls,
+        "user_preferences": {
+            "growType": random.choice(["edible", "ornamental"]),
+            "subType": random.choice(["herbs", "vegetables", "flowering"]),
+            "cycleType": random.choice(["annual", "perennial"]),
+            "winterType": random.choice(["outdoors", "indoors"]),
+        },
+        "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+    }
+
+
+async def _monitor_loop_lag(interval: float, samples: List[float], stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+async def run_load_test(client: httpx.AsyncClient, config: LoadTestConfig) -> LoadTestReport:
+    """Run one open-loop load test against client and aggregate the results."""
+    if config.seed is not None:
+        random.seed(config.seed)
+
+    results: List[Tuple[int, float, str]] = []
+    lag_samples: List[float] = []
+    users: List[List[str]] = []
+    degradation_levels: List[int] = []
+
+    async def fire(payload: Dict):
+        started = time.perf_counter()
+        try:
+            response = await client.post("/api/garden_plan", json=payload, timeout=config.timeout)
+            status = str(response.status_code)
+            if response.status_code == 200:
+                degradation_levels.append(response.json().get("degradation_level", 0))
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append((len(payload["image_urls"]), time.perf_counter() - started, status))
+
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_loop_lag(config.lag_interval, lag_samples, stop))
+    tasks = []
+    started = time.perf_counter()
+    next_arrival = 0.0
+    while next_arrival < config.duration:
+        delay = next_arrival - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(fire(_build_payload(config, users))))
+        next_arrival += random.expovariate(config.rate) if config.poisson else 1.0 / config.rate
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    latencies = [latency for _, latency, status in results if status == "200"]
+    report = LoadTestReport(
+        requests=len(results),
+        succeeded=len(latencies),
+        failed=len(results) - len(latencies),
+        elapsed=elapsed,
+        throughput=len(latencies) / elapsed if elapsed else 0.0,
+        error_rate=(len(results) - len(latencies)) / len(results) if results else 0.0,
+        latency_p50=percentile(latencies, 50),
+        latency_p95=percentile(latencies, 95),
+        latency_p99=percentile(latencies, 99),
+        latency_max=max(latencies, default=0.0),
+        loop_lag_p50=percentile(lag_samples, 50),
+        loop_lag_p99=percentile(lag_samples, 99),
+        loop_lag_max=max(lag_samples, default=0.0),
+    )
+    for image_count, _, status in results:
+        report.status_codes[status] = report.status_codes.get(status, 0) + 1
+    for level in sorted(degradation_levels):
+        report.degradation_levels[str(level)] = report.degradation_levels.get(str(level), 0) + 1
+    for image_count in sorted({count for count, _, _ in results}):
+        report.latency_by_image_count[str(image_count)] = round(percentile(
+            [latency for count, latency, status in results if count == image_count and status == "200"], 50
+        ), 3)
+    return report
+
+
+async def _main(args) -> LoadTestReport:
+    config = LoadTestConfig(
+        rate=args.rate,
+        duration=args.duration,
+        poisson=not args.constant,
+        min_images=args.min_images,
+        max_images=args.max_images,
+        repeat_ratio=args.repeat_ratio,
+        timeout=args.timeout,
+        seed=args.seed,
+    )
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url) as client:
+            return await run_load_test(client, config)
+
+    if args.replay:
+        from cassette import replayed_backends
+        backends = replayed_backends(args.replay, latency_scale=args.replay_latency_scale, strict=args.replay_strict)
+    else:
+        backends = stand_in_backends(StandInLatency(
+            blob=args.blob_latency,
+            content_safety=args.safety_latency,
+            llm=args.llm_latency,
+            image=args.image_latency,
+        ))
+    with backends as app:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            report = await run_load_test(client, config)
+        if args.replay:
+            report.replay = app.state.cassette.stats()
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test POST /api/garden_plan")
+    parser.add_argument("--url", help="Base URL of a running server; default runs the app in-process with stand-ins")
+    parser.add_argument("--rate", type=float, default=2.0, help="Mean arrival rate (requests/s)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Arrival window (s)")
+    parser.add_argument("--constant", action="store_true", help="Constant instead of Poisson arrivals")
+    parser.add_argument("--min-images", type=int, default=1)
+    parser.add_argument("--max-images", type=int, default=3)
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Fraction of repeat users")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--blob-latency", type=float, default=0.05)
+    parser.add_argument("--safety-latency", type=float, default=0.1)
+    parser.add_argument("--llm-latency", type=float, default=1.5)
+    parser.add_argument("--image-latency", type=float, default=4.0)
+    parser.add_argument("--replay", metavar="DIR", help="Answer upstream calls from a cassette recorded with run_api.py --record-cassette instead of stand-ins")
+    parser.add_argument("--replay-latency-scale", type=float, default=1.0, help="Share of the recorded latencies to re-apply (0: none)")
+    parser.add_argument("--replay-strict", action="store_true", help="Fail calls not recorded for the same request instead of reusing similar ones")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(_main(args))
+    print(json.dumps(asdict(report), indent=2) if args.json else report.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Memory profile of full garden plans.
+
+Runs plans one after another in this process against the load test's local
+stand-ins (no Azure or OpenAI access needed) and reports, per plan, the peak
+of Python allocations while the plan ran, the size of its largest and of all
+its checkpoints, and the process's resident memory afterwards. Use it to check
+that a plan's footprint stays flat when photos get bigger or the graph gets
+more steps.
+
+Example:
+    python src/profile_memory.py --plans 5 --images 3
+"""
+
+import argparse
+import json
+import pickle
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import List
+
+from fastapi.testclient import TestClient
+
+from load_test import StandInLatency, stand_in_backends
+from server import rss_mb
+
+
+@dataclass
+class PlanMemory:
+    """Memory used by one plan."""
+    plan_id: str
+    peak_allocated_mb: float
+    checkpoints: int
+    largest_checkpoint_kb: float
+    checkpoints_total_kb: float
+    rss_mb: float
+
+
+@dataclass
+class MemoryProfile:
+    """Memory used by a series of plans."""
+    plans: List[PlanMemory] = field(default_factory=list)
+    peak_allocated_mb_max: float = 0.0
+    largest_checkpoint_kb: float = 0.0
+    rss_start_mb: float = 0.0
+    rss_end_mb: float = 0.0
+
+
+def plan_request(index: int, images: int) -> dict:
+    return {
+        "image_urls": [
+            f"https://account.blob.core.windows.net/uploads/profile-{index}-{photo}.jpg"
+            for photo in range(images)
+        ],
+        "user_preferences": {"growType": "edible"},
+        "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+    }
+
+
+def run_profile(plans: int, images: int) -> MemoryProfile:
+    """
+    Run plans with the stand-ins and measure each of them.
+
+    Args:
+        plans (int): Plans to run, one after another
+        images (int): Photos per plan
+
+    Returns:
+        MemoryProfile: Per-plan measurements and their maxima
+    """
+    profile = MemoryProfile(rss_start_mb=round(rss_mb(), 1))
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        import api
+
+        client = TestClient(app)
+        tracemalloc.start()
+        try:
+            for index in range(plans):
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                response = client.post("/api/garden_plan", json=plan_request(index, images))
+                _, peak = tracemalloc.get_traced_memory()
+                response.raise_for_status()
+                plan_id = response.json()["plan_id"]
+
+                sizes = [
+                    len(pickle.dumps(snapshot.values))
+                    for snapshot in api.garden_graph.get_state_history(api.plan_config(plan_id))
+                ]
+                profile.plans.append(PlanMemory(
+                    plan_id=plan_id,
+                    peak_allocated_mb=round((peak - baseline) / (1024 * 1024), 2),
+                    checkpoints=len(sizes),
+                    largest_checkpoint_kb=round(max(sizes, default=0) / 1024, 1),
+                    checkpoints_total_kb=round(sum(sizes) / 1024, 1),
+                    rss_mb=round(rss_mb(), 1),
+                ))
+        finally:
+            tracemalloc.stop()
+
+    profile.peak_allocated_mb_max = max((plan.peak_allocated_mb for plan in profile.plans), default=0.0)
+    profile.largest_checkpoint_kb = max((plan.largest_checkpoint_kb for plan in profile.plans), default=0.0)
+    profile.rss_end_mb = round(rss_mb(), 1)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the memory of full garden plans")
+    parser.add_argument("--plans", type=int, default=5)
+    parser.add_argument("--images", type=int, default=3, help="Photos per plan")
+    args = parser.parse_args()
+    print(json.dumps(asdict(run_profile(args.plans, args.images)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,15 @@
+import argparse
+
 import uvicorn
 from api import app
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the City Garden API")
+    parser.add_argument("--record-cassette", metavar="DIR", help="Record every upstream call with its latency to a cassette (see cassette.py)")
+    args = parser.parse_args()
+    if args.record_cassette:
+        from cassette import recorded_backends
+        with recorded_backends(args.record_cassette):
+            uvicorn.run(app, host="0.0.0.0", port=8000)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,316 @@
+"""
+Production entry point: a pre-forking supervisor around uvicorn.
+
+The supervisor imports the app once and warms everything that is process-wide
+and read-only (the compiled graph, parsed prompts, chat and storage clients,
+the plant catalog, the climate grid), freezes those objects out of the
+garbage collector and only then forks the workers. Workers therefore share
+the warmed memory copy-on-write and start serving immediately instead of
+paying the cold start each.
+
+All workers accept from one listening socket owned by the supervisor. A
+worker retires after a number of requests (with jitter, so they do not all
+recycle at once) or when its resident memory grows past a limit; it stops
+accepting, finishes its in-flight plans and exits, and the supervisor forks
+a replacement. On SIGTERM or SIGINT the supervisor forwards SIGTERM to every
+worker and waits for them to drain before exiting.
+
+Plan checkpoints are shared through a SQLite file, but a plan's photos,
+background refinements and deferred plant images live in the memory of the
+worker that created it. Workers accept from one socket, so a follow-up
+request of a plan (/replan, /resume, /status, cancelling a refinement)
+reaches any of them; one that does not hold the plan answers 409. The
+default is therefore a single worker; run several only for plans that are
+not followed up on.
+
+The shared cache (see services/cache_backend.py) defaults to the SQLite
+backend here rather than the per-process memory one, so workers reuse each
+other's climate data, safety verdicts and plant images; set
+CITY_GARDEN_CACHE_BACKEND to choose another.
+
+Configuration (environment variables, overridden by the command-line flags):
+    CITY_GARDEN_WORKERS                Worker processes (default 1, see above)
+    CITY_GARDEN_MAX_REQUESTS           Requests after which a worker is recycled, 0 disables (default 1000)
+    CITY_GARDEN_MAX_REQUESTS_JITTER    Random extra requests per worker (default 100)
+    CITY_GARDEN_MAX_WORKER_MEMORY_MB   Resident memory after which a worker is recycled, 0 disables (default 0)
+    CITY_GARDEN_DRAIN_SECONDS          Time given to in-flight plans on shutdown (default: request deadline + 30)
+
+Example:
+    python src/server.py --host 0.0.0.0 --port 8000 --max-worker-memory-mb 1500
+"""
+
+import argparse
+import gc
+import logging
+import os
+import random
+import resource
+import signal
+import socket
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import uvicorn
+
+from city_garden.utils.structured_logging import fields, shutdown_logging
+
+logger = logging.getLogger(__name__)
+
+# A worker exiting this soon after it was forked counts as a crash, not a recycle
+_MIN_WORKER_LIFETIME = 1.0
+# Seconds between memory checks in a worker
+_MEMORY_CHECK_INTERVAL = 5.0
+
+
+@dataclass
+class ServerConfig:
+    """Settings of the supervisor and its workers."""
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: int = 1
+    max_requests: int = 1000
+    max_requests_jitter: int = 100
+    max_worker_memory_mb: float = 0.0
+    drain_seconds: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "ServerConfig":
+        drain_seconds = os.environ.get("CITY_GARDEN_DRAIN_SECONDS")
+        return cls(
+            workers=int(os.environ.get("CITY_GARDEN_WORKERS", "1")),
+            max_requests=int(os.environ.get("CITY_GARDEN_MAX_REQUESTS", "1000")),
+            max_requests_jitter=int(os.environ.get("CITY_GARDEN_MAX_REQUESTS_JITTER", "100")),
+            max_worker_memory_mb=float(os.environ.get("CITY_GARDEN_MAX_WORKER_MEMORY_MB", "0")),
+            drain_seconds=float(drain_seconds) if drain_seconds else None,
+        )
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # No procfs (e.g. macOS): fall back to the peak, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+
+def preload_app():
+    """
+    Import the app and warm the process-wide state, in the supervisor before forking.
+
+    Returns:
+        The ASGI app and the request deadline in seconds
+    """
+    started = time.monotonic()
+    import api
+    from city_garden.services.climate_grid import get_climate_grid
+    from city_garden.services.image_prescreen import get_image_prescreener
+    from city_garden.services.plant_catalog import get_plant_catalog
+    from city_garden.utils.prompt_loader import preload_prompts
+
+    prompt_files = preload_prompts()
+    get_plant_catalog()
+    get_climate_grid()
+    get_image_prescreener()
+
+    # Keep the collector from touching (and so copying) the preloaded objects in every worker
+    gc.collect()
+    gc.freeze()
+    logger.info("Preloaded app", extra=fields(
+        prompts=prompt_files,
+        seconds=round(time.monotonic() - started, 2),
+        rss_mb=round(rss_mb(), 1)
+    ))
+    return api.app, api.REQUEST_DEADLINE
+
+
+class WorkerServer(uvicorn.Server):
+    """uvicorn server of one worker that also retires once its memory exceeds a limit."""
+
+    def __init__(self, config: uvicorn.Config, max_memory_mb: float = 0.0):
+        """
+        Initialize the WorkerServer.
+
+        Args:
+            config (uvicorn.Config): uvicorn settings, including limit_max_requests
+            max_memory_mb (float): Resident memory after which the worker retires, 0 disables
+        """
+        super().__init__(config)
+        self.max_memory_mb = max_memory_mb
+        self._check_every = max(1, int(_MEMORY_CHECK_INTERVAL / 0.1))
+
+    async def on_tick(self, counter: int) -> bool:
+        # uvicorn ticks every 0.1s; the request limit is checked by the base class
+        if await super().on_tick(counter):
+            return True
+        if self.max_memory_mb and counter % self._check_every == 0:
+            resident = rss_mb()
+            if resident > self.max_memory_mb:
+                logger.info("Worker over memory limit, retiring", extra=fields(
+                    rss_mb=round(resident, 1),
+                    limit_mb=self.max_memory_mb,
+                    requests=self.server_state.total_requests
+                ))
+                return True
+        return False
+
+
+class Supervisor:
+    """Fork workers onto a shared socket, replace the ones that exit and drain them on shutdown."""
+
+    def __init__(self, app, sock: socket.socket, config: ServerConfig):
+        """
+        Initialize the Supervisor.
+
+        Args:
+            app: The preloaded ASGI app
+            sock (socket.socket): Bound listening socket shared by all workers
+            config (ServerConfig): Worker count, recycling limits and drain time
+        """
+        self.app = app
+        self.sock = sock
+        self.config = config
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return pid
+
+        # Worker process: uvicorn installs its own SIGTERM/SIGINT handling
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            self._serve()
+        except BaseException:
+            logger.exception("Worker failed")
+            exit_code = 1
+        finally:
+            # os._exit skips atexit; flush the log queue first
+            shutdown_logging()
+            os._exit(exit_code)
+
+    def _serve(self) -> None:
+        config = self.config
+        max_requests = None
+        if config.max_requests > 0:
+            max_requests = config.max_requests + random.randint(0, max(config.max_requests_jitter, 0))
+        uvicorn_config = uvicorn.Config(
+            self.app,
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=config.drain_seconds,
+            log_config=None,
+            lifespan="on",
+        )
+        logger.info("Worker started", extra=fields(max_requests=max_requests, rss_mb=round(rss_mb(), 1)))
+        WorkerServer(uvicorn_config, max_memory_mb=config.max_worker_memory_mb).run(sockets=[self.sock])
+        logger.info("Worker exiting", extra=fields(rss_mb=round(rss_mb(), 1)))
+
+    def _stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def _reap(self) -> None:
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            exit_code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            lifetime = time.monotonic() - started
+            logger.info("Worker exited, replacing it", extra=fields(pid=pid, exit_code=exit_code, lifetime_seconds=round(lifetime, 1)))
+            if exit_code != 0 and lifetime < _MIN_WORKER_LIFETIME:
+                # Crashing on start; do not fork in a tight loop
+                time.sleep(_MIN_WORKER_LIFETIME)
+            self.spawn()
+
+    def run(self) -> int:
+        """Serve until SIGTERM or SIGINT, then drain the workers. Returns the process exit code."""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.config.workers):
+            self.spawn()
+        logger.info("Supervisor started", extra=fields(
+            pid=os.getpid(),
+            workers=list(self.workers),
+            address=f"{self.config.host}:{self.config.port}"
+        ))
+
+        while not self.stopping:
+            self._reap()
+            time.sleep(0.2)
+
+        logger.info("Draining workers", extra=fields(workers=list(self.workers), drain_seconds=self.config.drain_seconds))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # uvicorn gives in-flight requests drain_seconds; allow a little on top for its own shutdown
+        deadline = time.monotonic() + (self.config.drain_seconds or 0) + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            logger.warning("Worker did not drain in time, killing it", extra=fields(pid=pid))
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.sock.close()
+        logger.info("Supervisor stopped")
+        return 0
+
+
+def serve(config: ServerConfig) -> int:
+    """Preload the app, bind the socket and run the supervisor."""
+    # The memory cache would give every worker its own copy
+    os.environ.setdefault("CITY_GARDEN_CACHE_BACKEND", "sqlite")
+    app, request_deadline = preload_app()
+    if config.drain_seconds is None:
+        config.drain_seconds = request_deadline + 30
+    sock = uvicorn.Config(app, host=config.host, port=config.port, log_config=None).bind_socket()
+    sock.set_inheritable(True)
+    return Supervisor(app, sock, config).run()
+
+
+def main():
+    defaults = ServerConfig.from_env()
+    parser = argparse.ArgumentParser(description="Run the City Garden API with pre-forked workers")
+    parser.add_argument("--host", default=defaults.host)
+    parser.add_argument("--port", type=int, default=defaults.port)
+    parser.add_argument("--workers", type=int, default=defaults.workers)
+    parser.add_argument("--max-requests", type=int, default=defaults.max_requests,
+                        help="Recycle a worker after this many requests (0 disables)")
+    parser.add_argument("--max-requests-jitter", type=int, default=defaults.max_requests_jitter)
+    parser.add_argument("--max-worker-memory-mb", type=float, default=defaults.max_worker_memory_mb,
+                        help="Recycle a worker whose resident memory exceeds this (0 disables)")
+    parser.add_argument("--drain-seconds", type=float, default=defaults.drain_seconds,
+                        help="Time given to in-flight plans on shutdown")
+    args = parser.parse_args()
+
+    config = ServerConfig(
+        host=args.host,
+        port=args.port,
+        workers=max(1, args.workers),
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        max_worker_memory_mb=args.max_worker_memory_mb,
+        drain_seconds=args.drain_seconds,
+    )
+    raise SystemExit(serve(config))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import pytest
 from unittest.mock import Mock, patch
+import base64
 import os
+import sys
+from io import BytesIO
+from PIL import Image
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,7 +20,8 @@ def mock_llm():
 @pytest.fixture
 def mock_azure_storage():
     """Mock Azure Storage client for testing."""
-    with patch('azure.storage.blob.BlobClient') as mock:
+    with patch('city_garden.services.asset_store.BlobClient') as mock:
+        mock.return_value.exists.return_value = False
         mock.upload_blob.return_value = None
         mock.url = "https://mock-storage-url.com/test-image.png"
         yield mock
@@ -39,14 +44,21 @@ def sample_garden_state():
     }
 
 @pytest.fixture
-def mock_openai():
+def mock_openai(monkeypatch):
     """Mock OpenAI client for testing."""
+    buffer = BytesIO()
+    Image.new("RGB", (64, 64), "green").save(buffer, format="PNG")
     with patch('openai.OpenAI') as mock:
         mock_instance = Mock()
         mock_instance.images.generate.return_value.data = [
-            Mock(b64_json="mock_base64_image")
+            Mock(b64_json=base64.b64encode(buffer.getvalue()).decode("ascii"))
         ]
+        mock_instance.images.edit.return_value.data = mock_instance.images.generate.return_value.data
         mock.return_value = mock_instance
+        # The nodes module binds OpenAI at import, possibly under both package paths
+        for name, module in list(sys.modules.items()):
+            if name.endswith("city_garden.city_garden_nodes"):
+                monkeypatch.setattr(module, "OpenAI", mock)
         yield mock
 
 @pytest.fixture
@@ -57,3 +69,19 @@ def mock_image_loader():
         mock_instance.upload_image.return_value = "https://mock-storage-url.com/test-image.png"
         mock.return_value = mock_instance
         yield mock
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    """Give every test an empty in-memory cache, so cached results do not leak between tests."""
+    from city_garden.services import cache_backend
+    cache = cache_backend.MemoryCache()
+    monkeypatch.setattr(cache_backend, "_cache", cache)
+    yield cache
+
+@pytest.fixture(autouse=True)
+def trace_exporter(monkeypatch, tmp_path):
+    """Write every test's request traces to its own temporary directory."""
+    from city_garden.utils import tracing
+    exporter = tracing.JsonlTraceExporter(str(tmp_path / "traces"))
+    monkeypatch.setattr(tracing, "_exporter", exporter)
+    yield exporter
@@ -0,0 +1,96 @@
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from city_garden.utils import admission
+from city_garden.utils.admission import AdmissionController, Overloaded, current_degradation
+from load_test import StandInLatency, _StandInImages, stand_in_backends
+
+PLAN_REQUEST = {
+    "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+    "user_preferences": {"growType": "edible"},
+    "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+}
+
+
+def test_levels_step_up_with_plans_in_flight_and_reject_at_capacity():
+    """Test that each admitted plan raises the pressure until the next one is rejected."""
+    controller = AdmissionController(max_in_flight=4, thresholds=(0.25, 0.5, 0.75, 1.0))
+    with ExitStack() as stack:
+        levels = [stack.enter_context(controller.admit()).level for _ in range(4)]
+        assert current_degradation().level == 3
+        with pytest.raises(Overloaded):
+            stack.enter_context(controller.admit())
+    assert levels == [0, 1, 2, 3]
+    assert current_degradation().level == 0
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_exactly_max_in_flight_plans_are_admitted_by_default():
+    """Test the boundaries of the default settings: half of max_in_flight runs at full quality, all of it runs."""
+    controller = AdmissionController()
+    with ExitStack() as stack:
+        levels = [stack.enter_context(controller.admit()).level for _ in range(16)]
+        assert controller.stats()["pressure"]["in_flight"] == 1.0
+        with pytest.raises(Overloaded):
+            stack.enter_context(controller.admit())
+    assert levels[:8] == [0] * 8 and levels[8] == 1
+    assert controller.admitted["rejected"] == 1
+
+
+def test_upstream_429s_and_queue_wait_raise_the_level():
+    """Test that throttled upstream calls and long queue waits count as pressure without plans in flight."""
+    controller = AdmissionController(max_in_flight=100, target_wait=1.0, max_throttle_rate=0.2)
+    for index in range(10):
+        controller.record_upstream(throttled=index < 1)
+    with controller.admit() as degradation:
+        assert degradation.level == 1
+
+    controller = AdmissionController(max_in_flight=100, target_wait=0.001)
+    with controller.admit():
+        time.sleep(0.02)
+        controller.started()
+    with pytest.raises(Overloaded) as rejected:
+        with controller.admit():
+            pass
+    assert rejected.value.retry_after >= 1
+
+
+def test_degraded_plan_defers_plant_images_and_reports_its_level(monkeypatch):
+    """Test that a plan admitted under load gets a cheap garden image, deferred plant images and its level."""
+    monkeypatch.setattr(admission, "_controller", AdmissionController(thresholds=(0.0, 0.0, 0.0, 1e9)))
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        client = TestClient(app)
+        with patch.object(_StandInImages, "edit", autospec=True, side_effect=_StandInImages.edit) as edit:
+            plan = client.post("/api/garden_plan", json=PLAN_REQUEST).json()
+
+        assert plan["degradation_level"] == 3
+        assert plan["degradation"] == "deferred_plant_images"
+        # One low-quality render and no background refinement
+        assert [call.kwargs["quality"] for call in edit.call_args_list] == ["low"]
+        assert plan["garden_image_quality"] == "final"
+        assert plan["plant_images"] == []
+        assert len(plan["plant_images_deferred"]) == len(plan["plant_recommendations"])
+
+        status = client.get(f"/api/garden_plan/{plan['plan_id']}/status").json()
+        deadline = time.monotonic() + 5
+        while status["plant_images_deferred"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+            status = client.get(f"/api/garden_plan/{plan['plan_id']}/status").json()
+        assert len(status["plant_images"]) == len(plan["plant_recommendations"])
+
+
+def test_overloaded_service_rejects_fast(monkeypatch):
+    """Test that a plan admitted at the last level is answered 503 with Retry-After before any work."""
+    monkeypatch.setattr(admission, "_controller", AdmissionController(thresholds=(0.0, 0.0, 0.0, 0.0)))
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        with patch.object(_StandInImages, "edit", autospec=True) as edit:
+            response = TestClient(app).post("/api/garden_plan", json=PLAN_REQUEST)
+
+    assert response.status_code == 503
+    assert response.headers["X-Degradation-Level"] == "4"
+    assert int(response.headers["Retry-After"]) >= 1
+    edit.assert_not_called()
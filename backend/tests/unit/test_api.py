@@ -0,0 +1,65 @@
+import json
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from load_test import StandInContentAnalyzer, StandInImageLoader, StandInLatency, stand_in_backends
+
+
+@pytest.fixture
+def client():
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        yield TestClient(app)
+
+
+def balcony_unit(unit_id, photo):
+    return {
+        "unit_id": unit_id,
+        "image_urls": [f"https://account.blob.core.windows.net/uploads/{photo}.jpg?sig={unit_id}"],
+        "user_preferences": {"growType": "edible"},
+        "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+    }
+
+
+def test_batch_streams_one_line_per_unit_and_shares_work(client):
+    """Test that a batch streams every unit and screens shared photos and plant images once."""
+    from city_garden import city_garden_nodes
+
+    loaded, screened = [], []
+    original_load = StandInImageLoader.load_image
+    original_analyze = StandInContentAnalyzer.analyze_image_data
+    original_generate = city_garden_nodes.generate_image_variants
+    generated = []
+
+    def generate(prompt, image_files=None, image_name="garden_image", **kwargs):
+        generated.append(image_name)
+        return original_generate(prompt, image_files, image_name, **kwargs)
+
+    with patch.object(StandInImageLoader, "load_image", lambda self, url: loaded.append(url) or original_load(self, url)), \
+            patch.object(StandInContentAnalyzer, "analyze_image_data", lambda self, data: screened.append(1) or original_analyze(self, data)), \
+            patch.object(city_garden_nodes, "generate_image_variants", generate):
+        response = client.post("/api/garden_plan/batch", json={"units": [
+            balcony_unit("unit-1", "shared-facade"),
+            balcony_unit("unit-2", "shared-facade"),
+            balcony_unit("unit-3", "unit-3-balcony"),
+        ]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    units = [line for line in lines if line["type"] == "unit"]
+    assert sorted(line["unit_id"] for line in units) == ["unit-1", "unit-2", "unit-3"]
+    assert all(line["status"] == "ok" for line in units)
+    assert lines[-1]["type"] == "summary" and lines[-1]["succeeded"] == 3
+
+    # Two distinct photos (the SAS query differs per unit but the blob is the same)
+    assert len(loaded) == 2 and len(screened) == 2
+    # Garden images are per unit, plant images are shared by species
+    plant_names = [name for name in generated if name != "garden_image"]
+    assert len(plant_names) == len(set(plant_names))
+
+
+def test_batch_rejects_empty_submission(client):
+    """Test that a batch needs at least one unit."""
+    assert client.post("/api/garden_plan/batch", json={"units": []}).status_code == 422
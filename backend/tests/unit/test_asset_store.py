@@ -0,0 +1,50 @@
+import hashlib
+from unittest.mock import patch
+
+from azure.core.exceptions import ResourceExistsError
+
+from city_garden.services.asset_store import IMMUTABLE_CACHE_CONTROL, AssetStore
+
+
+@patch("city_garden.services.asset_store.BlobClient")
+def test_put_names_blob_by_content_hash(mock_blob_client):
+    """Test that the blob name is the SHA-256 of the content and the upload is immutable."""
+    mock_blob_client.return_value.exists.return_value = False
+    store = AssetStore("account", "key")
+
+    url = store.put(b"image bytes", content_type="image/webp", extension="webp")
+
+    digest = hashlib.sha256(b"image bytes").hexdigest()
+    assert url == f"https://account.blob.core.windows.net/images/{digest}.webp"
+    _, kwargs = mock_blob_client.return_value.upload_blob.call_args
+    assert kwargs["overwrite"] is False
+    assert kwargs["content_settings"].cache_control == IMMUTABLE_CACHE_CONTROL
+    assert kwargs["content_settings"].content_type == "image/webp"
+    assert store.uploads == 1
+
+
+@patch("city_garden.services.asset_store.BlobClient")
+def test_put_skips_known_and_existing_blobs(mock_blob_client):
+    """Test that repeated content is not uploaded again."""
+    mock_blob_client.return_value.exists.return_value = False
+    store = AssetStore("account", "key")
+    first = store.put(b"same", content_type="image/webp", extension="webp")
+    second = store.put(b"same", content_type="image/webp", extension="webp")
+    assert first == second
+    assert mock_blob_client.return_value.upload_blob.call_count == 1
+    # The second put is answered from the local index without a HEAD request
+    assert mock_blob_client.return_value.exists.call_count == 1
+
+    mock_blob_client.return_value.exists.return_value = True
+    store.put(b"already in storage", content_type="image/webp", extension="webp")
+    assert mock_blob_client.return_value.upload_blob.call_count == 1
+    assert store.skipped_uploads == 2
+
+
+@patch("city_garden.services.asset_store.BlobClient")
+def test_put_tolerates_concurrent_upload(mock_blob_client):
+    """Test that losing an upload race to identical content is not an error."""
+    mock_blob_client.return_value.exists.return_value = False
+    mock_blob_client.return_value.upload_blob.side_effect = ResourceExistsError("exists")
+    store = AssetStore("account", "key")
+    assert store.put(b"raced", content_type="image/png", extension="png").endswith(".png")
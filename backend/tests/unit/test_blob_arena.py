@@ -0,0 +1,99 @@
+import base64
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from city_garden.services.blob_arena import BlobArenas, MissingBlob, is_handle, resolve_images, get_blob_arenas
+from load_test import StandInLatency, stand_in_backends
+
+
+def test_handles_are_content_addressed_and_refcounted():
+    """Test that a blob shared by two arenas survives until both are released."""
+    arenas = BlobArenas()
+    first = arenas.put("plan-1", b"facade")
+    second = arenas.put("plan-2", b"facade")
+    arenas.put("plan-2", b"facade")
+
+    assert is_handle(first) and first != second
+    assert arenas.stats()["arenas"] == 2
+    assert arenas.stats()["blobs"] == 1 and arenas.stats()["bytes"] == 6
+
+    arenas.release("plan-1")
+    with pytest.raises(MissingBlob):
+        arenas.get(first)
+    assert arenas.get(second) == b"facade"
+
+    arenas.release("plan-2")
+    assert arenas.stats()["arenas"] == 0
+    assert arenas.stats()["blobs"] == 0 and arenas.stats()["bytes"] == 0
+
+
+def test_finished_arenas_beyond_the_budget_are_spilled(tmp_path):
+    """Test that finished plans' blobs leave memory oldest first, stay readable and are deleted on release."""
+    arenas = BlobArenas(max_bytes=10, spill_dir=str(tmp_path))
+    first = arenas.put("plan-1", b"facade")
+    shared = arenas.put("plan-1", b"garden")
+    second = arenas.put("plan-2", b"garden")
+    arenas.finish("plan-1")
+    # plan-2 is still running, so the blob it shares with plan-1 stays in memory
+    stats = arenas.stats()
+    assert stats["bytes"] == 6 and stats["max_bytes"] == 10
+    assert stats["spilled_blobs"] == 1 and stats["spilled_bytes"] == 6
+    assert arenas.get(first) == b"facade" and arenas.get(shared) == arenas.get(second) == b"garden"
+
+    arenas.put("plan-3", b"balcony!")
+    arenas.finish("plan-2")
+    arenas.finish("plan-3")
+    # Only the newest finished arena still fits in memory
+    assert arenas.stats()["bytes"] == 8 and arenas.stats()["idle_arenas"] == 1
+    assert arenas.get(second) == b"garden"
+
+    for plan_id in ("plan-1", "plan-2", "plan-3"):
+        arenas.release(plan_id)
+    assert arenas.stats()["spilled_blobs"] == 0 and arenas.stats()["bytes"] == 0
+    assert not any(path.is_file() for path in tmp_path.rglob("*"))
+
+
+def test_arenas_that_cannot_spill_are_dropped():
+    """Test that without a spill directory the oldest finished arena is released to stay within the budget."""
+    arenas = BlobArenas(max_bytes=4, spill_dir=None)
+    handle = arenas.put("plan-1", b"facade")
+    running = arenas.put("plan-2", b"balcony")
+    arenas.finish("plan-1")
+    with pytest.raises(MissingBlob):
+        arenas.get(handle)
+    # A plan in flight is never dropped, even above the budget
+    assert arenas.get(running) == b"balcony"
+    assert arenas.stats()["dropped_arenas"] == 1
+
+
+def test_resolve_images_accepts_legacy_base64():
+    """Test that states written before handles (base64 strings) still resolve."""
+    handle = get_blob_arenas().put("legacy-test", b"photo")
+    try:
+        assert resolve_images([handle, base64.b64encode(b"old").decode("ascii")]) == [b"photo", b"old"]
+    finally:
+        get_blob_arenas().release("legacy-test")
+
+
+def test_plan_checkpoints_hold_handles_not_photos():
+    """Test that no checkpoint of a plan carries photo payloads or the raw report."""
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        import api
+
+        response = TestClient(app).post("/api/garden_plan", json={
+            "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+            "user_preferences": {"growType": "edible"},
+            "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+        })
+        assert response.status_code == 200
+        plan_id = response.json()["plan_id"]
+
+        history = list(api.garden_graph.get_state_history(api.plan_config(plan_id)))
+        assert history
+        for snapshot in history:
+            assert all(is_handle(image) for image in snapshot.values.get("images", []))
+            assert "final_output" not in snapshot.values
+            # Without the photos a checkpoint is a few kilobytes
+            assert len(json.dumps(snapshot.values, default=str)) < 64 * 1024
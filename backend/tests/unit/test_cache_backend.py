@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from city_garden.services.cache_backend import MemoryCache, NullCache, SQLiteCache, cache_key
+from city_garden.utils.deadline import DeadlineExceeded, deadline_scope
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCache(max_bytes=1000)
+    return SQLiteCache(str(tmp_path / "cache.sqlite3"), max_bytes=1000)
+
+
+def test_get_set_and_ttl(cache):
+    """Test that values round-trip and expire after their TTL."""
+    cache.set("a:1", b"value")
+    cache.set("a:2", b"short-lived", ttl=0.05)
+    assert cache.get("a:1") == b"value"
+    assert cache.get("a:2") == b"short-lived"
+    time.sleep(0.1)
+    assert cache.get("a:2") is None
+    cache.delete("a:1")
+    assert cache.get("a:1") is None
+
+
+def test_least_recently_used_entries_are_evicted_beyond_byte_budget(cache):
+    """Test byte-bounded eviction that keeps recently read entries."""
+    for index in range(3):
+        cache.set(f"e:{index}", bytes(300))
+        time.sleep(0.01)
+    cache.get("e:0")
+    time.sleep(0.01)
+    cache.set("e:3", bytes(300))
+
+    assert cache.get("e:0") is not None and cache.get("e:3") is not None
+    assert cache.get("e:1") is None
+    assert cache.usage()["bytes"] <= 1000
+
+
+def test_get_or_compute_runs_once_for_concurrent_callers(cache):
+    """Test single flight within a process and hit/miss metrics per namespace."""
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return b"computed"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("plans:x", compute))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [b"computed"] * 4
+    assert len(calls) == 1
+    assert cache.get_or_compute("plans:x", compute) == b"computed"
+    counts = cache.stats()["namespaces"]["plans"]
+    assert counts["misses"] == 1 and counts["hits"] + counts["waits"] == 4
+
+
+def test_json_helper_does_not_cache_none_or_failures(cache):
+    """Test that failed computations are retried by the next caller."""
+    key = cache_key("climate_normals", 52.52, 13.4)
+    assert cache.get_or_compute_json(key, lambda: None) is None
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute_json(key, lambda: (_ for _ in ()).throw(RuntimeError("upstream down")))
+    assert cache.get_or_compute_json(key, lambda: {"frost_days": 3}) == {"frost_days": 3}
+    assert cache.get_or_compute_json(key, lambda: {"frost_days": 99}) == {"frost_days": 3}
+
+
+def test_waiter_takes_over_when_the_owner_runs_out_of_time(cache):
+    """Test that the owner's deadline does not fail callers waiting for the same key; one of them computes."""
+    started = threading.Event()
+    results = []
+
+    def slow_owner():
+        started.set()
+        time.sleep(0.05)
+        raise DeadlineExceeded("owner deadline")
+
+    def owner():
+        with pytest.raises(DeadlineExceeded):
+            cache.get_or_compute("plant_image:basil", slow_owner)
+
+    def waiter():
+        started.wait(5)
+        results.append(cache.get_or_compute("plant_image:basil", lambda: b"rendered"))
+
+    threads = [threading.Thread(target=owner)] + [threading.Thread(target=waiter) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [b"rendered", b"rendered"]
+    counts = cache.stats()["namespaces"]["plant_image"]
+    assert counts["misses"] == 2 and counts["takeovers"] >= 1
+
+
+def test_waiters_give_up_at_their_own_deadline(tmp_path):
+    """Test that a caller stops waiting for another thread's or another process' computation at its deadline."""
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    started, release = threading.Event(), threading.Event()
+
+    def blocked():
+        started.set()
+        release.wait(5)
+        return b"late"
+
+    owner = threading.Thread(target=cache.get_or_compute, args=("plant_image:basil", blocked))
+    owner.start()
+    started.wait(5)
+    with deadline_scope(0.05), pytest.raises(DeadlineExceeded):
+        cache.get_or_compute("plant_image:basil", lambda: b"unused")
+    release.set()
+    owner.join()
+
+    # A lease held by another process for LEASE_SECONDS
+    assert SQLiteCache(cache.path)._acquire_lease("plant_image:mint", "other-process")
+    started_at = time.monotonic()
+    with deadline_scope(0.1), pytest.raises(DeadlineExceeded):
+        cache.get_or_compute("plant_image:mint", lambda: b"unused")
+    assert time.monotonic() - started_at < 5
+
+
+def _compute_in_worker(path, log_path, results):
+    cache = SQLiteCache(path)
+
+    def compute():
+        with open(log_path, "a") as f:
+            f.write(f"{os.getpid()}\n")
+        time.sleep(0.3)
+        return b"shared"
+
+    results.put(cache.get_or_compute("plant_image:basil", compute))
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="needs fork")
+def test_sqlite_cache_computes_once_across_processes(tmp_path):
+    """Test that workers on one host wait for each other's computation instead of repeating it."""
+    path, log_path = str(tmp_path / "cache.sqlite3"), str(tmp_path / "computations.log")
+    SQLiteCache(path)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [context.Process(target=_compute_in_worker, args=(path, log_path, results)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=20)
+
+    assert sorted(results.get(timeout=5) for _ in workers) == [b"shared"] * 3
+    with open(log_path) as f:
+        assert len(f.read().split()) == 1
+    assert SQLiteCache(path).get("plant_image:basil") == b"shared"
+
+
+def test_null_cache_stores_nothing():
+    """Test the disabled backend."""
+    cache = NullCache()
+    cache.set("a:1", b"value")
+    assert cache.get("a:1") is None
+    assert cache.get_or_compute("a:1", lambda: b"fresh") == b"fresh"
@@ -0,0 +1,56 @@
+import json
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from cassette import Cassette, CassetteMiss, RecordedUpstreamError, recorded_backends, replayed_backends
+from load_test import StandInLatency, stand_in_backends
+
+PLAN_REQUEST = {
+    "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg?sig=first"],
+    "user_preferences": {"growType": "edible"},
+    "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+}
+
+
+def test_recorded_plan_replays_offline(tmp_path):
+    """Test that a plan recorded against the backends is answered from the cassette with the same result."""
+    directory = str(tmp_path / "cassette")
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0.01, image=0)) as app, \
+            recorded_backends(directory) as cassette:
+        recorded = TestClient(app).post("/api/garden_plan", json=PLAN_REQUEST).json()
+    assert cassette.stats()["recorded"] > 0
+    for seam in ("llm", "image", "blob_download", "blob_upload", "content_safety", "climate"):
+        assert os.path.exists(cassette.path(seam)), seam
+    with open(cassette.path("llm"), encoding="utf-8") as llm_file:
+        assert all(json.loads(line)["latency"] > 0 for line in llm_file)
+
+    # A rotated SAS token is the same blob
+    request = {**PLAN_REQUEST, "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg?sig=second"]}
+    with replayed_backends(directory, latency_scale=0, strict=True) as app:
+        replayed = TestClient(app).post("/api/garden_plan", json=request).json()
+        stats = app.state.cassette.stats()
+    assert replayed["plant_recommendations"] == recorded["plant_recommendations"]
+    assert replayed["garden_image_url"] == recorded["garden_image_url"]
+    assert stats["exact"] > 0 and stats["fallback"] == 0 and stats["missed"] == 0
+
+
+def test_unrecorded_calls_reuse_similar_interactions_unless_strict(tmp_path):
+    """Test that a call without its own recording gets those of its kind in turn, or fails in strict mode."""
+    recorder = Cassette(str(tmp_path))
+    recorder.record("image", "a", "edit:low", 0.05, response={"b64_json": "first"})
+    recorder.record("image", "b", "edit:low", 0.05, response={"b64_json": "second"})
+    recorder.record("image", "c", "edit:medium", 0.2, error=TimeoutError("upstream timed out"))
+
+    cassette = Cassette(str(tmp_path), latency_scale=0.5)
+    assert [cassette.replay("image", "x", "edit:low")["response"]["b64_json"] for _ in range(3)] == ["first", "second", "first"]
+    started = time.monotonic()
+    with pytest.raises(RecordedUpstreamError, match="TimeoutError"):
+        cassette.wait(cassette.replay("image", "c", "edit:medium"))
+    assert time.monotonic() - started >= 0.1
+    assert cassette.stats() == {"recorded": 0, "exact": 1, "fallback": 3, "missed": 0}
+
+    with pytest.raises(CassetteMiss):
+        Cassette(str(tmp_path), strict=True).replay("image", "x", "edit:low")
@@ -0,0 +1,128 @@
+from typing import TypedDict
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from langgraph.graph import END, START, StateGraph
+
+from city_garden.services.checkpoint_store import SQLiteCheckpointSaver
+from load_test import StandInLatency, StandInLLM, stand_in_backends
+
+
+class CounterState(TypedDict):
+    count: int
+
+
+def counting_graph(saver, fail_at=None):
+    def step(name):
+        def run(state):
+            if name == fail_at:
+                raise RuntimeError(f"{name} failed")
+            return {"count": state["count"] + 1}
+        return run
+
+    graph = StateGraph(CounterState)
+    for name in ("first", "second", "third"):
+        graph.add_node(name, step(name))
+    graph.add_edge(START, "first")
+    graph.add_edge("first", "second")
+    graph.add_edge("second", "third")
+    graph.add_edge("third", END)
+    return graph.compile(checkpointer=saver)
+
+
+def test_checkpoints_survive_a_new_saver_and_resume_from_the_failed_node(tmp_path):
+    """Test that a run failing mid-way is resumed from the failed node by a fresh process' saver."""
+    path = str(tmp_path / "checkpoints.sqlite3")
+    config = {"configurable": {"thread_id": "plan-1"}}
+
+    with pytest.raises(RuntimeError):
+        counting_graph(SQLiteCheckpointSaver(path), fail_at="second").invoke({"count": 0}, config)
+
+    # Another saver on the same file, as after a restart or in another worker
+    graph = counting_graph(SQLiteCheckpointSaver(path))
+    snapshot = graph.get_state(config)
+    assert snapshot.next == ("second",)
+    assert snapshot.values == {"count": 1}
+    assert "second failed" in str(snapshot.tasks[0].error)
+
+    assert graph.invoke(None, config) == {"count": 3}
+    assert len(list(graph.get_state_history(config))) == 5
+
+
+def test_delete_thread(tmp_path):
+    """Test that deleting a plan removes all of its checkpoints."""
+    saver = SQLiteCheckpointSaver(str(tmp_path / "checkpoints.sqlite3"))
+    graph = counting_graph(saver)
+    graph.invoke({"count": 0}, {"configurable": {"thread_id": "keep"}})
+    graph.invoke({"count": 0}, {"configurable": {"thread_id": "drop"}})
+
+    saver.delete_thread("drop")
+    assert list(saver.list({"configurable": {"thread_id": "drop"}})) == []
+    assert graph.get_state({"configurable": {"thread_id": "keep"}}).values == {"count": 3}
+
+
+def test_sweep_deletes_plans_older_than_the_ttl_only(tmp_path):
+    """Test that plans idle past the TTL are swept when a saver opens the file, and recent ones are kept."""
+    path = str(tmp_path / "checkpoints.sqlite3")
+    saver = SQLiteCheckpointSaver(path)
+    graph = counting_graph(saver)
+    graph.invoke({"count": 0}, {"configurable": {"thread_id": "stale"}})
+    graph.invoke({"count": 0}, {"configurable": {"thread_id": "recent"}})
+    saver._connection().execute("UPDATE threads SET updated_at = updated_at - 7200 WHERE thread_id = 'stale'")
+
+    # As at the start of another worker or after a restart
+    restarted = SQLiteCheckpointSaver(path, ttl=3600)
+    assert list(restarted.list({"configurable": {"thread_id": "stale"}})) == []
+    assert counting_graph(restarted).get_state({"configurable": {"thread_id": "recent"}}).values == {"count": 3}
+    assert restarted.sweep() == 0
+
+
+def test_failed_plan_resumes_without_repeating_paid_work():
+    """Test that resuming a plan whose plant images failed only redoes the plant images."""
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        from city_garden import city_garden_nodes
+
+        client = TestClient(app)
+        original_generate = city_garden_nodes.generate_image_variants
+        original_answer = StandInLLM.answer
+        generated, prompts = [], []
+        failing = {"Lavender"}
+
+        def generate(prompt, image_files=None, image_name="garden_image", **kwargs):
+            generated.append(image_name)
+            if image_name in failing:
+                raise city_garden_nodes.ImageGenerationError(f"Could not generate {image_name}")
+            return original_generate(prompt, image_files, image_name, **kwargs)
+
+        def answer(self, messages):
+            prompts.append(messages[0].content)
+            return original_answer(self, messages)
+
+        with patch.object(city_garden_nodes, "generate_image_variants", generate), \
+                patch.object(StandInLLM, "answer", answer):
+            response = client.post("/api/garden_plan", json={
+                "image_urls": ["https://account.blob.core.windows.net/uploads/resume.jpg"],
+                "user_preferences": {"growType": "edible"},
+                "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+            })
+            assert response.status_code == 502
+            plan_id = response.headers["X-Plan-ID"]
+
+            status = client.get(f"/api/garden_plan/{plan_id}/status").json()
+            assert status["status"] == "failed"
+            assert status["nodes"]["create_garden_image"] == "done"
+            assert status["nodes"]["create_plant_images"] == "failed"
+            assert "Lavender" in status["error"]
+
+            llm_calls, image_calls = len(prompts), len(generated)
+            failing.clear()
+            resumed = client.post(f"/api/garden_plan/{plan_id}/resume")
+
+        assert resumed.status_code == 200
+        assert len(resumed.json()["plant_images"]) == 3
+        # No chat call and no garden image again; of the plant images only the failed one
+        assert len(prompts) == llm_calls
+        assert generated[image_calls:] == ["Lavender"]
+        assert client.get(f"/api/garden_plan/{plan_id}/status").json()["status"] == "complete"
+        assert client.get("/api/garden_plan/unknown/status").status_code == 404
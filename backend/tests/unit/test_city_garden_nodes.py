@@ -79,7 +79,8 @@ def test_generate_final_output(llm, sample_garden_state):
     assert isinstance(state, dict)
     assert "plant_recommendations" in state
     assert len(state["plant_recommendations"]) > 0
-    assert "final_output" in state
+    # The raw report is not kept in the state; its content is in plant_recommendations
+    assert "final_output" not in state
 
 def test_create_garden_image(mock_openai, mock_azure_storage, sample_garden_state):
     """Test garden image creation."""
@@ -0,0 +1,49 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from city_garden.services.climate_grid import ClimateGrid, write_climate_grid
+from city_garden.tools.climate import GRID_FIELDS, get_climate_profile
+
+
+@pytest.fixture
+def grid_path(tmp_path):
+    # 3 x 3 grid over 50..51°N, 10..11°E; every field holds latitude + longitude / 10 + month / 100
+    values = np.zeros((3, 3, len(GRID_FIELDS), 12), dtype=np.float32)
+    for row, lat in enumerate([50.0, 50.5, 51.0]):
+        for col, lon in enumerate([10.0, 10.5, 11.0]):
+            values[row, col] = lat + lon / 10 + np.arange(12) / 100
+    values[2, 2, 0, 0] = np.nan
+    path = str(tmp_path / "grid.bin")
+    write_climate_grid(path, values, 50.0, 10.0, 0.5, 0.5, GRID_FIELDS)
+    return path
+
+
+def test_lookup_interpolates_bilinearly(grid_path):
+    """Test that a point between cells gets the bilinear blend of its four neighbours."""
+    grid = ClimateGrid(grid_path)
+    normals = grid.lookup(50.25, 10.125)
+    np.testing.assert_allclose(normals["monthly_temperature_c"][:2], [50.25 + 1.0125, 50.25 + 1.0125 + 0.01], rtol=1e-6)
+
+    # Exactly on the upper edge
+    assert grid.lookup(50.0, 11.0) is not None
+
+
+def test_lookup_outside_grid_or_next_to_missing_cells_returns_none(grid_path):
+    """Test that the caller falls back to live data outside the grid and near missing cells."""
+    grid = ClimateGrid(grid_path)
+    assert grid.lookup(49.9, 10.5) is None
+    assert grid.lookup(50.9, 10.9) is None
+
+
+def test_climate_profile_prefers_the_grid(grid_path, monkeypatch):
+    """Test that sites in the grid are served without calling Open-Meteo and others still are."""
+    monkeypatch.setenv("CITY_GARDEN_CLIMATE_GRID", grid_path)
+    with patch("city_garden.tools.climate.fetch_climate_normals", side_effect=RuntimeError("offline")) as fetch:
+        profile = get_climate_profile(50.5, 10.5)
+        assert profile.monthly_frost_days[0] == pytest.approx(51.55)
+        fetch.assert_not_called()
+
+        assert get_climate_profile(40.0, 10.0) is None
+        fetch.assert_called_once()
@@ -0,0 +1,61 @@
+import base64
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from azure.ai.contentsafety.models import ImageCategory, TextCategory
+
+from city_garden.services.cache_backend import MemoryCache
+from city_garden.services.content_safety import ContentAnalyzer
+
+
+def severities(categories, violence=0):
+    return SimpleNamespace(categories_analysis=[
+        SimpleNamespace(category=category, severity=violence if category.name == "VIOLENCE" else 0)
+        for category in categories
+    ])
+
+
+@pytest.fixture
+def analyzer():
+    analyzer = ContentAnalyzer("https://safety.cognitiveservices.azure.com", "key", cache=MemoryCache())
+    analyzer.client = MagicMock()
+    analyzer.client.analyze_image.return_value = severities(ImageCategory, violence=2)
+    analyzer.client.analyze_text.return_value = severities(TextCategory)
+    return analyzer
+
+
+def test_repeat_image_screening_is_a_local_lookup(analyzer):
+    """Test that the same bytes, raw or base64-encoded, are sent to the service once."""
+    photo = b"balcony photo bytes"
+    first = analyzer.analyze_image_data(photo)
+    second = analyzer.analyze_image_data(base64.b64encode(photo).decode("ascii"))
+
+    assert first == second and first.violence_severity == 2
+    assert analyzer.client.analyze_image.call_count == 1
+    assert analyzer.cache.stats()["namespaces"]["content_safety"]["hits"] == 1
+
+    analyzer.analyze_image_data(b"another photo")
+    assert analyzer.client.analyze_image.call_count == 2
+
+
+def test_api_version_is_part_of_the_key(analyzer):
+    """Test that a verdict from another service version is not reused."""
+    analyzer.analyze_image_data(b"photo")
+    analyzer.api_version = "2099-01-01"
+    analyzer.analyze_image_data(b"photo")
+    assert analyzer.client.analyze_image.call_count == 2
+
+
+def test_text_verdicts_are_cached(analyzer):
+    """Test that analyze_text is cached by the text's hash."""
+    assert analyzer.analyze_text("water twice a week") == analyzer.analyze_text("water twice a week")
+    assert analyzer.client.analyze_text.call_count == 1
+
+
+def test_failed_analysis_is_not_cached(analyzer):
+    """Test that a service error is raised to every caller instead of being remembered."""
+    analyzer.client.analyze_image.side_effect = [RuntimeError("throttled"), severities(ImageCategory)]
+    with pytest.raises(RuntimeError):
+        analyzer.analyze_image_data(b"photo")
+    assert analyzer.analyze_image_data(b"photo").violence_severity == 0
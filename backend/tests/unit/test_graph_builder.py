@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from load_test import StandInLatency, StandInLLM, stand_in_backends
+
+
+class CountingLLM(StandInLLM):
+    """Stand-in chat model that records which prompts it answered."""
+
+    def __init__(self):
+        super().__init__(StandInLatency(blob=0, content_safety=0, llm=0, image=0))
+        self.prompts = []
+
+    def record(self, messages):
+        system_prompt = str(messages[0].content)
+        self.prompts.append(
+            "compliance" if "compliance inspector" in system_prompt
+            else "recommendations" if "botany expert" in system_prompt
+            else "analysis"
+        )
+
+    def invoke(self, messages, *args, **kwargs):
+        self.record(messages)
+        return super().invoke(messages, *args, **kwargs)
+
+    def stream(self, messages, *args, **kwargs):
+        self.record(messages)
+        return super().stream(messages, *args, **kwargs)
+
+
+@pytest.fixture
+def client():
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        yield TestClient(app)
+
+
+def garden_plan_request(grow_type="edible"):
+    return {
+        "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+        "user_preferences": {"growType": grow_type, "cycleType": "annual"},
+        "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+    }
+
+
+def test_replan_only_reruns_nodes_downstream_of_preferences(client):
+    """Test that a preference change skips compliance and garden analysis."""
+    from city_garden import city_garden_nodes
+
+    llm = CountingLLM()
+    # Standard preference profiles are answered from the plant catalog; force the LLM path here
+    with patch.object(city_garden_nodes, "llm", llm), patch.object(city_garden_nodes, "CATALOG_SKIP_LLM", False):
+        response = client.post("/api/garden_plan", json=garden_plan_request())
+        assert response.status_code == 200
+        plan_id = response.json()["plan_id"]
+        assert llm.prompts == ["compliance", "analysis", "recommendations"]
+
+        llm.prompts.clear()
+        response = client.post(f"/api/garden_plan/{plan_id}/replan", json={
+            "user_preferences": {"growType": "ornamental", "cycleType": "perennial"}
+        })
+        assert response.status_code == 200
+        assert response.json()["plan_id"] == plan_id
+        assert llm.prompts == ["recommendations"]
+        assert len(response.json()["plant_images"]) == len(response.json()["plant_recommendations"])
+
+    import api
+    state = api.garden_graph.get_state(api.plan_config(plan_id)).values
+    assert "ornamental" in state["style_preferences"]
+
+
+def test_replan_unknown_plan_returns_404(client):
+    """Test that re-planning a plan without checkpoints is rejected."""
+    response = client.post("/api/garden_plan/does-not-exist/replan", json={"user_preferences": {}})
+    assert response.status_code == 404
+
+
+def test_plan_of_another_worker_returns_409(client):
+    """Test that follow-up requests for a plan this process does not hold are refused, not failed."""
+    import api
+
+    plan_id = client.post("/api/garden_plan", json=garden_plan_request()).json()["plan_id"]
+    # As seen by a worker that did not create the plan: the checkpoints are shared, the session is not
+    with patch.object(api, "_plan_sessions", {}):
+        assert client.post(f"/api/garden_plan/{plan_id}/replan", json={"user_preferences": {}}).status_code == 409
+        assert client.post(f"/api/garden_plan/{plan_id}/resume").status_code == 409
+        assert client.get(f"/api/garden_plan/{plan_id}/status").status_code == 409
+        assert client.delete(f"/api/garden_plan/{plan_id}/refinement").status_code == 409
+    assert client.get(f"/api/garden_plan/{plan_id}/status").status_code == 200
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from city_garden.utils.deadline import DeadlineExceeded, call_timeout, check_deadline, deadline_scope
+from city_garden.utils.hedging import Hedger
+from load_test import StandInLatency, stand_in_backends
+
+
+def warmed_up_hedger(**kwargs):
+    hedger = Hedger("test", percentile=95, min_samples=20, **kwargs)
+    for _ in range(20):
+        hedger.latency.record(0.02)
+    return hedger
+
+
+def test_backup_call_wins_and_slow_primary_is_cancelled():
+    """Test that a stuck primary is hedged after the p95 latency and then cancelled."""
+    hedger = warmed_up_hedger(max_hedge_ratio=1.0)
+    attempts, cancelled = [], []
+
+    async def call():
+        attempt = len(attempts)
+        attempts.append(attempt)
+        try:
+            await asyncio.sleep(5 if attempt == 0 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return attempt
+
+    started = time.monotonic()
+    assert hedger.call(call, timeout=10) == 1
+    assert time.monotonic() - started < 1
+    time.sleep(0.05)
+    assert cancelled == [0]
+    assert hedger.stats()["hedges"] == 1 and hedger.stats()["backup_wins"] == 1
+
+
+def test_hedging_respects_the_ratio_cap_and_timeout():
+    """Test that at most max_hedge_ratio of calls start a backup and the overall timeout holds."""
+    hedger = warmed_up_hedger(max_hedge_ratio=0.25)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    for _ in range(8):
+        hedger.call(slow, timeout=5)
+    assert hedger.stats()["hedges"] <= 2
+
+    async def stuck():
+        await asyncio.sleep(5)
+
+    with pytest.raises(TimeoutError):
+        hedger.call(stuck, timeout=0.1)
+
+
+def test_call_timeout_is_capped_by_the_deadline():
+    """Test that per-call timeouts shrink to the time left and expired deadlines raise."""
+    assert call_timeout(60, "stage") == 60
+    with deadline_scope(1):
+        assert call_timeout(60, "stage") <= 1
+        with deadline_scope(30):
+            assert call_timeout(60, "stage") <= 1
+    with deadline_scope(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            check_deadline("stage")
+
+
+def test_plan_past_its_deadline_returns_504():
+    """Test that the request deadline reaches the graph nodes and fails the plan with 504."""
+    import api
+
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0.2, image=0, jitter=0)) as app, \
+            patch.object(api, "REQUEST_DEADLINE", 0.1):
+        response = TestClient(app).post("/api/garden_plan", json={
+            "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+            "user_preferences": {"growType": "edible"},
+            "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+        })
+
+    assert response.status_code == 504
+    assert "deadline" in response.json()["detail"]
@@ -0,0 +1,59 @@
+from unittest.mock import patch
+
+from azure.core.exceptions import ResourceNotModifiedError
+
+from city_garden.services.image_cache import ImageCache
+from city_garden.services.image_loader import AzureImageLoader
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    """Test that the memory tier stays within its byte budget."""
+    cache = ImageCache(max_memory_bytes=10)
+    cache.put("a", "etag-a", b"1234")
+    cache.put("b", "etag-b", b"1234")
+    assert cache.get("a") is not None  # a becomes most recently used
+    cache.put("c", "etag-c", b"1234")
+
+    assert cache.get("b") is None
+    assert cache.get("a").data == b"1234"
+    assert cache.stats()["memory_bytes"] <= 10
+
+
+def test_disk_tier_survives_restart_and_respects_cap(tmp_path):
+    """Test that disk entries are found by a new cache instance and evicted over the cap."""
+    cache = ImageCache(max_memory_bytes=1024, disk_dir=str(tmp_path), max_disk_bytes=8)
+    cache.put("a", "etag-a", b"aaaa")
+    cache.put("b", "etag-b", b"bbbb")
+
+    restarted = ImageCache(max_memory_bytes=1024, disk_dir=str(tmp_path), max_disk_bytes=8)
+    entry = restarted.get("b")
+    assert entry.data == b"bbbb" and entry.etag == "etag-b"
+
+    restarted.put("c", "etag-c", b"cccc")
+    assert restarted.stats()["disk_bytes"] <= 8
+
+
+@patch("city_garden.services.image_loader.BlobClient")
+def test_loader_ignores_sas_token_and_revalidates_stale_entries(mock_blob_client, monkeypatch):
+    """Test that a rotated SAS token hits the cache and stale entries use a conditional GET."""
+    monkeypatch.setenv("AZURE_STORAGE_ACCOUNT_NAME", "account")
+    monkeypatch.setenv("AZURE_STORAGE_ACCOUNT_KEY", "key")
+    blob_client = mock_blob_client.from_blob_url.return_value
+    blob_client.download_blob.return_value.readall.return_value = b"photo"
+    blob_client.download_blob.return_value.properties.etag = "etag-1"
+
+    cache = ImageCache(fresh_for=60)
+    loader = AzureImageLoader("account", "key", cache=cache)
+    url = "https://account.blob.core.windows.net/uploads/balcony.jpg"
+
+    assert loader.load_image_bytes(f"{url}?sig=first") == b"photo"
+    assert loader.load_image_bytes(f"{url}?sig=rotated") == b"photo"
+    assert blob_client.download_blob.call_count == 1
+
+    # Expire the entry: the next load sends If-None-Match and reuses the bytes on 304
+    cache.fresh_for = 0
+    blob_client.download_blob.side_effect = ResourceNotModifiedError("not modified")
+    assert loader.load_image_bytes(f"{url}?sig=third") == b"photo"
+    _, kwargs = blob_client.download_blob.call_args
+    assert kwargs["etag"] == "etag-1"
+    assert cache.stats()["revalidations"] == 1
@@ -0,0 +1,70 @@
+import base64
+from io import BytesIO
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+from city_garden.services.image_dedup import collapse_near_duplicates, hamming_distance, perceptual_hash
+from load_test import StandInImageLoader, StandInLatency, stand_in_backends
+
+
+def balcony(seed, width=800, height=600):
+    """A structured scene: railing bars and planters whose layout depends on seed."""
+    image = Image.new("RGB", (width, height), (120, 160, 210))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, height * 2 // 3, width, height), fill=(150, 140, 130))
+    for x in range(seed * 17 % 60, width, 60 + seed * 7):
+        draw.rectangle((x, height // 2, x + 8, height), fill=(40, 40, 40))
+    for i in range(3 + seed % 3):
+        x = (i * 211 + seed * 97) % (width - 120)
+        draw.ellipse((x, height // 3, x + 120, height // 3 + 120), fill=(30, 120 + seed * 20 % 100, 40))
+    return image
+
+
+def encode(image, quality=90):
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def test_near_duplicates_collapse_to_the_sharpest_frame():
+    """Test that a blurred, darker re-shot of a view is collapsed into the sharp one."""
+    sharp = encode(balcony(1))
+    blurred = encode(ImageEnhance.Brightness(balcony(1).filter(ImageFilter.GaussianBlur(3))).enhance(0.8), quality=60)
+    other = encode(balcony(4).transpose(Image.FLIP_LEFT_RIGHT))
+
+    assert hamming_distance(perceptual_hash(sharp), perceptual_hash(blurred)) <= 10
+    assert hamming_distance(perceptual_hash(sharp), perceptual_hash(other)) > 10
+
+    result = collapse_near_duplicates([blurred, other, sharp])
+    assert result.kept == [1, 2]
+    assert [(c.index, c.kept_index) for c in result.collapsed] == [(0, 2)]
+
+    assert collapse_near_duplicates([blurred, other, sharp], max_distance=-1).kept == [0, 1, 2]
+
+
+def test_dedup_decision_is_in_the_response():
+    """Test that collapsed photos are reported in image_dedup and never reach the pipeline."""
+    photos = {
+        "sharp": encode(balcony(1)),
+        "soft": encode(balcony(1).filter(ImageFilter.GaussianBlur(2))),
+        "copy": encode(balcony(1)),
+    }
+
+    def load_image(self, url):
+        return base64.b64encode(photos[url.rsplit("/", 1)[-1]]).decode("utf-8")
+
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app, \
+            patch.object(StandInImageLoader, "load_image", load_image):
+        response = TestClient(app).post("/api/garden_plan", json={
+            "image_urls": [f"https://account.blob.core.windows.net/uploads/{name}" for name in ("soft", "sharp", "copy")],
+            "user_preferences": {"growType": "edible"},
+            "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+        })
+
+    assert response.status_code == 200
+    image_dedup = response.json()["image_dedup"]
+    assert image_dedup["uploaded"] == 3
+    assert image_dedup["kept"] == [1]
+    assert [(entry["index"], entry["kept_index"]) for entry in image_dedup["collapsed"]] == [(0, 1), (2, 1)]
@@ -0,0 +1,88 @@
+import base64
+from io import BytesIO
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw
+
+from city_garden.services.image_prescreen import ImagePrescreener, PrescreenRules
+from load_test import StandInContentAnalyzer, StandInImageLoader, StandInLatency, stand_in_backends, stand_in_photo
+
+
+def encode(image, image_format="JPEG"):
+    buffer = BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def screenshot():
+    image = Image.new("RGB", (1080, 1920), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1080, 160), fill=(32, 110, 230))
+    for row in range(20):
+        draw.text((40, 220 + row * 80), "Settings  >  Notifications  >  Sounds", fill="black")
+    return encode(image, "PNG")
+
+
+def test_obvious_failures_are_rejected():
+    """Test that corrupt, tiny, black and unsupported images are rejected locally."""
+    prescreener = ImagePrescreener(PrescreenRules())
+    photo = stand_in_photo("balcony")
+
+    assert prescreener.screen(photo).accepted
+    assert prescreener.screen(photo[: len(photo) // 2]).rejected_by == ["corrupt"]
+    assert prescreener.screen(b"not an image").rejected_by == ["corrupt"]
+    assert "too_small" in prescreener.screen(encode(Image.open(BytesIO(photo)).resize((64, 48)))).rejected_by
+    black = prescreener.screen(encode(Image.new("RGB", (640, 480))))
+    assert {"blank", "too_dark"} <= set(black.rejected_by)
+    assert prescreener.screen(encode(Image.open(BytesIO(photo)), "GIF")).rejected_by == ["format"]
+
+
+def test_screenshots_are_flagged_and_actions_are_configurable(monkeypatch):
+    """Test the screenshot heuristic and that an action override turns a flag into a rejection."""
+    result = ImagePrescreener(PrescreenRules()).screen(screenshot())
+    assert result.accepted and result.flagged_by == ["screenshot"]
+
+    monkeypatch.setenv("CITY_GARDEN_PRESCREEN_ACTIONS", "screenshot=reject")
+    assert ImagePrescreener(PrescreenRules.from_env()).screen(screenshot()).rejected_by == ["screenshot"]
+
+
+def test_request_drops_duplicates_and_counts_saved_calls():
+    """Test that duplicates are dropped and a rejected request counts the paid calls it avoided."""
+    prescreener = ImagePrescreener(PrescreenRules())
+    photo = stand_in_photo("balcony")
+
+    prescreen = prescreener.screen_request([photo, photo, stand_in_photo("other")])
+    assert prescreen.accepted and prescreen.kept == [0, 2]
+
+    prescreen = prescreener.screen_request([photo, encode(Image.new("RGB", (640, 480)))])
+    assert not prescreen.accepted
+
+    stats = prescreener.stats()
+    assert stats["duplicates_dropped"] == 1
+    assert stats["rejected_requests"] == 1
+    assert stats["saved_content_safety_calls"] == 3
+    assert stats["saved_compliance_calls"] == 1
+
+
+def test_api_rejects_before_content_safety():
+    """Test that a blank upload fails the plan without a content-safety call and shows up in metrics."""
+    black = base64.b64encode(encode(Image.new("RGB", (640, 480)))).decode("utf-8")
+    screened = []
+
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app, \
+            patch.object(StandInImageLoader, "load_image", lambda self, url: black), \
+            patch.object(StandInContentAnalyzer, "analyze_image_data", lambda self, data: screened.append(data)):
+        client = TestClient(app)
+        before = client.get("/api/metrics").json()["prescreen"]
+        response = client.post("/api/garden_plan", json={
+            "image_urls": ["https://account.blob.core.windows.net/uploads/black.jpg"],
+            "user_preferences": {"growType": "edible"},
+            "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+        })
+        after = client.get("/api/metrics").json()["prescreen"]
+
+    assert response.status_code == 400
+    assert "pre-screen" in response.json()["detail"]
+    assert screened == []
+    assert after["saved_compliance_calls"] == before["saved_compliance_calls"] + 1
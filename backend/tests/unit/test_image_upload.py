@@ -0,0 +1,132 @@
+import asyncio
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from city_garden.services.asset_store import BlockUpload
+from city_garden.services.image_upload import UploadTooLarge, receive_upload
+from load_test import StandInAssetStore, StandInImageLoader, StandInLatency, stand_in_backends, stand_in_photo
+
+
+@pytest.fixture
+def client():
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        yield TestClient(app)
+
+
+def chunked(body: bytes, size: int = 1024):
+    for position in range(0, len(body), size):
+        yield body[position:position + size]
+
+
+def multipart(payload: bytes, boundary: str = "testboundary") -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="balcony.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+
+
+def test_block_upload_stages_full_blocks_and_commits_in_order():
+    """Test that a streamed blob is staged in fixed-size blocks and committed once."""
+    blob_client = MagicMock(url="https://acct.blob.core.windows.net/uploads/x", blob_name="x")
+    blob_client.commit_block_list.return_value = {"etag": '"0x1"'}
+    upload = BlockUpload(blob_client, block_bytes=4)
+
+    assert not upload.write(b"abc")
+    assert upload.write(b"defghij")
+    upload.stage()
+    assert [call.args[1] for call in blob_client.stage_block.call_args_list] == [b"abcd", b"efgh"]
+
+    assert upload.commit("image/jpeg") == '"0x1"'
+    block_ids = blob_client.commit_block_list.call_args.args[0]
+    assert [call.args[1] for call in blob_client.stage_block.call_args_list][-1] == b"ij"
+    assert block_ids == [call.args[0] for call in blob_client.stage_block.call_args_list]
+    assert len(set(map(len, block_ids))) == 1
+
+
+def test_uploaded_photo_is_planned_from_its_blob(client):
+    """Test that a streamed upload returns a handle the plan reads from the committed blob."""
+    photo = stand_in_photo("upload-test")
+    response = client.post(
+        "/api/uploads",
+        content=chunked(multipart(photo)),
+        headers={"Content-Type": "multipart/form-data; boundary=testboundary"},
+    )
+    assert response.status_code == 200
+    upload = response.json()
+    assert upload["handle"].startswith("upload:")
+    assert upload["size"] == len(photo) and (upload["width"], upload["height"]) == (640, 480)
+    assert upload["content_type"] == "image/jpeg"
+
+    # The photo was streamed through, not kept in memory; the plan downloads it once
+    with patch.object(StandInImageLoader, "load_image", autospec=True, side_effect=StandInImageLoader.load_image) as download:
+        plan = client.post("/api/garden_plan", json={
+            "image_handles": [upload["handle"]],
+            "user_preferences": {"growType": "edible"},
+            "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+        })
+    assert plan.status_code == 200
+    assert plan.json()["image_dedup"]["uploaded"] == 1
+    assert download.call_count == 1 and download.call_args.args[1].endswith(upload["handle"][len("upload:"):])
+
+
+def test_raw_image_body_is_accepted(client):
+    """Test that a photo can be sent as the body itself."""
+    buffer = BytesIO()
+    Image.new("RGB", (300, 200), "green").save(buffer, format="PNG")
+    response = client.post("/api/uploads", content=buffer.getvalue(), headers={"Content-Type": "image/png"})
+    assert response.status_code == 200
+    assert response.json()["content_type"] == "image/png"
+
+
+def test_decompression_bomb_is_rejected(client, monkeypatch):
+    """Test that a photo whose pixel count trips Pillow's bomb check is a 400, not a 500."""
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    buffer = BytesIO()
+    Image.new("RGB", (300, 200), "green").save(buffer, format="PNG")
+    response = client.post("/api/uploads", content=buffer.getvalue(), headers={"Content-Type": "image/png"})
+    assert response.status_code == 400
+    assert "too large to decode" in response.json()["detail"]
+
+
+def test_oversized_upload_stops_streaming():
+    """Test that an upload past the size limit fails before the rest of the body is read."""
+    received = []
+
+    async def body():
+        for chunk in chunked(b"\xff" * 10_000):
+            received.append(chunk)
+            yield chunk
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(receive_upload(body(), "image/jpeg", StandInAssetStore(StandInLatency(blob=0)), max_bytes=2048))
+    assert len(received) == 3
+
+
+def test_rejected_uploads(client):
+    """Test that non-images, oversized bodies and bad handles are refused."""
+    not_an_image = client.post(
+        "/api/uploads",
+        content=multipart(b"plain text"),
+        headers={"Content-Type": "multipart/form-data; boundary=testboundary"},
+    )
+    assert not_an_image.status_code == 400
+
+    wrong_type = client.post("/api/uploads", content=b"{}", headers={"Content-Type": "application/json"})
+    assert wrong_type.status_code == 400
+
+    bad_handle = client.post("/api/garden_plan", json={
+        "image_handles": ["upload:../images/secret"],
+        "user_preferences": {},
+        "location": {"latitude": 0, "longitude": 0, "address": ""},
+    })
+    assert bad_handle.status_code == 400
+    no_images = client.post("/api/garden_plan", json={
+        "user_preferences": {},
+        "location": {"latitude": 0, "longitude": 0, "address": ""},
+    })
+    assert no_images.status_code == 422
@@ -0,0 +1,52 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from city_garden.services.image_variants import encode_variants, resolve_format, upload_variants
+
+
+@pytest.fixture
+def generated_png():
+    """A 1024x1536 PNG shaped like a gpt-image-1 garden image."""
+    buffer = BytesIO()
+    Image.new("RGB", (1024, 1536), (40, 160, 60)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_encode_variants_widths_and_format(generated_png):
+    """Test that each derivative is resized proportionally and re-encoded."""
+    variants = {variant.label: variant for variant in encode_variants(generated_png, image_format="webp")}
+
+    assert set(variants) == {"thumbnail", "card", "full"}
+    assert (variants["thumbnail"].width, variants["thumbnail"].height) == (256, 384)
+    assert (variants["card"].width, variants["card"].height) == (512, 768)
+    assert variants["full"].width == 1024
+    for variant in variants.values():
+        assert variant.content_type == "image/webp"
+        assert Image.open(BytesIO(variant.data)).format == "WEBP"
+    assert len(variants["thumbnail"].data) < len(variants["full"].data)
+
+
+def test_encode_variants_never_upscales(generated_png):
+    """Test that a target width larger than the source keeps the source size."""
+    variants = encode_variants(generated_png, image_format="jpeg", widths={"huge": 4096})
+    assert variants[0].width == 1024
+    assert variants[0].extension == "jpg"
+
+
+def test_resolve_format_rejects_unknown():
+    """Test that unknown formats are rejected."""
+    with pytest.raises(ValueError):
+        resolve_format("gif")
+
+
+def test_upload_variants_returns_srcset_map(generated_png):
+    """Test that every variant is uploaded and mapped by label."""
+    variants = encode_variants(generated_png, image_format="jpeg")
+    srcset = upload_variants(variants, lambda variant: f"https://blob/{variant.label}.{variant.extension}")
+    assert srcset == {
+        "thumbnail": "https://blob/thumbnail.jpg",
+        "card": "https://blob/card.jpg",
+        "full": "https://blob/full.jpg",
+    }
@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from unittest.mock import patch
+
+from city_garden.utils.json_stream import ArrayItemStream
+from load_test import STAND_IN_RECOMMENDATIONS, StandInLatency, StandInLLM
+
+
+def feed_in_chunks(parser, text, size):
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start:start + size]))
+    return items
+
+
+def test_items_are_yielded_as_soon_as_they_are_complete():
+    """Test that each entry comes out with the chunk that closes it, not at the end of the document."""
+    document = json.dumps({"plant_recommendations": [{"id": "0", "name": "Basil"}, {"id": "1", "name": "Mint"}]})
+    parser = ArrayItemStream("plant_recommendations")
+    first_end = document.index("}") + 1
+
+    assert parser.feed(document[:first_end - 1]) == []
+    assert parser.feed(document[first_end - 1:first_end]) == [{"id": "0", "name": "Basil"}]
+    assert parser.feed(document[first_end:]) == [{"id": "1", "name": "Mint"}]
+    assert [item["name"] for item in parser.items] == ["Basil", "Mint"]
+
+
+def test_strings_nesting_and_surrounding_text_do_not_confuse_the_parser():
+    """Test braces and quotes inside strings, nested values, other keys and a Markdown fence."""
+    payload = {
+        "note": "plant_recommendations [not this] {either}",
+        "plant_recommendations": [
+            {"id": "0", "name": 'Basil "Genovese" {sweet}', "tags": [{"sun": "full"}], "care_tips": "a\\b"},
+            {"id": "1", "name": "Thyme", "tags": []},
+        ],
+        "extra": [{"id": "ignored"}],
+    }
+    document = "```json\n" + json.dumps(payload, indent=2) + "\n```"
+    for size in (1, 3, 7, 64):
+        assert feed_in_chunks(ArrayItemStream("plant_recommendations"), document, size) == payload["plant_recommendations"]
+
+
+def test_plant_images_start_while_recommendations_are_still_streaming():
+    """Test that generate_final_output starts plant images before the stream ends and create_plant_images reuses them."""
+    from city_garden import city_garden_nodes
+
+    llm = StandInLLM(StandInLatency(llm=0.3, jitter=0))
+    stream_done = threading.Event()
+    stream = llm.stream
+
+    def tracked_stream(messages, *args, **kwargs):
+        yield from stream(messages, *args, **kwargs)
+        stream_done.set()
+
+    image_calls = []
+
+    def generate(prompt, image_files=None, image_name="garden_image", size="1024x1024", quality="medium"):
+        image_calls.append((image_name, stream_done.is_set()))
+        return {"full": f"https://example.blob.core.windows.net/images/{image_name}.webp"}
+
+    state = {
+        "style_preferences": "preferred grow type: edible",
+        "user_preferences": {"growType": "edible", "cycleType": "annual"},
+        "messages": [],
+    }
+    with patch.object(city_garden_nodes, "llm", type("StreamingLLM", (), {"stream": staticmethod(tracked_stream)})()), \
+            patch.object(city_garden_nodes, "CATALOG_SKIP_LLM", False), \
+            patch.object(city_garden_nodes, "generate_image_variants", generate):
+        state = city_garden_nodes.generate_final_output(state)
+        time.sleep(0.05)
+        started_early = [name for name, after_stream in image_calls if not after_stream]
+        state = city_garden_nodes.create_plant_images(state)
+
+    names = [plant["name"] for plant in json.loads(STAND_IN_RECOMMENDATIONS)["plant_recommendations"]]
+    assert [plant["name"] for plant in state["plant_recommendations"]] == names
+    assert started_early, "no plant image started before the stream finished"
+    assert sorted(name for name, _ in image_calls) == sorted(names)
+    assert [image["name"] for image in state["plant_images"]] == names
+    assert all(image["image_url"].endswith(".webp") for image in state["plant_images"])
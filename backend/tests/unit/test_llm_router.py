@@ -0,0 +1,209 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from city_garden.services.llm_router import CircuitBreaker, LLMRouter, RoutedDeployment
+from city_garden.utils.deadline import deadline_scope
+
+
+class FakeResponse:
+    def __init__(self, content, headers=None):
+        self.content = content
+        self.response_metadata = {"headers": headers or {}}
+
+
+class FakeClient:
+    """Chat model stand-in that answers with its name, or raises the queued errors first."""
+
+    def __init__(self, name, errors=(), headers=None, gate=None):
+        self.name = name
+        self.errors = list(errors)
+        self.headers = headers
+        self.gate = gate
+        self.calls = 0
+        self.callbacks = None
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeResponse(self.name, self.headers)
+
+    async def ainvoke(self, messages, **kwargs):
+        return self.invoke(messages, **kwargs)
+
+
+def status_error(status, headers=None):
+    request = httpx.Request("POST", "https://example.openai.azure.com/chat/completions")
+    response = httpx.Response(status, request=request, headers=headers or {})
+    error_class = openai.RateLimitError if status == 429 else openai.InternalServerError if status >= 500 else openai.BadRequestError
+    return error_class("upstream error", response=response, body=None)
+
+
+def test_calls_go_to_least_loaded_deployment_by_weight():
+    """Test that concurrent calls are spread by outstanding requests per unit of weight."""
+    gate = threading.Event()
+    big = FakeClient("big", gate=gate)
+    small = FakeClient("small", gate=gate)
+    router = LLMRouter([RoutedDeployment("big", big, weight=2), RoutedDeployment("small", small, weight=1)])
+
+    threads = [threading.Thread(target=router.invoke, args=(["hi"],)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while sum(d.state.outstanding for d in router.deployments) < 3:
+        pass
+    gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert (big.calls, small.calls) == (2, 1)
+    assert all(d.state.outstanding == 0 for d in router.deployments)
+
+
+def test_rate_limited_deployment_fails_over_and_is_skipped_for_its_retry_after():
+    """Test that a 429 is retried on another deployment and the limited one is skipped without opening its circuit."""
+    limited = FakeClient("limited", errors=[status_error(429, {"retry-after": "20"})])
+    spare = FakeClient("spare")
+    router = LLMRouter([RoutedDeployment("limited", limited), RoutedDeployment("spare", spare)])
+
+    assert router.invoke(["hi"]).content == "spare"
+    stats = router.stats()["limited"]
+    assert stats["circuit"] == "closed" and stats["throttled_seconds"] > 19
+    assert router.invoke(["hi"]).content == "spare"
+    assert limited.calls == 1
+
+
+def test_single_rate_limited_deployment_waits_for_retry_after():
+    """Test that with one deployment a 429 delays the call by its Retry-After instead of failing it or later calls."""
+    only = FakeClient("only", errors=[status_error(429, {"retry-after-ms": "200"})])
+    router = LLMRouter([RoutedDeployment("only", only)])
+
+    started = time.monotonic()
+    assert router.invoke(["hi"]).content == "only"
+    assert time.monotonic() - started >= 0.2
+    assert router.invoke(["hi"]).content == "only"
+    assert router.stats()["only"]["circuit"] == "closed"
+
+    # Waiting past the request's deadline is no use: the 429 surfaces instead
+    only.errors = [status_error(429, {"retry-after": "5"})]
+    with deadline_scope(1), pytest.raises(openai.RateLimitError):
+        router.invoke(["hi"])
+
+
+def test_server_errors_open_circuit_after_threshold_and_half_open_trial_closes_it():
+    """Test the closed -> open -> half-open -> closed cycle on repeated 5xx answers."""
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.2)
+    flaky = FakeClient("flaky", errors=[status_error(503), status_error(503)])
+    router = LLMRouter([RoutedDeployment("flaky", flaky, breaker=breaker), RoutedDeployment("spare", FakeClient("spare"))])
+
+    router.invoke(["hi"])
+    assert breaker.state == "closed"
+    # Make spare look busy so the next call goes to flaky again
+    router.deployments[1].state.outstanding = 5
+    router.invoke(["hi"])
+    assert breaker.state == "open"
+
+    time.sleep(0.25)
+    assert breaker.state == "half_open"
+    assert router.invoke(["hi"]).content == "flaky"
+    assert breaker.state == "closed"
+
+
+def test_remaining_quota_from_headers_steers_calls():
+    """Test that a deployment reporting exhausted quota is only used when nothing else is left."""
+    drained = FakeClient("drained", headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-remaining-tokens": "150"})
+    fresh = FakeClient("fresh", headers={"x-ratelimit-remaining-requests": "500", "x-ratelimit-remaining-tokens": "90000"})
+    router = LLMRouter([RoutedDeployment("drained", drained), RoutedDeployment("fresh", fresh)])
+
+    router.invoke(["hi"])
+    router.invoke(["hi"])
+    stats = router.stats()
+    assert stats["drained"]["remaining_requests"] == 0
+    assert stats["fresh"]["remaining_tokens"] == 90000
+    assert router.invoke(["hi"]).content == "fresh"
+    assert router.invoke(["hi"]).content == "fresh"
+
+
+def test_non_retryable_error_is_raised_without_failover():
+    """Test that a bad request is the caller's problem and is not retried elsewhere."""
+    bad = FakeClient("bad", errors=[status_error(400)])
+    spare = FakeClient("spare")
+    router = LLMRouter([RoutedDeployment("bad", bad), RoutedDeployment("spare", spare)])
+    router.deployments[1].state.outstanding = 1
+
+    with pytest.raises(openai.BadRequestError):
+        router.invoke(["hi"])
+    assert spare.calls == 0
+
+
+def test_repeated_bad_requests_keep_the_circuit_closed():
+    """Test that 400s on user input neither count as deployment failures nor open the circuit."""
+    router = LLMRouter([RoutedDeployment("only", FakeClient("only", errors=[status_error(400)] * 4))])
+
+    for _ in range(4):
+        with pytest.raises(openai.BadRequestError):
+            router.invoke(["hi"])
+    assert router.invoke(["hi"]).content == "only"
+    stats = router.stats()["only"]
+    assert (stats["circuit"], stats["failures"], stats["outstanding"]) == ("closed", 0, 0)
+
+
+def test_async_failover_and_all_deployments_down():
+    """Test failover through ainvoke, and that the last error surfaces when every deployment fails."""
+    router = LLMRouter([
+        RoutedDeployment("a", FakeClient("a", errors=[status_error(500)])),
+        RoutedDeployment("b", FakeClient("b")),
+    ])
+    assert asyncio.run(router.ainvoke(["hi"])).content == "b"
+
+    down = LLMRouter([
+        RoutedDeployment("a", FakeClient("a", errors=[status_error(500)]), breaker=CircuitBreaker(failure_threshold=1)),
+        RoutedDeployment("b", FakeClient("b", errors=[status_error(500)]), breaker=CircuitBreaker(failure_threshold=1)),
+    ])
+    with pytest.raises(openai.InternalServerError):
+        down.invoke(["hi"])
+    # The last deployment still taking calls keeps its circuit closed
+    assert sorted(stats["circuit"] for stats in down.stats().values()) == ["closed", "open"]
+    assert down.invoke(["hi"]).content == "b"
+
+
+class StreamingClient(FakeClient):
+    def __init__(self, name, errors=(), break_after_first=False):
+        super().__init__(name, errors)
+        self.break_after_first = break_after_first
+
+    def stream(self, messages, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        for token in ("hel", "lo"):
+            yield FakeResponse(token)
+            if self.break_after_first:
+                raise status_error(503)
+
+
+def test_stream_fails_over_before_the_first_chunk_only():
+    """Test that a stream is retried elsewhere when nothing was sent yet, but a broken stream is raised."""
+    router = LLMRouter([
+        RoutedDeployment("a", StreamingClient("a", errors=[status_error(503)])),
+        RoutedDeployment("b", StreamingClient("b")),
+    ])
+    assert "".join(chunk.content for chunk in router.stream(["hi"])) == "hello"
+    assert router.stats()["a"]["failures"] == 1
+
+    broken = LLMRouter([
+        RoutedDeployment("a", StreamingClient("a", break_after_first=True)),
+        RoutedDeployment("b", StreamingClient("b")),
+    ])
+    chunks = []
+    with pytest.raises(openai.InternalServerError):
+        for chunk in broken.stream(["hi"]):
+            chunks.append(chunk.content)
+    assert chunks == ["hel"]
+    assert broken.deployments[1].client.calls == 0
@@ -0,0 +1,34 @@
+import asyncio
+
+import httpx
+
+from load_test import LoadTestConfig, StandInLatency, percentile, run_load_test, stand_in_backends
+
+
+def test_percentile_interpolates():
+    """Test linear interpolation between ranks."""
+    values = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4.0
+    assert percentile([], 99) == 0.0
+
+
+def test_run_load_test_against_stand_ins():
+    """Test a short open-loop run against the in-process app."""
+    config = LoadTestConfig(rate=20, duration=0.25, repeat_ratio=0.5, seed=7)
+    latency = StandInLatency(blob=0, content_safety=0, llm=0, image=0)
+
+    async def run():
+        with stand_in_backends(latency) as app:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+                return await run_load_test(client, config)
+
+    report = asyncio.run(run())
+
+    assert report.requests > 0
+    assert report.failed == 0
+    assert report.status_codes == {"200": report.requests}
+    assert report.latency_p50 <= report.latency_p99 <= report.latency_max
+    assert set(report.latency_by_image_count) <= {"1", "2", "3"}
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from city_garden.utils.multipart_stream import MultipartError, MultipartFileStream, parse_boundary
+
+
+BOUNDARY = b"----boundary7MA4YWxkTrZu0gW"
+
+
+def multipart_body(payload: bytes) -> bytes:
+    return (
+        b"--" + BOUNDARY + b"\r\n"
+        b'Content-Disposition: form-data; name="note"\r\n\r\n'
+        b"balcony\r\n"
+        b"--" + BOUNDARY + b"\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="balcony.jpg"\r\n'
+        b"Content-Type: image/jpeg\r\n\r\n"
+        + payload +
+        b"\r\n--" + BOUNDARY + b"--\r\n"
+    )
+
+
+def test_parse_boundary():
+    """Test that the boundary is read from a multipart Content-Type only."""
+    assert parse_boundary('multipart/form-data; boundary="abc"') == b"abc"
+    assert parse_boundary("multipart/form-data; charset=utf-8; boundary=xyz") == b"xyz"
+    assert parse_boundary("image/jpeg") is None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_file_field_survives_any_chunking(seed):
+    """Test that the file's bytes are extracted exactly, however the body is split."""
+    rng = random.Random(seed)
+    # Include bytes that look like the start of a delimiter
+    payload = rng.randbytes(5000) + b"\r\n--" + BOUNDARY[:10] + rng.randbytes(100)
+    body = multipart_body(payload)
+
+    stream = MultipartFileStream(BOUNDARY)
+    extracted = bytearray()
+    position = 0
+    while position < len(body):
+        size = rng.randint(1, 300)
+        extracted += stream.feed(body[position:position + size])
+        position += size
+
+    assert bytes(extracted) == payload
+    assert stream.complete
+    assert stream.filename == "balcony.jpg" and stream.content_type == "image/jpeg"
+
+
+def test_missing_field_is_not_complete():
+    """Test that a body without the field yields nothing."""
+    stream = MultipartFileStream(BOUNDARY, field="photo")
+    assert stream.feed(multipart_body(b"data")) == b""
+    assert not stream.complete
+
+
+def test_malformed_headers_are_rejected():
+    """Test that a part header without a colon fails the upload."""
+    stream = MultipartFileStream(BOUNDARY)
+    with pytest.raises(MultipartError):
+        stream.feed(b"--" + BOUNDARY + b"\r\nnot a header\r\n\r\ndata")
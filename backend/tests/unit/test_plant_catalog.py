@@ -0,0 +1,117 @@
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from city_garden.services.plant_catalog import PlantCatalog, SuitabilityQuery, get_plant_catalog
+from load_test import StandInLatency, stand_in_backends
+
+
+def test_bundled_catalog_ranks_by_site_and_preferences():
+    """Test that a shady, windy site with a cold winter favours hardy shade plants."""
+    catalog = get_plant_catalog()
+    query = SuitabilityQuery.from_state({
+        "sun_exposure": "North-facing, mostly shade",
+        "wind_pattern": "Strong gusts on the upper floors",
+        "climate_profile": {"coldest_month_c": -2.0, "warmest_month_c": 19.0},
+        "user_preferences": {"growType": "ornamental", "subType": "foliage", "cycleType": "perennial", "winterType": "outdoors"},
+    })
+    assert query.sun_level == 0 and query.wind_level == 2
+
+    ranked = catalog.rank(query, top_k=5)
+    assert [plant.score for plant in ranked] == sorted((plant.score for plant in ranked), reverse=True)
+    for plant in ranked:
+        assert catalog.category[plant.index] == "ornamental"
+        assert catalog.cycle[plant.index] == "perennial"
+    assert ranked[0].name in {"English Ivy", "Boxwood"}
+
+
+def test_exposure_text_reads_negations_before_compass_words():
+    """Test that negated and partial exposure phrases win over full-sun phrases and the balcony's facing."""
+    def levels(sun_exposure, wind_pattern=None):
+        query = SuitabilityQuery.from_state({"sun_exposure": sun_exposure, "wind_pattern": wind_pattern})
+        return query.sun_level, query.wind_level
+
+    assert levels("No direct sunlight, north-facing")[0] == 0
+    assert levels("Partial shade in the afternoon, south-west facing")[0] == 1
+    assert levels("Full sun for most of the day")[0] == 2
+    assert levels("South-facing balcony")[0] == 2
+    assert levels("North-facing balcony")[0] == 0
+    assert levels("Below the roofline, yellow walls", "Sheltered from strong winds by the building below")[1] == 0
+    assert levels(None, "Exposed to yellow-flagged gusts")[1] == 2
+    assert levels(None, "Winds below average")[1] is None
+
+
+def test_unreadable_site_is_not_a_standard_profile():
+    """Test that the catalog only answers alone when it could read the site's sun and wind exposure."""
+    state = {
+        "sun_exposure": "North-facing, mostly shade",
+        "wind_pattern": "Strong gusts on the upper floors",
+        "climate_profile": {"coldest_month_c": -2.0, "warmest_month_c": 19.0},
+        "user_preferences": {"growType": "edible", "subType": "herbs", "cycleType": "annual"},
+    }
+    assert SuitabilityQuery.from_state(state).is_standard_profile()
+    assert not SuitabilityQuery.from_state({**state, "sun_exposure": "Hard to tell from the photos"}).is_standard_profile()
+    assert not SuitabilityQuery.from_state({**state, "wind_pattern": None}).is_standard_profile()
+
+
+def test_hard_preferences_exclude_species():
+    """Test that grow type and cycle are hard filters, and tender perennials drop in cold climates."""
+    catalog = get_plant_catalog()
+    query = SuitabilityQuery(grow_type="edible", cycle_type="perennial", winter_type="outdoors", coldest_month_c=-3.0)
+    names = [plant.name for plant in catalog.rank(query, top_k=len(catalog))]
+
+    assert "Basil" not in names and "Lavender" not in names
+    assert names.index("Chives") < names.index("Meyer Lemon")
+
+
+def test_rank_scales_to_large_catalogs():
+    """Test that ranking ten thousand species stays in the millisecond range."""
+    rng = np.random.default_rng(0)
+    n = 10_000
+    catalog = PlantCatalog.from_records([
+        {
+            "name": f"plant-{i}",
+            "category": rng.choice(["edible", "ornamental"]),
+            "subtype": rng.choice(["herbs", "vegetables", "fruits", "foliage", "flowering"]),
+            "cycle": rng.choice(["annual", "perennial"]),
+            "min_temp_c": rng.uniform(-35, 10),
+            "max_temp_c": rng.uniform(25, 40),
+            "sun_min": rng.integers(0, 2),
+            "sun_max": 2,
+            "wind_tolerance": rng.integers(0, 3),
+            "container": rng.uniform(0.3, 1),
+            "winter_indoors": rng.integers(0, 2),
+        }
+        for i in range(n)
+    ])
+    query = SuitabilityQuery(sun_level=1, wind_level=1, coldest_month_c=0.0, warmest_month_c=20.0,
+                             grow_type="both", sub_type="herbs", cycle_type="perennial", winter_type="indoors")
+
+    catalog.rank(query)
+    started = time.perf_counter()
+    ranked = catalog.rank(query, top_k=8)
+    assert time.perf_counter() - started < 0.05
+    assert len(ranked) == 8
+
+
+def test_standard_profile_is_answered_without_the_llm():
+    """Test that a confident catalog match skips the recommendation prompt entirely."""
+    from city_garden import city_garden_nodes
+
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        response = TestClient(app).post("/api/garden_plan", json={
+            "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+            "user_preferences": {"growType": "edible", "subType": "herbs", "cycleType": "annual"},
+            "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+        })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["recommendation_source"] == "catalog"
+    catalog = get_plant_catalog()
+    names = list(catalog.names)
+    for plant in body["plant_recommendations"]:
+        assert catalog.category[names.index(plant["name"])] == "edible"
+        assert plant["care_tips"]
+    assert len(body["plant_recommendations"]) >= city_garden_nodes.CATALOG_MIN_CONFIDENT
@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from fastapi.testclient import TestClient
+
+from city_garden.utils import profiling
+from city_garden.utils.profiling import SamplingProfiler, sampled_thread
+from load_test import StandInLatency, stand_in_backends
+
+PLAN_REQUEST = {
+    "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+    "user_preferences": {"growType": "edible"},
+    "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+}
+
+
+def busy_garden_work(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(1000))
+
+
+def idle_bystander(stop):
+    stop.wait(5)
+
+
+def test_session_samples_only_threads_working_for_the_request(tmp_path):
+    """Test that stacks of sampled threads are folded into the profile while other threads are left out."""
+    profiler = SamplingProfiler(str(tmp_path), interval=0.001)
+    stop = threading.Event()
+    bystander = threading.Thread(target=idle_bystander, args=(stop,))
+    bystander.start()
+    try:
+        with profiler.session("request-1") as session, ThreadPoolExecutor(max_workers=1) as pool:
+            def work():
+                with sampled_thread():
+                    busy_garden_work(0.1)
+            pool.submit(copy_context().run, work).result()
+    finally:
+        stop.set()
+        bystander.join()
+
+    assert session.closed
+    assert profiling.current_session() is None
+    folded = profiler.load("request-1") if profiler.finish(session) else ""
+    lines = folded.splitlines()
+    assert lines and all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+    assert any("busy_garden_work" in line for line in lines)
+    assert "idle_bystander" not in folded
+    assert profiler.stats() == {"active": 0, "profiled": 1, "skipped": 0}
+
+
+def test_concurrent_sessions_are_capped(tmp_path):
+    """Test that requests beyond max_sessions run unprofiled and nothing is written without samples."""
+    profiler = SamplingProfiler(str(tmp_path), max_sessions=1)
+    with profiler.session("first") as first, profiler.session("second") as second:
+        assert first is not None and second is None
+    assert profiler.finish(first) is None
+    assert profiler.stats()["skipped"] == 1
+
+
+def test_profile_token_forces_a_profile_of_the_request(monkeypatch, tmp_path):
+    """Test that a request with the configured token is profiled and its folded stacks are served."""
+    monkeypatch.setattr(profiling, "_profiler", SamplingProfiler(str(tmp_path), token="s3cret", interval=0.001))
+    with stand_in_backends(StandInLatency(blob=0.05, content_safety=0.05, llm=0.05, image=0.05)) as app:
+        client = TestClient(app)
+        unprofiled = client.post("/api/garden_plan", json=PLAN_REQUEST, headers={"X-Profile-Token": "wrong"})
+        assert "X-Profile-ID" not in unprofiled.headers
+
+        response = client.post("/api/garden_plan", json=PLAN_REQUEST, headers={"X-Profile-Token": "s3cret"})
+        assert response.status_code == 200
+        assert response.headers["X-Profile-ID"] == response.headers["X-Trace-ID"]
+
+        folded = client.get(f"/api/debug/profiles/{response.headers['X-Profile-ID']}").text
+        assert "run_garden_plan" in folded
+        assert "create_garden_image" in folded
+        assert client.get("/api/debug/profiles/..%2Funknown").status_code == 404
+        assert client.get("/api/metrics").json()["profiler"]["profiled"] == 1
@@ -29,4 +29,18 @@ def test_load_prompt_invalid_key():
 def test_load_prompt_invalid_yaml():
     """Test that loading an invalid YAML file raises an exception."""
     with pytest.raises(Exception):
-        load_prompt('invalid.yml', 'test_key') 
\ No newline at end of file
+        load_prompt('invalid.yml', 'test_key')
+
+
+def test_preload_prompts_parses_every_file_once(monkeypatch):
+    """Test that preloaded prompt files are served from memory afterwards."""
+    from src.city_garden.utils import prompt_loader
+
+    loaded = prompt_loader.preload_prompts()
+    assert 'plant_recommender.yml' in loaded
+
+    def fail_open(*args, **kwargs):
+        raise AssertionError("prompt file read again")
+
+    monkeypatch.setattr("builtins.open", fail_open)
+    assert "You are a botany expert" in prompt_loader.load_prompt('plant_recommender.yml', 'plant_recommender_en')
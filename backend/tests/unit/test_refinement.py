@@ -0,0 +1,90 @@
+import threading
+import time
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from city_garden.utils.refinement import CANCELLED, DONE, RUNNING, SKIPPED, Refinements
+from load_test import StandInLatency, _StandInImages, stand_in_backends
+
+
+def wait_for(refinements, key, statuses, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while refinements.get(key).status not in statuses:
+        assert time.monotonic() < deadline, refinements.get(key).status
+        time.sleep(0.01)
+    return refinements.get(key)
+
+
+def test_refinement_result_is_kept_until_released():
+    """Test that a finished refinement's result can be read until its key is released."""
+    refinements = Refinements(max_workers=1)
+    refinements.start("plan-1", lambda: {"full": "https://example.com/final.webp"})
+
+    assert wait_for(refinements, "plan-1", (DONE,)).result == {"full": "https://example.com/final.webp"}
+    refinements.release("plan-1")
+    assert refinements.get("plan-1") is None
+    assert refinements.stats()["done"] == 1
+
+
+def test_queued_refinement_is_skipped_when_the_client_is_gone():
+    """Test that a refinement nobody polled for while it was queued never runs."""
+    refinements = Refinements(max_workers=1, abandon_after=0.05)
+    busy = threading.Event()
+    calls = []
+    refinements.start("busy", busy.wait)
+    refinements.start("plan-1", lambda: calls.append("rendered"))
+    time.sleep(0.1)
+    busy.set()
+
+    assert wait_for(refinements, "plan-1", (SKIPPED,)).status == SKIPPED
+    assert calls == []
+
+
+def test_cancel_drops_a_running_refinement_and_start_supersedes():
+    """Test that a cancelled or superseded refinement's result is never used."""
+    refinements = Refinements(max_workers=2)
+    release = threading.Event()
+    refinements.start("plan-1", lambda: release.wait() and {"full": "stale"})
+    wait_for(refinements, "plan-1", (RUNNING,))
+
+    assert refinements.cancel("plan-1").status == CANCELLED
+    release.set()
+    time.sleep(0.05)
+    assert refinements.get("plan-1").result is None
+
+    refinements.start("plan-1", lambda: {"full": "fresh"})
+    assert wait_for(refinements, "plan-1", (DONE,)).result == {"full": "fresh"}
+
+
+def test_plan_returns_a_preview_then_status_serves_the_refined_image():
+    """Test that a plan answers with a low-quality preview and the status endpoint swaps in the full render."""
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        client = TestClient(app)
+        with patch.object(_StandInImages, "edit", autospec=True, side_effect=_StandInImages.edit) as edit:
+            response = client.post("/api/garden_plan", json={
+                "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+                "user_preferences": {"growType": "edible"},
+                "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+            })
+            assert response.status_code == 200
+            plan = response.json()
+            assert plan["garden_image_quality"] in ("preview", "final")
+
+            deadline = time.monotonic() + 5
+            while True:
+                status = client.get(f"/api/garden_plan/{plan['plan_id']}/status").json()
+                if status["garden_image_refinement"] == DONE or time.monotonic() > deadline:
+                    break
+                time.sleep(0.01)
+
+        assert status["garden_image_quality"] == "final"
+        assert status["garden_image_srcset"]["full"] == status["garden_image_url"]
+        qualities = [call.kwargs["quality"] for call in edit.call_args_list]
+        assert qualities == ["low", "medium"]
+
+        response = client.delete(f"/api/garden_plan/{plan['plan_id']}/refinement")
+        assert response.status_code == 200
+        # Cancelling after the fact keeps the refined image
+        assert response.json()["garden_image_refinement"] == DONE
+        assert client.delete("/api/garden_plan/unknown/refinement").status_code == 404
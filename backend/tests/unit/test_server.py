@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+import uvicorn
+
+from server import WorkerServer, rss_mb
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "src")
+
+
+async def empty_app(scope, receive, send):
+    pass
+
+
+def test_worker_retires_when_memory_exceeds_limit():
+    """Test that a worker's tick asks uvicorn to exit once resident memory is over the limit."""
+    config = uvicorn.Config(empty_app, log_config=None)
+    config.load()
+    assert rss_mb() > 1
+
+    assert asyncio.run(WorkerServer(config, max_memory_mb=0).on_tick(0)) is False
+    assert asyncio.run(WorkerServer(config, max_memory_mb=rss_mb() * 10).on_tick(0)) is False
+    assert asyncio.run(WorkerServer(config, max_memory_mb=1).on_tick(0)) is True
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def worker_pid(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/metrics", timeout=10) as response:
+        return json.load(response)["worker"]["pid"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-fork server needs os.fork")
+def test_supervisor_recycles_workers_and_stops_on_sigterm():
+    """Test that workers are replaced after max requests and that SIGTERM drains and stops the server."""
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port), "--workers", "2",
+         "--max-requests", "2", "--max-requests-jitter", "0", "--drain-seconds", "2"],
+        cwd=SRC_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                first = worker_pid(port)
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise
+                time.sleep(0.2)
+
+        pids = {first}
+        for _ in range(7):
+            # uvicorn checks the request limit on its 0.1s tick
+            time.sleep(0.15)
+            pids.add(worker_pid(port))
+        # Two workers serving at most two requests each cannot answer eight requests alone
+        assert len(pids) > 2
+
+        server.send_signal(signal.SIGTERM)
+        assert server.wait(timeout=20) == 0
+    finally:
+        if server.poll() is None:
+            server.kill()
@@ -0,0 +1,69 @@
+import threading
+import time
+
+import pytest
+
+from city_garden.utils.deadline import DeadlineExceeded, deadline_scope
+from city_garden.utils.shared_work import SharedWork
+
+
+def test_waiter_takes_over_when_the_owner_runs_out_of_time():
+    """Test that the owner's own deadline does not fail the waiters; one of them computes instead."""
+    shared_work = SharedWork()
+    started = threading.Event()
+    results = []
+
+    def slow_owner():
+        started.set()
+        time.sleep(0.05)
+        raise DeadlineExceeded("owner deadline")
+
+    def owner():
+        with pytest.raises(DeadlineExceeded):
+            shared_work.get_or_compute("photo", slow_owner)
+
+    def waiter():
+        started.wait(5)
+        results.append(shared_work.get_or_compute("photo", lambda: "screened"))
+
+    threads = [threading.Thread(target=owner)] + [threading.Thread(target=waiter) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["screened", "screened"]
+    assert shared_work.stats()["misses"] == 2
+
+
+def test_waiter_gives_up_at_its_own_deadline_and_sees_real_failures():
+    """Test that a waiter stops waiting at its own deadline, and that failures of the work itself are shared."""
+    shared_work = SharedWork()
+    started, release = threading.Event(), threading.Event()
+
+    def blocked():
+        started.set()
+        release.wait(5)
+        raise ValueError("bad photo")
+
+    outcome = []
+
+    def attempt(compute):
+        try:
+            shared_work.get_or_compute("photo", compute)
+        except ValueError as e:
+            outcome.append(str(e))
+
+    owner = threading.Thread(target=attempt, args=(blocked,))
+    owner.start()
+    started.wait(5)
+    with deadline_scope(0.05), pytest.raises(DeadlineExceeded):
+        shared_work.get_or_compute("photo", lambda: "unused")
+
+    waiter = threading.Thread(target=attempt, args=(lambda: "unused",))
+    waiter.start()
+    time.sleep(0.02)
+    release.set()
+    owner.join()
+    waiter.join()
+    assert outcome == ["bad photo", "bad photo"]
@@ -0,0 +1,79 @@
+import io
+import json
+import logging
+
+from city_garden.utils import structured_logging
+from city_garden.utils.structured_logging import (
+    JsonFormatter, RequestContextFilter, cap, configure_logging, fields, request_context
+)
+
+
+def test_cap_bounds_large_payloads():
+    """Test that strings and containers are capped to the field limit."""
+    assert cap("short") == "short"
+    capped = cap("x" * 10000, limit=100)
+    assert capped.startswith("x" * 100)
+    assert capped.endswith("(+9900 chars)")
+    assert len(cap(list(range(100000)))) < 200
+    assert cap(3) == "3"
+
+
+def test_fields_caps_every_value():
+    """Test that fields() wraps capped values for the `extra` argument."""
+    extra = fields(response="y" * 5000, count=2)
+    assert extra["fields"]["count"] == "2"
+    assert len(extra["fields"]["response"]) < 600
+
+
+def test_json_formatter_includes_request_id():
+    """Test that the request id bound to the context ends up in the JSON line."""
+    record = logging.LogRecord("city_garden", logging.INFO, __file__, 1, "hello", None, None)
+    record.fields = {"images": "2"}
+    with request_context("req-123"):
+        assert RequestContextFilter().filter(record)
+    payload = json.loads(JsonFormatter().format(record))
+    assert payload["msg"] == "hello"
+    assert payload["request_id"] == "req-123"
+    assert payload["images"] == "2"
+
+
+def test_debug_sampling_is_per_request(monkeypatch):
+    """Test that DEBUG records are kept or dropped consistently for a request."""
+    monkeypatch.setattr(structured_logging, "_debug_sample_rate", 0.5)
+    log_filter = RequestContextFilter()
+
+    def keep(request_id):
+        record = logging.LogRecord("city_garden", logging.DEBUG, __file__, 1, "debug", None, None)
+        with request_context(request_id):
+            return log_filter.filter(record)
+
+    decisions = {request_id: keep(request_id) for request_id in (f"req-{i}" for i in range(200))}
+    assert all(keep(request_id) == kept for request_id, kept in decisions.items())
+    assert 0 < sum(decisions.values()) < 200
+
+    monkeypatch.setattr(structured_logging, "_debug_sample_rate", 0.0)
+    assert not keep("req-1")
+
+
+def test_exception_is_a_capped_field_through_the_queue():
+    """Test that a logged traceback reaches the JSON line as a capped exc field, not inside msg."""
+    configure_logging(level="INFO", fmt="json")
+    listener = structured_logging._listener
+    handler = listener.handlers[0]
+    output = io.StringIO()
+    previous = handler.setStream(output)
+    try:
+        try:
+            raise ValueError("bad garden " + "x" * 10000)
+        except ValueError:
+            logging.getLogger("city_garden.test").exception("Plan %s failed", "plan-1")
+        # Stopping the listener writes out everything queued so far
+        listener.stop()
+    finally:
+        handler.setStream(previous)
+        listener.start()
+
+    payload = json.loads(output.getvalue().splitlines()[-1])
+    assert payload["msg"] == "Plan plan-1 failed"
+    assert payload["exc"].startswith("Traceback") and "ValueError: bad garden" in payload["exc"]
+    assert len(payload["exc"]) < structured_logging.EXC_LIMIT + 50
@@ -0,0 +1,84 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.testclient import TestClient
+
+from city_garden.utils.structured_logging import request_context
+from city_garden.utils.tracing import is_trace_id, render_waterfall, span
+from load_test import StandInLatency, stand_in_backends
+
+
+def test_spans_nest_across_threads_under_one_trace(trace_exporter):
+    """Test that child spans started in worker threads keep their parent and the root's trace id."""
+    with request_context("req-1"):
+        with span("root") as root:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, _child, index) for index in range(2)]
+                threads = {future.result() for future in futures}
+
+    spans = trace_exporter.load(root.trace_id)
+    by_name = {record["name"]: record for record in spans}
+    assert set(by_name) == {"root", "child-0", "child-1"}
+    assert by_name["root"]["attributes"] == {"request_id": "req-1"}
+    assert by_name["child-0"]["parent_id"] == root.span_id
+    assert by_name["child-0"]["thread"] in threads and by_name["root"]["thread"] not in threads
+    assert by_name["child-1"]["attributes"] == {"index": "1"}
+
+
+def _child(index):
+    with span(f"child-{index}", index=index):
+        return threading.current_thread().name
+
+
+def test_failed_span_records_the_error_and_client_ids_never_name_traces(trace_exporter):
+    """Test that an exception is recorded on its span and client request ids are only an attribute."""
+    with request_context("../../etc/passwd"):
+        try:
+            with span("upload") as upload:
+                raise OSError("disk full")
+        except OSError:
+            pass
+
+    assert is_trace_id(upload.trace_id)
+    assert trace_exporter.load("../../etc/passwd") == []
+    [record] = trace_exporter.load(upload.trace_id)
+    assert record["attributes"]["request_id"] == "../../etc/passwd"
+    assert record["error"] == "OSError: disk full"
+    assert "#d9534f" in render_waterfall([record])
+
+
+def test_plan_trace_covers_loading_nodes_and_uploads(trace_exporter):
+    """Test that a plan's trace has spans for image loading, content safety, every node and each blob upload."""
+    with stand_in_backends(StandInLatency(blob=0, content_safety=0, llm=0, image=0)) as app:
+        client = TestClient(app)
+        response = client.post("/api/garden_plan", headers={"X-Request-ID": "plan-trace"}, json={
+            "image_urls": ["https://account.blob.core.windows.net/uploads/balcony.jpg"],
+            "user_preferences": {"growType": "edible"},
+            "location": {"latitude": 52.52, "longitude": 13.405, "address": "Berlin, Germany"},
+        })
+        assert response.status_code == 200
+        trace_id = response.headers["X-Trace-ID"]
+
+        spans = client.get(f"/api/debug/traces/{trace_id}", params={"format": "json"}).json()["spans"]
+        names = [record["name"] for record in spans]
+        for expected in ("POST /api/garden_plan", "load_images", "load_image", "content_safety", "graph",
+                         "node:check_compliance", "node:create_garden_image", "node:create_plant_images",
+                         "generate_image", "blob_upload"):
+            assert expected in names, expected
+        by_id = {record["span_id"]: record for record in spans}
+        upload = next(record for record in spans if record["name"] == "blob_upload")
+        assert by_id[upload["parent_id"]]["name"] == "generate_image"
+        assert [record for record in spans if record["parent_id"] is None] == [
+            record for record in spans if record["name"] == "POST /api/garden_plan"
+        ]
+
+        page = client.get(f"/api/debug/traces/{trace_id}")
+        assert page.headers["content-type"].startswith("text/html")
+        assert "node:create_garden_image" in page.text
+        assert client.get("/api/debug/traces/plan-trace").status_code == 404
+
+        # A reused request id starts a trace of its own
+        again = client.get("/api/metrics", headers={"X-Request-ID": "plan-trace"})
+        assert again.headers["X-Request-ID"] == "plan-trace" and again.headers["X-Trace-ID"] != trace_id
+        assert len(client.get(f"/api/debug/traces/{trace_id}", params={"format": "json"}).json()["spans"]) == len(spans)